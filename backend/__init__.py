@@ -0,0 +1,7 @@
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# Settings are read from the environment when modules are imported, so .env
+# is loaded once here, before any backend module runs.
+load_dotenv(Path(__file__).resolve().parents[1] / ".env")
@@ -0,0 +1,161 @@
+from __future__ import annotations
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+# IVF (inverted file) index: rows are clustered with spherical k-means and a
+# query only scores the rows of the `nprobe` lists whose centroids are closest.
+ANN_MIN_ROWS = int(os.getenv("ANN_MIN_ROWS", "20000"))   # below this: exact search
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+ANN_TRAIN_ITERS = int(os.getenv("ANN_TRAIN_ITERS", "10"))
+# Incremental builds keep the previous centroids and only assign new rows until
+# the row count has moved by more than this fraction since they were trained.
+ANN_RETRAIN_DRIFT = float(os.getenv("ANN_RETRAIN_DRIFT", "0.2"))
+# Bytes of the (rows x nlist) float32 score block when assigning rows
+ASSIGN_BLOCK_BYTES = 1 << 24
+
+N_ROLE_CODES = 3   # public / internal / private (utils.ROLE_CODES)
+
+
+def top_k_positions(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Positions of the k highest scores, best first.
+    argpartition keeps this O(n) instead of a full sort.
+    """
+    if k < len(scores):
+        part = np.argpartition(-scores, k - 1)[:k]
+    else:
+        part = np.arange(len(scores))
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+def default_nlist(n_rows: int) -> int:
+    return int(np.clip(4 * np.sqrt(n_rows), 16, 4096))
+
+
+def _assign(X: np.ndarray, C: np.ndarray) -> np.ndarray:
+    """Nearest centroid (by dot product) for every row, in blocks."""
+    out = np.empty(X.shape[0], dtype="int32")
+    block = max(256, ASSIGN_BLOCK_BYTES // (4 * max(1, C.shape[0])))
+    for b in range(0, X.shape[0], block):
+        out[b:b + block] = np.argmax(np.asarray(X[b:b + block]) @ C.T, axis=1)
+    return out
+
+
+class IVFIndex:
+    """
+    centroids  (nlist, dim)  unit-norm cluster centres
+    rows       (N,)          row ids grouped by list
+    offsets    (nlist + 1,)  list j is rows[offsets[j]:offsets[j + 1]]
+    role_counts (nlist, 3)   rows per role in each list, so probing can skip
+                             lists with nothing the caller may see
+    """
+
+    FILES = ("centroids", "rows", "offsets", "role_counts")
+
+    def __init__(self, centroids: np.ndarray, rows: np.ndarray, offsets: np.ndarray, role_counts: np.ndarray):
+        self.centroids = centroids
+        self.rows = rows
+        self.offsets = offsets
+        self.role_counts = role_counts
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    # ---- build ----
+    @classmethod
+    def train(cls, X: np.ndarray, role_codes: np.ndarray, nlist: Optional[int] = None,
+              iters: int = ANN_TRAIN_ITERS, seed: int = 0) -> "IVFIndex":
+        """Spherical k-means on a sample of the (normalized) rows, then assign all rows."""
+        n = X.shape[0]
+        nlist = min(nlist or default_nlist(n), n)
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(n, size=min(n, nlist * 64), replace=False))
+        S = np.asarray(X[sample], dtype="float32")
+
+        C = S[rng.choice(len(S), size=nlist, replace=False)].copy()
+        for _ in range(iters):
+            a = _assign(S, C)
+            sums = np.zeros_like(C)
+            np.add.at(sums, a, S)
+            counts = np.bincount(a, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # Re-seed empty lists with random sample points
+                sums[empty] = S[rng.choice(len(S), size=int(empty.sum()), replace=False)]
+            C = sums / (np.linalg.norm(sums, axis=1, keepdims=True) + 1e-8)
+
+        return cls._from_assignment(C.astype("float32"), _assign(X, C), role_codes)
+
+    def updated(self, X: np.ndarray, role_codes: np.ndarray, row_origin: np.ndarray) -> "IVFIndex":
+        """
+        Same centroids over new rows X, where row i was row row_origin[i] of
+        this index (< 0: new row). Reused rows keep their list; only new rows
+        are assigned, so the result equals assigning every row of X.
+        """
+        old_assign = np.empty(len(self.rows), dtype="int32")
+        old_assign[self.rows] = np.repeat(np.arange(self.nlist, dtype="int32"), np.diff(self.offsets))
+        reused = row_origin >= 0
+        assign = np.empty(len(row_origin), dtype="int32")
+        assign[reused] = old_assign[row_origin[reused]]
+        new = np.flatnonzero(~reused)
+        if len(new):
+            assign[new] = _assign(X[new], self.centroids)
+        return self._from_assignment(np.asarray(self.centroids), assign, role_codes)
+
+    @classmethod
+    def _from_assignment(cls, C: np.ndarray, assign: np.ndarray, role_codes: np.ndarray) -> "IVFIndex":
+        nlist = C.shape[0]
+        rows = np.argsort(assign, kind="stable").astype("int64")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))]).astype("int64")
+        role_counts = np.zeros((nlist, N_ROLE_CODES), dtype="int64")
+        valid = (role_codes >= 0) & (role_codes < N_ROLE_CODES)
+        np.add.at(role_counts, (assign[valid], role_codes[valid]), 1)
+        return cls(C, rows, offsets, role_counts)
+
+    # ---- persistence ----
+    def save(self, directory: Path, prefix: str = "ivf_") -> None:
+        for name in self.FILES:
+            np.save(directory / f"{prefix}{name}.npy", getattr(self, name))
+
+    @classmethod
+    def load(cls, directory: Path, prefix: str = "ivf_") -> Optional["IVFIndex"]:
+        """Load a saved index, or None if there is none."""
+        paths = [directory / f"{prefix}{name}.npy" for name in cls.FILES]
+        if not all(p.exists() for p in paths):
+            return None
+        arrays = [np.load(p, mmap_mode="r") for p in paths]
+        arrays[0] = np.asarray(arrays[0])   # centroids are scored on every query
+        return cls(*arrays)
+
+    # ---- query ----
+    def candidates(self, q: np.ndarray, visible: Optional[np.ndarray], codes: Optional[list],
+                   nprobe: int, min_candidates: int) -> np.ndarray:
+        """
+        Row ids from the closest lists, filtered by the boolean `visible` mask.
+        Only lists holding rows of the allowed role `codes` are probed, and
+        probing continues past nprobe until min_candidates visible rows are
+        found, so rare restricted roles keep their recall.
+        """
+        sims = self.centroids @ q
+        if codes is not None:
+            eligible = np.flatnonzero(np.asarray(self.role_counts)[:, codes].sum(axis=1) > 0)
+        else:
+            eligible = np.arange(self.nlist)
+        order = eligible[np.argsort(-sims[eligible], kind="stable")]
+
+        found, total = [], 0
+        for j, lst in enumerate(order):
+            r = np.asarray(self.rows[self.offsets[lst]:self.offsets[lst + 1]])
+            if visible is not None:
+                r = r[visible[r]]
+            found.append(r)
+            total += len(r)
+            if j + 1 >= nprobe and total >= min_candidates:
+                break
+        if not found:
+            return np.zeros(0, dtype="int64")
+        return np.sort(np.concatenate(found))
@@ -1,13 +1,106 @@
-import os, time, jwt
-from typing import Optional, List
-from .utils import load_users, ALLOWED_ROLES  # ALLOWED_ROLES = {"public","internal","private"}
+import argparse, hmac, json, os, threading, time, jwt, bcrypt
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterator, Optional, List, Tuple
+from .cache import TTLCache
+from .utils import load_users, USERS_PATH, ALLOWED_ROLES  # ALLOWED_ROLES = {"public","internal","private"}
 
 JWT_SECRET = os.getenv("JWT_SECRET", "change-me")
 JWT_ALG = "HS256"
 
+# Work factor for password hashes written by hash_users_file()
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Verified tokens are remembered until their exp, so most requests skip jwt.decode
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
 def _normalize_categories(cats: List[str]) -> List[str]:
     return [str(c).strip().lower() for c in cats or []]
 
+def _iter_users(raw) -> Iterator[Tuple[str, dict]]:
+    """(username, entry) from either users.json shape: a list of entries or {username: entry}."""
+    if isinstance(raw, dict):
+        yield from ((str(name), u) for name, u in raw.items())
+    else:
+        yield from ((str(u.get("username")), u) for u in raw if u.get("username"))
+
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("ascii")
+
+class UserDirectory:
+    """
+    users.json held in memory as {username: entry}. The file is re-read only
+    when its mtime or size changes, so a login costs one stat() and a dict
+    lookup however many accounts the file holds.
+
+    Entries carry a bcrypt "password_hash". Plaintext "password" entries
+    from older files keep working until the file is converted with
+    `python -m backend.auth --hash-users`.
+    """
+
+    def __init__(self, path: Path = USERS_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._users: Dict[str, dict] = {}
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _reload(self) -> None:
+        with self._lock:
+            stamp = self._file_stamp()
+            if stamp is not None and stamp == self._stamp:
+                return
+            raw = load_users(self.path)
+            # Stamp taken before the read: a write during it triggers another reload
+            stamp = stamp or self._file_stamp()
+            users: Dict[str, dict] = {}
+            plaintext = 0
+            for name, u in _iter_users(raw):
+                cats = [c for c in _normalize_categories(u.get("categories", [])) if c in ALLOWED_ROLES]
+                pw_hash = u.get("password_hash")
+                users[name] = {
+                    "categories": cats,
+                    "password_hash": pw_hash.encode("ascii") if pw_hash else None,
+                    "password": None if pw_hash else u.get("password"),
+                }
+                plaintext += not pw_hash
+            if plaintext:
+                print(f"[auth] WARNING: {plaintext} user(s) in {self.path.name} have plaintext passwords; "
+                      f"run `python -m backend.auth --hash-users` to hash them.")
+            self._users, self._stamp = users, stamp
+
+    def get(self, username: str) -> Optional[dict]:
+        if self._stamp is None or self._file_stamp() != self._stamp:
+            self._reload()
+        return self._users.get(username)
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+USERS = UserDirectory()
+
+@lru_cache(maxsize=1)
+def _dummy_hash() -> bytes:
+    return hash_password("", BCRYPT_ROUNDS).encode("ascii")
+
+def _check_password(user: Optional[dict], password: str) -> bool:
+    pw = password.encode("utf-8")
+    if user is None or user["password_hash"] is None and user["password"] is None:
+        # Unknown user: still pay for one bcrypt check so timing does not reveal it
+        bcrypt.checkpw(pw[:72], _dummy_hash())
+        return False
+    if user["password_hash"] is None:
+        return hmac.compare_digest(str(user["password"]).encode("utf-8"), pw)
+    try:
+        return bcrypt.checkpw(pw, user["password_hash"])
+    except ValueError:     # malformed hash, or a password over bcrypt's 72 bytes
+        return False
+
 def issue_token(username: str, categories: list, exp_seconds: int = 60 * 60 * 12) -> str:
     now = int(time.time())
     payload = {
@@ -19,16 +112,60 @@ def issue_token(username: str, categories: list, exp_seconds: int = 60 * 60 * 12
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALG)
 
 def login(username: str, password: str) -> Optional[dict]:
-    users = load_users()
-    for u in users:
-        if u.get("username") == username and u.get("password") == password:
-            cats = _normalize_categories(u.get("categories", []))
-            cats = [c for c in cats if c in ALLOWED_ROLES]
-            if not cats:
-                return None
-            tok = issue_token(username, cats)
-            return {"token": tok, "categories": cats}
-    return None
+    user = USERS.get(username)
+    if not _check_password(user, password):
+        return None
+    cats = user["categories"]
+    if not cats:
+        return None
+    tok = issue_token(username, cats)
+    return {"token": tok, "categories": list(cats)}
+
+_TOKEN_CACHE = TTLCache(TOKEN_CACHE_SIZE)
 
 def decode_token(token: str) -> dict:
-    return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
+    """
+    Verify a JWT and return its claims. A token that verified once is served
+    from a bounded cache until its exp; invalid tokens are never cached.
+    """
+    claims = _TOKEN_CACHE.get(token)
+    if claims is None:
+        claims = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
+        if isinstance(claims.get("exp"), (int, float)):
+            _TOKEN_CACHE.set(token, claims, expires_at=float(claims["exp"]))
+    return dict(claims)
+
+def token_cache_stats() -> dict:
+    c = _TOKEN_CACHE
+    return {"size": len(c), "hits": c.hits, "misses": c.misses}
+
+def hash_users_file(path: Path = USERS_PATH, rounds: int = BCRYPT_ROUNDS) -> int:
+    """
+    Replace plaintext "password" fields in a users file with bcrypt
+    "password_hash" ones (written atomically). Returns how many were hashed.
+    """
+    path = Path(path)
+    raw = json.loads(path.read_text(encoding="utf-8"))
+    hashed = 0
+    for name, u in _iter_users(raw):
+        if "password" in u and not u.get("password_hash"):
+            password = str(u.pop("password"))
+            if len(password.encode("utf-8")) > 72:
+                raise ValueError(f"Password of {name!r} is longer than bcrypt's 72-byte limit")
+            u["password_hash"] = hash_password(password, rounds)
+            hashed += 1
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(raw, indent=2) + "\n", encoding="utf-8")
+    os.replace(tmp, path)
+    return hashed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="User file maintenance.")
+    parser.add_argument("--hash-users", action="store_true", help="bcrypt-hash plaintext passwords in the users file")
+    parser.add_argument("--path", type=Path, default=USERS_PATH)
+    parser.add_argument("--rounds", type=int, default=BCRYPT_ROUNDS)
+    args = parser.parse_args()
+    if args.hash_users:
+        print(f"[auth] Hashed {hash_users_file(args.path, args.rounds)} password(s) in {args.path}.")
+    else:
+        parser.print_help()
@@ -0,0 +1,168 @@
+from __future__ import annotations
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """
+    Thread-safe bounded LRU cache with an optional time-to-live.
+
+    - Entries expire `ttl` seconds after insertion (a per-entry ttl or an
+      absolute `expires_at` may be given to set()).
+    - get_or_compute() coalesces concurrent misses: while one thread computes
+      a key, other callers for the same key wait for that result instead of
+      repeating the work.
+    """
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None):
+        self.max_size = max(1, int(max_size))
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[Hashable, Tuple[Any, Optional[float]]]" = OrderedDict()
+        self._inflight: Dict[Hashable, Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_rate(self) -> float:
+        """Share of lookups that did not trigger a compute (coalesced waiters count as hits)."""
+        served = self.hits + self.coalesced
+        total = served + self.misses
+        return served / total if total else 0.0
+
+    def _lookup(self, key: Hashable) -> Tuple[bool, Any]:
+        """Caller holds the lock."""
+        item = self._data.get(key)
+        if item is None:
+            return False, None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.time():
+            del self._data[key]
+            return False, None
+        self._data.move_to_end(key)
+        return True, value
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                self.hits += 1
+                return value
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None,
+            expires_at: Optional[float] = None) -> None:
+        if expires_at is None:
+            ttl = self.ttl if ttl is None else ttl
+            expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def _claim(self, key: Hashable) -> Tuple[bool, Any, Optional[Future], bool]:
+        """(found, value, in-flight future, caller owns the computation)."""
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                self.hits += 1
+                return True, value, None, False
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                self.misses += 1
+                fut = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+            return False, None, fut, owner
+
+    def _settle(self, key: Hashable, fut: Future, value: Any = None,
+                error: Optional[BaseException] = None) -> None:
+        if error is None:
+            self.set(key, value)
+        with self._lock:
+            self._inflight.pop(key, None)
+        if error is None:
+            fut.set_result(value)
+        else:
+            fut.set_exception(error)
+
+    def _abandon(self, key: Hashable, fut: Future) -> None:
+        """Drop a cancelled computation; its waiters claim the key again."""
+        with self._lock:
+            if self._inflight.get(key) is fut:
+                del self._inflight[key]
+        fut.cancel()
+
+    def _finish(self, key: Hashable, fut: Future, task: "asyncio.Task") -> None:
+        if task.cancelled():
+            self._abandon(key, fut)
+        elif task.exception() is not None:
+            self._settle(key, fut, error=task.exception())
+        else:
+            self._settle(key, fut, task.result())
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        while True:
+            found, value, fut, owner = self._claim(key)
+            if found:
+                return value
+            if owner:
+                break
+            try:
+                return fut.result()
+            except BaseException:
+                if fut.cancelled():
+                    continue
+                raise
+        try:
+            value = compute()
+        except BaseException as e:
+            self._settle(key, fut, error=e)
+            raise
+        self._settle(key, fut, value)
+        return value
+
+    async def aget_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Coroutine version of get_or_compute(). Waiters await the in-flight
+        result, so they never block the event loop; sync and async callers
+        share the same in-flight table.
+
+        The computation runs as its own task and everyone awaits it shielded:
+        a cancelled caller (e.g. a client that disconnected), owner or waiter,
+        leaves it running for the others, and only real errors reach waiters.
+        """
+        while True:
+            found, value, fut, owner = self._claim(key)
+            if found:
+                return value
+            if owner:
+                break
+            try:
+                return await asyncio.shield(asyncio.wrap_future(fut))
+            except asyncio.CancelledError:
+                if fut.cancelled():
+                    continue
+                raise
+        task = asyncio.ensure_future(compute())
+        task.add_done_callback(lambda t: self._finish(key, fut, t))
+        return await asyncio.shield(task)
@@ -1,15 +1,16 @@
-import os, re
-from typing import List, Tuple, Dict
-from openai import OpenAI
-from dotenv import load_dotenv
+import asyncio, os, re, threading
+from typing import AsyncIterator, List, Tuple, Dict, Optional
+import numpy as np
+from .cache import TTLCache
+from .clients import CHAT_TIMEOUT, async_openai_client, openai_client
+from .embedder import approx_tokens
+from .metrics import stage
 from .schemas import ChatChunk
 # Note: Retriever class is imported as a type hint in the function signature
 
-load_dotenv()
 # Ensure these are set in your .env file
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4")
 EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-large") 
-_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 # ---- Role-guided behavior (The Security Layer) ----
 ROLE_TEMPLATES = {
@@ -41,84 +42,244 @@ SYSTEM_REWRITE = (
 )
 
 TOK = re.compile(r"[a-z0-9]+", re.I)
+LLM_ERROR_MESSAGE = "I am experiencing a temporary issue. Please try again shortly."
+
+# ---- Answer cache ----
+# Answers are reused only for the same role, the same allowed-roles set, the
+# same index generation and the exact same retrieved chunks, so an answer built
+# from private context can never reach a caller who could not retrieve it.
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "900"))
+# Within one such scope a differently worded question may reuse an answer when
+# its query vector is at least this similar. 0 = exact (normalized) text only.
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))
+ANSWER_CACHE_PER_SCOPE = 8
+
+# ---- Context assembly ----
+# Prompt context is capped at CONTEXT_TOKEN_BUDGET (approximate) tokens.
+# Chunks are ordered by maximal marginal relevance over their stored
+# embeddings (relevance weight CONTEXT_MMR_LAMBDA) and a chunk at least
+# CONTEXT_DUP_THRESHOLD similar to one already included is left out.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+CONTEXT_DUP_THRESHOLD = float(os.getenv("CONTEXT_DUP_THRESHOLD", "0.95"))
+
+# Batch chat: completions generated at once per /chat/batch request
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8"))
+
+def _normalize_question(q: str) -> str:
+    return " ".join(q.split()).casefold()
+
+
+class AnswerCache:
+    """
+    Size/TTL-bounded cache of (answer, ui context) per retrieval scope.
+    Everything is dropped when a new index generation shows up.
+    """
+
+    def __init__(self, max_size: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL,
+                 similarity: float = ANSWER_CACHE_SIMILARITY):
+        self.similarity = similarity
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._scopes = TTLCache(max_size, ttl=ttl or None)
+        self._generation: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def scope(category: str, allowed_roles: List[str], chunks: List[Dict]) -> Tuple:
+        return (
+            category,
+            frozenset(r.lower() for r in allowed_roles),
+            chunks[0].get("generation"),
+            tuple(c.get("id") for c in chunks),
+        )
+
+    def _sync_generation(self, generation: Optional[int]) -> None:
+        with self._lock:
+            if generation != self._generation:
+                self._scopes.clear()
+                self._generation = generation
+
+    def get(self, scope: Tuple, question: str,
+            qvec: Optional[np.ndarray] = None) -> Optional[Tuple[str, List[ChatChunk]]]:
+        self._sync_generation(scope[2])
+        entries = self._scopes.get(scope) or ()
+        key = _normalize_question(question)
+        for q, _, answer, ui_ctx in entries:
+            if q == key:
+                self.hits += 1
+                return answer, list(ui_ctx)
+        if qvec is not None and self.similarity > 0:
+            for _, v, answer, ui_ctx in entries:
+                if v is not None and float(v @ qvec) >= self.similarity:
+                    self.semantic_hits += 1
+                    return answer, list(ui_ctx)
+        self.misses += 1
+        return None
+
+    def put(self, scope: Tuple, question: str, qvec: Optional[np.ndarray],
+            answer: str, ui_ctx: List[ChatChunk]) -> None:
+        self._sync_generation(scope[2])
+        key = _normalize_question(question)
+        with self._lock:
+            entries = [e for e in (self._scopes.get(scope) or ()) if e[0] != key]
+            entries.append((key, qvec, answer, tuple(ui_ctx)))
+            self._scopes.set(scope, tuple(entries[-ANSWER_CACHE_PER_SCOPE:]))
+
+    def clear(self) -> None:
+        self._scopes.clear()
+
+    def stats(self) -> Dict:
+        return {"size": len(self._scopes), "hits": self.hits,
+                "semantic_hits": self.semantic_hits, "misses": self.misses}
+
+
+ANSWER_CACHE = AnswerCache()
+
+def _messages(system_prompt: str, user_prompt: str) -> List[Dict]:
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
 
 def _chat(system_prompt: str, user_prompt: str) -> str:
     """Simple wrapper for OpenAI API completion."""
     try:
-        response = _client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.0,
-        )
+        with stage("llm_completion"):
+            response = openai_client().chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=_messages(system_prompt, user_prompt),
+                temperature=0.0,
+                timeout=CHAT_TIMEOUT,
+            )
         return response.choices[0].message.content.strip()
     except Exception as e:
         print(f"LLM Error: {e}")
-        return "I am experiencing a temporary issue. Please try again shortly."
+        return LLM_ERROR_MESSAGE
+
+async def _achat(system_prompt: str, user_prompt: str) -> str:
+    """_chat() on the shared AsyncOpenAI client; awaiting it never blocks the event loop."""
+    try:
+        with stage("llm_completion"):
+            response = await async_openai_client().chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=_messages(system_prompt, user_prompt),
+                temperature=0.0,
+                timeout=CHAT_TIMEOUT,
+            )
+        return response.choices[0].message.content.strip()
+    except Exception as e:
+        print(f"LLM Error: {e}")
+        return LLM_ERROR_MESSAGE
+
+async def _astream_chat(system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+    """Completion text pieces as the model produces them (errors propagate)."""
+    stream = await async_openai_client().chat.completions.create(
+        model=OPENAI_MODEL,
+        messages=_messages(system_prompt, user_prompt),
+        temperature=0.0,
+        timeout=CHAT_TIMEOUT,
+        stream=True,
+    )
+    async for event in stream:
+        if event.choices and event.choices[0].delta.content:
+            yield event.choices[0].delta.content
+
+def _mmr_order(relevance: np.ndarray, V: np.ndarray, lam: float = CONTEXT_MMR_LAMBDA,
+               dup: float = CONTEXT_DUP_THRESHOLD) -> List[int]:
+    """
+    Greedy maximal-marginal-relevance order over chunk vectors V (unit rows).
+    A chunk whose cosine to an already picked one reaches `dup` is dropped
+    as a near-duplicate (overlapping windows, repeated headers).
+    """
+    S = V @ V.T
+    alive = np.ones(len(relevance), dtype=bool)
+    max_sim = np.zeros(len(relevance), dtype="float32")
+    order: List[int] = []
+    while alive.any():
+        score = np.where(alive, lam * relevance - (1.0 - lam) * max_sim, -np.inf)
+        j = int(np.argmax(score))
+        order.append(j)
+        alive[j] = False
+        np.maximum(max_sim, S[j], out=max_sim)
+        alive &= max_sim < dup
+    return order
 
-def _ctx_from_chunks(chunks: List[Dict]) -> Tuple[str, List[ChatChunk]]:
-    """Formats retrieved chunks into a context string for the LLM and a UI list."""
-    context_str = ""
+
+def _ctx_from_chunks(chunks: List[Dict], vectors: Optional[np.ndarray] = None,
+                     budget: int = CONTEXT_TOKEN_BUDGET) -> Tuple[str, List[ChatChunk]]:
+    """
+    Formats retrieved chunks into a context string for the LLM and a UI list.
+
+    With the chunks' stored embeddings (`vectors`), near-duplicates are
+    dropped and chunks are ordered by MMR; chunks are then added until the
+    token budget is spent (the first one always goes in).
+    """
+    if vectors is not None and len(chunks) > 1:
+        cos = np.array([c.get("cos", 0.0) for c in chunks], dtype="float32")
+        if not cos.any():
+            # Lexical results carry no cosine: use retrieval rank instead
+            cos = np.linspace(1.0, 0.5, len(chunks), dtype="float32")
+        order = _mmr_order(cos, np.asarray(vectors, dtype="float32"))
+    else:
+        order = list(range(len(chunks)))
+
+    parts: List[str] = []
     ui_ctx: List[ChatChunk] = []
-    
+    used = 0
+
     # Simple deduplication based on text/source pair
     seen = set()
 
-    for i, c in enumerate(chunks):
+    for i in order:
+        c = chunks[i]
         text = c["text"]
         source = c.get("source", f"Chunk {i}")
-        
+
         if (text, source) in seen:
             continue
         seen.add((text, source))
 
-        context_str += f"== CONTEXT CHUNK FROM {source} ==\n{text}\n\n"
+        part = f"== CONTEXT CHUNK FROM {source} ==\n{text}"
+        cost = approx_tokens(part)
+        if parts and used + cost > budget:
+            continue
+        used += cost
+        parts.append(part)
         ui_ctx.append(ChatChunk(text=text, source=source))
 
-    return context_str.strip(), ui_ctx
+    return "\n\n".join(parts).strip(), ui_ctx
+
+
+def _parse_rewrites(raw_queries: str) -> List[str]:
+    # Parse 3 queries (one per line)
+    return [q.strip() for q in raw_queries.split('\n') if q.strip() and len(TOK.findall(q)) > 3][:3]
 
 
 def _rerun_chat(msg: str, chunks: List[Dict], category: str) -> str:
     """Helper to rewrite query and attempt a second retrieval."""
-    system = SYSTEM_REWRITE
-    user = f"QUESTION: {msg}"
-    raw_queries = _chat(system, user)
-    
-    # Parse 3 queries (one per line)
-    new_queries = [q.strip() for q in raw_queries.split('\n') if q.strip() and len(TOK.findall(q)) > 3][:3]
-    return new_queries
+    with stage("query_rewrite"):
+        return _parse_rewrites(_chat(SYSTEM_REWRITE, f"QUESTION: {msg}"))
 
 
-def answer_with_rag(
-    message: str,
-    category: str,
-    retriever, # Type hint 'Retriever' is fine for internal use
-    allowed_roles: List[str],
-    top_k: int = 5,
-) -> Tuple[str, List[ChatChunk]]:
-    
-    msg = message.strip()
-    chunks = retriever.retrieve(msg, allowed_roles=allowed_roles, top_k=top_k)
-    
-    # Query rewriting and retry logic
-    if not chunks:
-        new_queries = _rerun_chat(msg, chunks, category)
-        for q in new_queries:
-            chunks = retriever.retrieve(q, allowed_roles=allowed_roles, top_k=top_k)
-            if chunks:
-                break
-        
-    if not chunks:
-        return (
-            "I couldn’t find any relevant information that you are authorized to view. "
-            "Try rephrasing or specify a more general topic.",
-            [],
-        )
+async def _arerun_chat(msg: str, chunks: List[Dict], category: str) -> List[str]:
+    with stage("query_rewrite"):
+        return _parse_rewrites(await _achat(SYSTEM_REWRITE, f"QUESTION: {msg}"))
+
+
+NO_CONTEXT_ANSWER = (
+    "I couldn’t find any relevant information that you are authorized to view. "
+    "Try rephrasing or specify a more general topic."
+)
 
-    # Build context and prompt
-    context, ui_ctx = _ctx_from_chunks(chunks)
+
+def _build_prompt(msg: str, category: str, chunks: List[Dict],
+                  vectors: Optional[np.ndarray] = None) -> Tuple[str, str, List[ChatChunk]]:
+    """System prompt, user prompt and UI context for the final completion."""
+    with stage("context_assembly"):
+        context, ui_ctx = _ctx_from_chunks(chunks, vectors)
     sys_prompt = ROLE_TEMPLATES.get(category, ROLE_TEMPLATES["public"])
 
     user_prompt = (
@@ -129,24 +290,198 @@ def answer_with_rag(
         "to the user's role (public/internal/private). "
         "If the context lacks enough info, say so clearly and suggest what to clarify."
     )
+    return sys_prompt, user_prompt, ui_ctx
 
-    answer = _chat(sys_prompt, user_prompt)
 
-    # Contact info enrichment (for private role)
-    if category == "private":
+def _contact_block(chunks: List[Dict], category: str) -> str:
+    """Contact info enrichment (for private role)."""
+    if category != "private":
+        return ""
+    with stage("contact_enrichment"):
         contacts: Dict[str, set] = {"urls": set(), "emails": set(), "phones": set()}
         for c in chunks:
             for t, vals in c["meta"].get("contacts", {}).items():
                 for v in vals:
                     contacts[t].add(v)
-        
-        lines = []
-        for t, vals in contacts.items():
-            if vals:
-                lines.append(f"{t.capitalize()}: {', '.join(sorted(vals))}")
 
-        if lines:
-            contact_block = "\n\n---\n**Relevant Contacts/Links:**\n" + "\n".join(lines)
-            answer += contact_block
+    lines = []
+    for t, vals in contacts.items():
+        if vals:
+            lines.append(f"{t.capitalize()}: {', '.join(sorted(vals))}")
+
+    if not lines:
+        return ""
+    return "\n\n---\n**Relevant Contacts/Links:**\n" + "\n".join(lines)
+
+
+def answer_with_rag(
+    message: str,
+    category: str,
+    retriever, # Type hint 'Retriever' is fine for internal use
+    allowed_roles: List[str],
+    top_k: int = 5,
+    fusion: bool = False,
+) -> Tuple[str, List[ChatChunk]]:
+    """Synchronous pipeline (CLI / scripts). The API uses aanswer_with_rag."""
+    msg = message.strip()
+    if fusion:
+        # Rewrites up front, fused with the original question
+        queries = [msg] + _rerun_chat(msg, [], category)
+        chunks = retriever.retrieve_multi(queries, allowed_roles=allowed_roles, top_k=top_k)
+    else:
+        chunks = retriever.retrieve(msg, allowed_roles=allowed_roles, top_k=top_k)
+
+    # Query rewriting and retry logic: all rewrites are embedded and
+    # searched in one batch and their rankings fused
+    if not chunks and not fusion:
+        new_queries = _rerun_chat(msg, chunks, category)
+        chunks = retriever.retrieve_multi(new_queries, allowed_roles=allowed_roles, top_k=top_k)
+
+    if not chunks:
+        return NO_CONTEXT_ANSWER, []
+
+    scope = AnswerCache.scope(category, allowed_roles, chunks)
+    qvec = retriever.query_vector(msg) if ANSWER_CACHE.similarity > 0 else None
+    cached = ANSWER_CACHE.get(scope, msg, qvec)
+    if cached is not None:
+        answer, ui_ctx = cached
+    else:
+        sys_prompt, user_prompt, ui_ctx = _build_prompt(msg, category, chunks, retriever.chunk_vectors(chunks))
+        answer = _chat(sys_prompt, user_prompt)
+        if answer != LLM_ERROR_MESSAGE:
+            ANSWER_CACHE.put(scope, msg, qvec, answer, ui_ctx)
+
+    return answer + _contact_block(chunks, category), ui_ctx
+
+
+async def _aretrieve_with_rewrites(msg: str, category: str, retriever, allowed_roles: List[str],
+                                   top_k: int, fusion: bool = False) -> List[Dict]:
+    if fusion:
+        queries = [msg] + await _arerun_chat(msg, [], category)
+        return await retriever.aretrieve_multi(queries, allowed_roles=allowed_roles, top_k=top_k)
+
+    chunks = await retriever.aretrieve(msg, allowed_roles=allowed_roles, top_k=top_k)
+    if not chunks:
+        new_queries = await _arerun_chat(msg, chunks, category)
+        chunks = await retriever.aretrieve_multi(new_queries, allowed_roles=allowed_roles, top_k=top_k)
+    return chunks
+
+
+async def _acached_answer(msg: str, category: str, retriever, allowed_roles: List[str], chunks: List[Dict]):
+    """(cache scope, query vector, cached (answer, ui_ctx) or None)."""
+    scope = AnswerCache.scope(category, allowed_roles, chunks)
+    qvec = await retriever.aquery_vector(msg) if ANSWER_CACHE.similarity > 0 else None
+    return scope, qvec, ANSWER_CACHE.get(scope, msg, qvec)
+
+
+async def aanswer_with_rag(
+    message: str,
+    category: str,
+    retriever,
+    allowed_roles: List[str],
+    top_k: int = 5,
+    fusion: bool = False,
+) -> Tuple[str, List[ChatChunk]]:
+    """answer_with_rag() on the async clients; used by the /chat endpoint."""
+    msg = message.strip()
+    chunks = await _aretrieve_with_rewrites(msg, category, retriever, allowed_roles, top_k, fusion)
+    return await _aanswer_from_chunks(msg, category, retriever, allowed_roles, chunks)
+
+
+async def _aanswer_from_chunks(msg: str, category: str, retriever, allowed_roles: List[str],
+                               chunks: List[Dict]) -> Tuple[str, List[ChatChunk]]:
+    if not chunks:
+        return NO_CONTEXT_ANSWER, []
+
+    scope, qvec, cached = await _acached_answer(msg, category, retriever, allowed_roles, chunks)
+    if cached is not None:
+        answer, ui_ctx = cached
+    else:
+        sys_prompt, user_prompt, ui_ctx = _build_prompt(msg, category, chunks, retriever.chunk_vectors(chunks))
+        answer = await _achat(sys_prompt, user_prompt)
+        if answer != LLM_ERROR_MESSAGE:
+            ANSWER_CACHE.put(scope, msg, qvec, answer, ui_ctx)
+
+    return answer + _contact_block(chunks, category), ui_ctx
+
+
+async def aanswer_many(
+    messages: List[str],
+    category: str,
+    retriever,
+    allowed_roles: List[str],
+    top_k: int = 5,
+    limit: Optional[asyncio.Semaphore] = None,
+) -> List[Tuple[str, List[ChatChunk]]]:
+    """
+    aanswer_with_rag() for a batch of questions under one role: all
+    questions are retrieved together (Retriever.aretrieve_many), then the
+    completions run concurrently, at most `limit` at a time. Results are
+    returned in input order.
+    """
+    msgs = [m.strip() for m in messages]
+    found = await retriever.aretrieve_many(msgs, allowed_roles=allowed_roles, top_k=top_k)
+    limit = limit or asyncio.Semaphore(CHAT_BATCH_CONCURRENCY)
+
+    async def one(msg: str, chunks: List[Dict]) -> Tuple[str, List[ChatChunk]]:
+        async with limit:
+            if not chunks and msg:
+                new_queries = await _arerun_chat(msg, chunks, category)
+                chunks = await retriever.aretrieve_multi(new_queries, allowed_roles=allowed_roles, top_k=top_k)
+            return await _aanswer_from_chunks(msg, category, retriever, allowed_roles, chunks)
+
+    return await asyncio.gather(*(one(m, c) for m, c in zip(msgs, found)))
+
+
+async def astream_answer_with_rag(
+    message: str,
+    category: str,
+    retriever,
+    allowed_roles: List[str],
+    top_k: int = 5,
+    fusion: bool = False,
+) -> AsyncIterator[Tuple[str, Dict]]:
+    """
+    Streaming aanswer_with_rag(), yielding (event, data) pairs in order:
+      context  - the retrieved chunks shown in the UI (sent before generation)
+      token    - answer text as it arrives from the model
+      contacts - private-role contact block, when there is one
+      done     - the complete answer
+    Same retrieval, RBAC, role templates and answer cache as aanswer_with_rag.
+    """
+    msg = message.strip()
+    chunks = await _aretrieve_with_rewrites(msg, category, retriever, allowed_roles, top_k, fusion)
+    if not chunks:
+        yield "context", {"context": []}
+        yield "token", {"text": NO_CONTEXT_ANSWER}
+        yield "done", {"answer": NO_CONTEXT_ANSWER}
+        return
+
+    scope, qvec, cached = await _acached_answer(msg, category, retriever, allowed_roles, chunks)
+    if cached is not None:
+        answer, ui_ctx = cached
+        yield "context", {"context": [c.model_dump() for c in ui_ctx]}
+        yield "token", {"text": answer}
+    else:
+        sys_prompt, user_prompt, ui_ctx = _build_prompt(msg, category, chunks, retriever.chunk_vectors(chunks))
+        yield "context", {"context": [c.model_dump() for c in ui_ctx]}
+        parts: List[str] = []
+        try:
+            # Includes the time the client takes to read the stream
+            with stage("llm_completion"):
+                async for piece in _astream_chat(sys_prompt, user_prompt):
+                    parts.append(piece)
+                    yield "token", {"text": piece}
+        except Exception as e:
+            print(f"LLM Error: {e}")
+            tail = ("\n\n" if parts else "") + LLM_ERROR_MESSAGE
+            yield "token", {"text": tail}
+            answer = "".join(parts) + tail
+        else:
+            answer = "".join(parts).strip()
+            ANSWER_CACHE.put(scope, msg, qvec, answer, ui_ctx)
 
-    return answer, ui_ctx
\ No newline at end of file
+    contacts = _contact_block(chunks, category)
+    if contacts:
+        yield "contacts", {"text": contacts}
+    yield "done", {"answer": answer + contacts}
@@ -1,73 +1,79 @@
 from __future__ import annotations
 import re
-from typing import List
+from typing import List, Tuple
+
+import numpy as np
 
-_SENT_SPLIT = re.compile(r"(?<=[.!?])\s+")
 _PARA_SPLIT = re.compile(r"\n\s*\n+")
+# A sentence ends at . ! or ? followed by whitespace (the whitespace run is
+# the break). Anchoring on the punctuation lets the regex engine scan for it
+# instead of testing a lookbehind at every position.
+_SENT_BREAK = re.compile(r"[.!?]\s+")
 
-def _normalize(s: str) -> str:
-    """Normalizes whitespace and preserves paragraph breaks."""
-    s = s.replace("\r", "")
-    parts = _PARA_SPLIT.split(s.strip())
-    parts = [" ".join(p.split()) for p in parts]
-    return "\n\n".join(parts)
+Span = Tuple[int, int]
 
-def _sentences(text: str) -> List[str]:
-    """Splits text into sentences, respecting paragraph boundaries."""
+def _sentences(text: str) -> Tuple[str, np.ndarray, np.ndarray]:
+    """
+    Splits text into sentences, respecting paragraph boundaries.
+    Returns the normalized source (the sentences joined by single spaces)
+    and the start and end offsets of each sentence in it.
+    """
     sents: List[str] = []
     for para in _PARA_SPLIT.split(text):
         para = para.strip()
         if not para:
             continue
-        for s in _SENT_SPLIT.split(para):
-            s = s.strip()
-            if s:
-                sents.append(s)
-    return sents
+        start = 0
+        for m in _SENT_BREAK.finditer(para):
+            sents.append(para[start:m.start() + 1])
+            start = m.end()
+        sents.append(para[start:])
+    lens = np.fromiter(map(len, sents), dtype="int64", count=len(sents))
+    ends = np.cumsum(lens + 1) - 1
+    return " ".join(sents), ends - lens, ends
 
-def chunk_text(
+def chunk_spans(
     text: str,
-    max_chars: int = 1800,   
-    min_chars: int = 600,    
-    overlap_sents: int = 1,  
-) -> List[str]:
-    """Splits raw text into overlapping chunks based on sentences."""
-    sents = _sentences(text)
-    chunks: List[str] = []
-    curr: List[str] = []
-    curr_len = 0
+    max_chars: int = 1800,
+    min_chars: int = 600,
+    overlap_sents: int = 1,
+) -> Tuple[str, List[Span]]:
+    """
+    Splits raw text into overlapping chunks based on sentences, in one pass.
 
-    def flush():
-        if curr:
-            chunks.append(" ".join(curr))
-            curr.clear()
-            nonlocal curr_len
-            curr_len = 0
+    Returns the normalized source and the (start, end) character span of
+    each chunk in it; chunk i is source[start:end]. A chunk is a run of
+    whole sentences, so overlapping chunks share the carried sentences
+    instead of copying them.
+    """
+    source, starts, ends = _sentences(text)
+    spans: List[Span] = []
+    n = len(starts)
+    first = forced = 0         # first sentence of the chunk; it always reaches `forced`
 
-    for i, s in enumerate(sents):
-        s_len = len(s) + 1 
-        if curr_len + s_len <= max_chars or not curr:
-            curr.append(s)
-            curr_len += s_len
-        else:
-            flush()
-            # overlap: carry last N sentences into the next chunk
-            if overlap_sents > 0 and chunks and i > 0:
-                # Find the index of the sentence N steps back
-                carry_start = max(0, i - overlap_sents)
-                carry = sents[carry_start:i]
-                if carry:
-                    curr.extend(carry)
-                    curr_len = sum(len(x) + 1 for x in curr)
-            
-            curr.append(s)
-            curr_len += s_len
+    while first < n:
+        # Last sentence that keeps the chunk (plus a separator) within max_chars
+        last = int(np.searchsorted(ends, starts[first] + max_chars - 1, side="right")) - 1
+        last = max(last, forced)
+        spans.append((int(starts[first]), int(ends[last])))
+        if last == n - 1:
+            break
+        # overlap: carry last N sentences into the next chunk
+        forced = last + 1
+        first = max(0, forced - overlap_sents) if overlap_sents > 0 else forced
 
-    flush()
+    # merge tiny last chunk into the one before it
+    if len(spans) >= 2 and spans[-1][1] - spans[-1][0] < min_chars:
+        spans[-2:] = [(spans[-2][0], spans[-1][1])]
 
-    # merge tiny last chunk
-    if len(chunks) >= 2 and len(chunks[-1]) < min_chars:
-        chunks[-2] = (chunks[-2] + " " + chunks[-1]).strip()
-        chunks.pop()
+    return source, spans
 
-    return [c for c in (x.strip() for x in chunks) if c]
\ No newline at end of file
+def chunk_text(
+    text: str,
+    max_chars: int = 1800,
+    min_chars: int = 600,
+    overlap_sents: int = 1,
+) -> List[str]:
+    """Splits raw text into overlapping chunks based on sentences."""
+    source, spans = chunk_spans(text, max_chars, min_chars, overlap_sents)
+    return [source[a:b] for a, b in spans]
\ No newline at end of file
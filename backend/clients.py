@@ -0,0 +1,79 @@
+from __future__ import annotations
+import os
+import threading
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import httpx
+    from openai import AsyncOpenAI, OpenAI
+
+# Shared OpenAI clients. Every module talks to the API through these, so all
+# calls share one pooled HTTP connection pool per client type instead of
+# opening a new one per module. OPENAI_BASE_URL (read by the SDK) may point
+# at a local stub server for load tests. The SDK is imported on first use:
+# it takes about half a second, and the local embedder never needs it.
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+# Default per-call timeouts (seconds); callers can still override per request
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", "30"))
+CHAT_TIMEOUT = float(os.getenv("CHAT_TIMEOUT", "60"))
+
+_lock = threading.Lock()
+_sync_client: Optional["OpenAI"] = None
+_async_client: Optional["AsyncOpenAI"] = None
+
+
+def _limits() -> "httpx.Limits":
+    import httpx
+    return httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS,
+                        max_keepalive_connections=OPENAI_MAX_KEEPALIVE)
+
+
+def _timeout() -> "httpx.Timeout":
+    import httpx
+    return httpx.Timeout(max(EMBED_TIMEOUT, CHAT_TIMEOUT), connect=OPENAI_CONNECT_TIMEOUT)
+
+
+def openai_client() -> "OpenAI":
+    """Process-wide synchronous client (indexer, CLI and sync call paths)."""
+    global _sync_client
+    with _lock:
+        if _sync_client is None:
+            import httpx
+            from openai import OpenAI
+
+            _sync_client = OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                timeout=_timeout(),
+                http_client=httpx.Client(limits=_limits(), timeout=_timeout()),
+            )
+        return _sync_client
+
+
+def async_openai_client() -> "AsyncOpenAI":
+    """Process-wide AsyncOpenAI client used by the request path."""
+    global _async_client
+    with _lock:
+        if _async_client is None:
+            import httpx
+            from openai import AsyncOpenAI
+
+            _async_client = AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                timeout=_timeout(),
+                http_client=httpx.AsyncClient(limits=_limits(), timeout=_timeout()),
+            )
+        return _async_client
+
+
+async def aclose_clients() -> None:
+    """Close pooled connections (application shutdown)."""
+    global _sync_client, _async_client
+    with _lock:
+        sync_client, async_client = _sync_client, _async_client
+        _sync_client = _async_client = None
+    if async_client is not None:
+        await async_client.close()
+    if sync_client is not None:
+        sync_client.close()
@@ -0,0 +1,272 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+
+from .utils import INDEX_DIR
+from .embedder import EMBED_MODEL, PROVIDER, embed_texts, prepare_text
+
+EMBED_CACHE_DIR = Path(os.getenv("EMBED_CACHE_DIR", str(INDEX_DIR / "embed_cache")))
+EMBED_CACHE_MAX_ROWS = int(os.getenv("EMBED_CACHE_MAX_ROWS", "200000"))
+
+_KEY_DTYPE = np.dtype([("key", "V20"), ("last_used", "<i8")])
+
+
+def _sync(f) -> None:
+    f.flush()
+    os.fsync(f.fileno())
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache, keyed by sha1(model + normalized text).
+
+    On-disk layout (one set per model, under EMBED_CACHE_DIR):
+      <slug>.json              - pointer: {"model", "dim", "rows", "epoch"}
+      <slug>.<epoch>.keys.npy  - (key, last_used) per row
+      <slug>.<epoch>.f32       - packed float32 vectors, row i <-> key i
+
+    New rows are appended to the blob on save(), after cutting it back to the
+    rows the pointer counts (a crashed save may have left more). When the cache
+    grows past max_rows, the least recently used rows are dropped and the
+    survivors are compacted into a new epoch. Files are fsynced and the pointer
+    is swapped last, so a crash never pairs keys with the wrong vectors.
+    """
+
+    def __init__(self, model: str = EMBED_MODEL, cache_dir: Path = EMBED_CACHE_DIR,
+                 max_rows: int = EMBED_CACHE_MAX_ROWS):
+        self.model = model
+        self.cache_dir = Path(cache_dir)
+        self.max_rows = max(1, int(max_rows))
+        self.slug = re.sub(r"[^A-Za-z0-9._-]+", "_", model)
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()      # one save() at a time; taken before _lock
+        self._index: Dict[bytes, int] = {}
+        self._last_used = np.zeros(0, dtype="int64")   # rows on disk
+        self._new_used: List[int] = []                  # rows in _new
+        self._disk: Optional[np.ndarray] = None   # memmap of rows already on disk
+        self._new: List[np.ndarray] = []          # rows added since the last save()
+        self._dim = 0
+        self._epoch = 0
+        self._clock = 0
+        self._load()
+
+    # ---- paths ----
+    def _pointer_path(self) -> Path:
+        return self.cache_dir / f"{self.slug}.json"
+
+    def _keys_path(self, epoch: int) -> Path:
+        return self.cache_dir / f"{self.slug}.{epoch}.keys.npy"
+
+    def _blob_path(self, epoch: int) -> Path:
+        return self.cache_dir / f"{self.slug}.{epoch}.f32"
+
+    def _load(self) -> None:
+        try:
+            ptr = json.loads(self._pointer_path().read_text(encoding="utf-8"))
+            if ptr.get("model") != self.model:
+                return
+            rows, dim, epoch = int(ptr["rows"]), int(ptr["dim"]), int(ptr["epoch"])
+            keys = np.load(self._keys_path(epoch))[:rows]
+            disk = np.memmap(self._blob_path(epoch), dtype="float32", mode="r", shape=(rows, dim)) if rows else None
+        except (OSError, ValueError, KeyError):
+            return
+
+        self._dim, self._epoch, self._disk = dim, epoch, disk
+        self._index = {k.tobytes(): i for i, k in enumerate(keys["key"])}
+        self._last_used = keys["last_used"].astype("int64")
+        self._clock = int(self._last_used.max()) + 1 if rows else 0
+
+    # ---- lookups ----
+    def key(self, text: str) -> bytes:
+        return hashlib.sha1(f"{self.model}\x00{prepare_text(text)}".encode("utf-8")).digest()
+
+    @property
+    def _n_disk(self) -> int:
+        return 0 if self._disk is None else self._disk.shape[0]
+
+    def _row(self, i: int) -> np.ndarray:
+        n = self._n_disk
+        return self._disk[i] if i < n else self._new[i - n]
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get_many(self, keys: List[bytes]) -> List[Optional[np.ndarray]]:
+        """Return the cached vector for each key (None on miss) and update hit/miss counts."""
+        out: List[Optional[np.ndarray]] = []
+        with self._lock:
+            for k in keys:
+                i = self._index.get(k)
+                if i is None:
+                    self.misses += 1
+                    out.append(None)
+                    continue
+                self.hits += 1
+                if i < self._n_disk:
+                    self._last_used[i] = self._clock
+                else:
+                    self._new_used[i - self._n_disk] = self._clock
+                self._clock += 1
+                out.append(np.array(self._row(i), dtype="float32"))
+        return out
+
+    def put_many(self, keys: List[bytes], vectors: np.ndarray) -> None:
+        with self._lock:
+            if vectors.size and not self._dim:
+                self._dim = int(vectors.shape[1])
+            for k, v in zip(keys, vectors):
+                if k in self._index:
+                    continue
+                self._index[k] = self._n_disk + len(self._new)
+                self._new.append(np.asarray(v, dtype="float32"))
+                self._new_used.append(self._clock)
+                self._clock += 1
+
+    # ---- persistence ----
+    def save(self) -> None:
+        """
+        Flush new rows to disk, evicting least recently used rows beyond max_rows.
+        State is snapshotted under the lock and the files are written without it,
+        so lookups are never blocked on disk I/O; rows put and clocks bumped
+        meanwhile are carried over when the new state is swapped in.
+        """
+        with self._save_lock:
+            with self._lock:
+                total = len(self._index)
+                if not total:
+                    return
+                disk, new = self._disk, list(self._new)
+                n_disk = self._n_disk
+                last_used = np.concatenate([self._last_used, np.array(self._new_used, dtype="int64")])
+                keys = np.empty(total, dtype=_KEY_DTYPE)
+                for k, i in self._index.items():
+                    keys[i] = (k, last_used[i])
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+            def row(i: int) -> np.ndarray:
+                n = 0 if disk is None else disk.shape[0]
+                return disk[i] if i < n else new[i - n]
+
+            if total <= self.max_rows:
+                # Append-only: previous rows keep their positions
+                if new:
+                    path = self._blob_path(self._epoch)
+                    with open(path, "r+b" if path.exists() else "wb") as f:
+                        f.truncate(n_disk * self._dim * 4)
+                        f.seek(0, os.SEEK_END)
+                        f.write(np.stack(new).astype("float32").tobytes())
+                        _sync(f)
+                self._write_keys(self._epoch, keys)
+                self._write_pointer(self._epoch, total)
+                with self._lock:
+                    self._reopen(self._epoch, keys, np.arange(total), len(new))
+                return
+
+            # Compact into a new epoch keeping the max_rows most recently used
+            keep = np.sort(np.argsort(last_used, kind="stable")[-self.max_rows:])
+            epoch = self._epoch + 1
+            with open(self._blob_path(epoch), "wb") as f:
+                for start in range(0, len(keep), 4096):
+                    block = [row(int(i)) for i in keep[start:start + 4096]]
+                    f.write(np.stack(block).astype("float32").tobytes())
+                _sync(f)
+            kept = keys[keep]
+            self._write_keys(epoch, kept)
+            self._write_pointer(epoch, len(kept))
+            old = self._epoch
+            with self._lock:
+                self._reopen(epoch, kept, keep, len(new))
+            for p in (self._keys_path(old), self._blob_path(old)):
+                p.unlink(missing_ok=True)
+            print(f"[embed-cache] Evicted {total - len(kept)} rows ({len(kept)} kept).")
+
+    def _write_keys(self, epoch: int, keys: np.ndarray) -> None:
+        tmp = self._keys_path(epoch).with_suffix(".tmp.npy")
+        with open(tmp, "wb") as f:
+            np.save(f, keys)
+            _sync(f)
+        os.replace(tmp, self._keys_path(epoch))
+
+    def _write_pointer(self, epoch: int, rows: int) -> None:
+        tmp = self._pointer_path().with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"model": self.model, "dim": self._dim, "rows": rows, "epoch": epoch}))
+            _sync(f)
+        os.replace(tmp, self._pointer_path())
+
+    def _reopen(self, epoch: int, keys: np.ndarray, source: np.ndarray, n_saved_new: int) -> None:
+        """
+        Switch to the saved epoch. `source` maps each saved row to its row before
+        save(); rows put after the first n_saved_new new ones stay in memory.
+        """
+        rows = len(keys)
+        last_used = np.concatenate([self._last_used, np.array(self._new_used, dtype="int64")])
+        pending_keys = [k for k, i in self._index.items() if i >= self._n_disk + n_saved_new]
+        pending, pending_used = self._new[n_saved_new:], self._new_used[n_saved_new:]
+
+        self._epoch = epoch
+        self._disk = np.memmap(self._blob_path(epoch), dtype="float32", mode="r", shape=(rows, self._dim))
+        self._index = {k.tobytes(): i for i, k in enumerate(keys["key"])}
+        self._last_used = last_used[source]
+        for i, k in enumerate(pending_keys):
+            self._index[k] = rows + i
+        self._new, self._new_used = list(pending), list(pending_used)
+
+
+_CACHE: Optional[EmbeddingCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_embed_cache() -> EmbeddingCache:
+    """Process-wide cache of chunk embeddings, filled by the indexer."""
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None or _CACHE.model != EMBED_MODEL:
+            _CACHE = EmbeddingCache()
+        return _CACHE
+
+
+def embed_cache_stats() -> Optional[Dict]:
+    """Size and hit counts of the process-wide cache; None if it was never loaded."""
+    cache = _CACHE
+    if cache is None:
+        return None
+    return {"size": len(cache), "hits": cache.hits, "misses": cache.misses}
+
+
+def embed_texts_cached(texts: List[str], cache: Optional[EmbeddingCache] = None) -> np.ndarray:
+    """
+    embed_texts() with a content-addressed cache in front of it.
+    Only texts whose (model, normalized text) key is missing are sent to the API,
+    and duplicates within one call are embedded once. Providers that are not
+    `cacheable` (local ones) are called directly.
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype="float32")
+    if not PROVIDER.cacheable:
+        return embed_texts(texts)
+    if cache is None:
+        cache = get_embed_cache()
+
+    keys = [cache.key(t) for t in texts]
+    rows = cache.get_many(keys)
+    todo: Dict[bytes, int] = {}
+    for i, (k, r) in enumerate(zip(keys, rows)):
+        if r is None and k not in todo:
+            todo[k] = i
+    if todo:
+        V = embed_texts([texts[i] for i in todo.values()])
+        cache.put_many(list(todo), V)
+        fresh = dict(zip(todo, V))
+        rows = [fresh[k] if r is None else r for k, r in zip(keys, rows)]
+    return np.stack(rows).astype("float32", copy=False)
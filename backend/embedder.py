@@ -1,22 +1,232 @@
+import asyncio
 import os
+import random
+import time
 import numpy as np
-from openai import OpenAI
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 
-# This client is used by indexer.py and retriever.py
-from dotenv import load_dotenv
-load_dotenv() 
+# Used by indexer.py (sync) and retriever.py (sync and async)
+from .clients import EMBED_TIMEOUT, async_openai_client, openai_client
+from . import hashing_embedder
 
-EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-large")
-_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Embedding backend:
+#   openai  - the embeddings API (EMBED_MODEL)
+#   hashing - local CPU embedder: hashed character n-grams, no network calls
+#             (backend/hashing_embedder.py; LOCAL_EMBED_DIM sets the width)
+# Vectors from different providers are not comparable, so an index records
+# the provider, model and dimension that built it and the retriever refuses
+# to serve an index built by anything else.
+EMBED_PROVIDER = os.getenv("EMBED_PROVIDER", "openai").strip().lower()
+OPENAI_EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-large")
+
+# ---- Batching / concurrency knobs ----
+# The embeddings API accepts up to 2048 inputs and ~300k tokens per request.
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "200000"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+EMBED_BACKOFF_BASE = float(os.getenv("EMBED_BACKOFF_BASE", "0.5"))
+EMBED_BACKOFF_MAX = float(os.getenv("EMBED_BACKOFF_MAX", "20"))
+
+
+@lru_cache(maxsize=None)
+def _transient_errors() -> Tuple[type, ...]:
+    """Network / 429 / 5xx error types (the SDK is imported only once it is used)."""
+    from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+    return APIConnectionError, APITimeoutError, RateLimitError, InternalServerError
+
+
+def prepare_text(text: str) -> str:
+    """Input normalization applied before embedding (the API rejects empty strings)."""
+    return text.replace("\n", " ") or " "
+
+
+def approx_tokens(text: str) -> int:
+    """Cheap token estimate (~4 chars/token for English) used for batch budgeting."""
+    return len(text) // 4 + 1
+
+
+def _batches(texts: List[str]) -> List[Tuple[int, int]]:
+    """
+    Split texts into contiguous [start, end) ranges that respect both
+    EMBED_BATCH_SIZE (input count) and EMBED_BATCH_TOKENS (token budget).
+    """
+    out: List[Tuple[int, int]] = []
+    start, tokens = 0, 0
+    for i, t in enumerate(texts):
+        n = approx_tokens(t)
+        if i > start and (i - start >= EMBED_BATCH_SIZE or tokens + n > EMBED_BATCH_TOKENS):
+            out.append((start, i))
+            start, tokens = i, 0
+        tokens += n
+    if start < len(texts):
+        out.append((start, len(texts)))
+    return out
+
+
+def _backoff(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(EMBED_BACKOFF_MAX, EMBED_BACKOFF_BASE * (2 ** attempt)))
+
+
+def _embed_batch(batch: List[str], model: str) -> List[List[float]]:
+    """One embeddings request, retried on transient (network / 429 / 5xx) errors."""
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        try:
+            # Retries are handled here so the backoff policy lives in one place
+            r = openai_client().with_options(max_retries=0).embeddings.create(
+                model=model, input=batch, timeout=EMBED_TIMEOUT)
+            # The API tags each row with its input index; don't rely on response order
+            return [d.embedding for d in sorted(r.data, key=lambda d: d.index)]
+        except _transient_errors() as e:
+            if attempt >= EMBED_MAX_RETRIES:
+                raise
+            delay = _backoff(attempt)
+            print(f"[embed] Transient error ({type(e).__name__}), retrying in {delay:.1f}s…")
+            time.sleep(delay)
+    raise RuntimeError("unreachable")
+
+
+async def _aembed_batch(batch: List[str], model: str) -> List[List[float]]:
+    """Async twin of _embed_batch (same retry/backoff policy)."""
+    client = async_openai_client().with_options(max_retries=0)
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        try:
+            r = await client.embeddings.create(model=model, input=batch, timeout=EMBED_TIMEOUT)
+            return [d.embedding for d in sorted(r.data, key=lambda d: d.index)]
+        except _transient_errors() as e:
+            if attempt >= EMBED_MAX_RETRIES:
+                raise
+            delay = _backoff(attempt)
+            print(f"[embed] Transient error ({type(e).__name__}), retrying in {delay:.1f}s…")
+            await asyncio.sleep(delay)
+    raise RuntimeError("unreachable")
+
+
+class EmbeddingProvider:
+    """
+    Turns texts into (n, dim) float32 rows, in input order.
+
+    `name` and `model` identify the vector space; `dim` is None when only the
+    service knows it. Providers with `cacheable` set sit behind the
+    persistent embedding cache (embed_cache.py); cheap local ones skip it.
+    """
+
+    name = ""
+    cacheable = True
+
+    def __init__(self, model: str, dim: Optional[int] = None):
+        self.model = model
+        self.dim = dim
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    async def aembed(self, texts: List[str]) -> np.ndarray:
+        return self.embed(texts)
+
+    def describe(self) -> Dict:
+        """What index.json records about the vectors (dim is added from the data)."""
+        return {"embed_provider": self.name, "embed_model": self.model}
+
+
+class OpenAIProvider(EmbeddingProvider):
+    name = "openai"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Inputs are grouped into multi-input requests by count and token budget,
+        up to EMBED_CONCURRENCY requests run at once, and rows are returned in
+        input order.
+        """
+        texts = [prepare_text(t) for t in texts]
+        if not texts:
+            return np.zeros((0, 0), dtype="float32")
+
+        ranges = _batches(texts)
+        if len(ranges) == 1:
+            return np.array(_embed_batch(texts, self.model), dtype="float32")
+
+        workers = max(1, min(EMBED_CONCURRENCY, len(ranges)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed") as pool:
+            # map() preserves submission order, so rows line up with the input
+            parts = list(pool.map(lambda r: _embed_batch(texts[r[0]:r[1]], self.model), ranges))
+
+        return np.array([row for part in parts for row in part], dtype="float32")
+
+    async def aembed(self, texts: List[str]) -> np.ndarray:
+        """
+        embed() for the request path: batches run as concurrent coroutines
+        (at most EMBED_CONCURRENCY at once) without blocking the loop.
+        """
+        texts = [prepare_text(t) for t in texts]
+        if not texts:
+            return np.zeros((0, 0), dtype="float32")
+
+        sem = asyncio.Semaphore(max(1, EMBED_CONCURRENCY))
+
+        async def run(r: Tuple[int, int]) -> List[List[float]]:
+            async with sem:
+                return await _aembed_batch(texts[r[0]:r[1]], self.model)
+
+        # gather() returns results in submission order
+        parts = await asyncio.gather(*(run(r) for r in _batches(texts)))
+        return np.array([row for part in parts for row in part], dtype="float32")
+
+
+class HashingProvider(EmbeddingProvider):
+    """Local hashed character n-gram vectors (see hashing_embedder.py)."""
+
+    name = "hashing"
+    # Recomputing is about as fast as a cache lookup
+    cacheable = False
+
+    def __init__(self, dim: int = hashing_embedder.LOCAL_EMBED_DIM):
+        lo, hi = hashing_embedder.NGRAM_MIN, hashing_embedder.NGRAM_MAX
+        super().__init__(f"char-ngram-{lo}-{hi}", int(dim))
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return hashing_embedder.hash_embed(texts, self.dim)
+
+
+def make_provider(name: str = EMBED_PROVIDER) -> EmbeddingProvider:
+    if name == "openai":
+        return OpenAIProvider(OPENAI_EMBED_MODEL)
+    if name == "hashing":
+        return HashingProvider()
+    raise ValueError(f"Unknown EMBED_PROVIDER: {name!r} (expected 'openai' or 'hashing')")
+
+
+PROVIDER = make_provider()
+# Identifies the vector space in cache keys and manifests
+EMBED_MODEL = PROVIDER.model
 
 
 def embed_texts(texts: List[str]) -> np.ndarray:
-    """Embeds a list of texts using the configured OpenAI model."""
-    texts = [t.replace("\n", " ") for t in texts]
-    out = []
-    # Batching loop for safety/efficiency
-    for t in texts:
-        r = _client.embeddings.create(model=EMBED_MODEL, input=t)
-        out.append(r.data[0].embedding)
-    return np.array(out, dtype="float32")
\ No newline at end of file
+    """Embeds a list of texts with the configured provider."""
+    return PROVIDER.embed(texts)
+
+
+async def aembed_texts(texts: List[str]) -> np.ndarray:
+    """embed_texts() for the request path."""
+    return await PROVIDER.aembed(texts)
+
+
+def index_incompatibility(info: Dict) -> Optional[str]:
+    """
+    Why an index (its index.json) cannot be searched with the configured
+    provider, or None if it can. Indexes from before providers were recorded
+    were built with the embeddings API.
+    """
+    provider = info.get("embed_provider", "openai")
+    if provider != PROVIDER.name:
+        return f"built with the {provider!r} embedding provider, but EMBED_PROVIDER is {PROVIDER.name!r}"
+    model = info.get("embed_model")
+    if model is not None and model != PROVIDER.model:
+        return f"built with embedding model {model!r}, but the configured model is {PROVIDER.model!r}"
+    dim = info.get("dim")
+    if PROVIDER.dim is not None and dim is not None and int(dim) != PROVIDER.dim:
+        return f"built with {dim}-dimensional vectors, but the provider produces {PROVIDER.dim}"
+    return None
@@ -0,0 +1,78 @@
+from __future__ import annotations
+import os
+from typing import List
+
+import numpy as np
+
+# Local CPU embedder (EMBED_PROVIDER=hashing): every character n-gram of the
+# lower-cased text (n in NGRAM_MIN..NGRAM_MAX, across word boundaries) is
+# hashed to one of LOCAL_EMBED_DIM signed buckets; counts are damped with
+# log1p and rows are L2-normalized. No model, no vocabulary and no network:
+# the whole batch is vectorized in NumPy. Retrieval quality is that of
+# fuzzy keyword matching, well below a learned embedding.
+LOCAL_EMBED_DIM = int(os.getenv("LOCAL_EMBED_DIM", "1024"))
+NGRAM_MIN = 3
+NGRAM_MAX = 5
+
+# Bytes kept as-is: ASCII letters and digits, and all non-ASCII (UTF-8) bytes.
+# Everything else becomes a space, and runs of spaces collapse to one.
+_KEEP = np.zeros(256, dtype=bool)
+_KEEP[ord("a"):ord("z") + 1] = True
+_KEEP[ord("0"):ord("9") + 1] = True
+_KEEP[128:] = True
+_SPACE = np.uint8(ord(" "))
+_SEP = "\x00"
+
+_PRIME = np.uint64(0x100000001B3)
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+
+
+def _normalized_bytes(texts: List[str]) -> np.ndarray:
+    """Normalized UTF-8 of all texts, each padded with spaces, separated by NUL."""
+    joined = _SEP.join(f" {t.replace(_SEP, ' ').lower()} " for t in texts)
+    b = np.frombuffer(joined.encode("utf-8"), dtype=np.uint8)
+    b = np.where(_KEEP[b] | (b == 0), b, _SPACE)
+    keep = np.ones(len(b), dtype=bool)
+    keep[1:] = (b[1:] != _SPACE) | (b[:-1] != _SPACE)
+    return b[keep]
+
+
+def hash_embed(texts: List[str], dim: int = LOCAL_EMBED_DIM,
+               ngram_min: int = NGRAM_MIN, ngram_max: int = NGRAM_MAX) -> np.ndarray:
+    """(len(texts), dim) float32 unit rows (all-zero for texts without n-grams)."""
+    n = len(texts)
+    if not n:
+        return np.zeros((0, dim), dtype="float32")
+    b = _normalized_bytes(texts)
+    sep = b == 0
+    row = np.cumsum(sep)
+    seps_before = np.concatenate([[0], row])
+    b64 = b.astype(np.uint64)
+
+    hashes, rows = [], []
+    for size in range(ngram_min, ngram_max + 1):
+        m = len(b) - size + 1
+        if m <= 0:
+            continue
+        h = np.full(m, size, dtype=np.uint64)
+        for k in range(size):
+            h = h * _PRIME + b64[k:k + m]
+        # Drop n-grams that straddle two texts
+        inside = seps_before[size:size + m] == seps_before[:m]
+        hashes.append(h[inside])
+        rows.append(row[:m][inside])
+    if not hashes:
+        return np.zeros((n, dim), dtype="float32")
+    h = np.concatenate(hashes)
+    # splitmix64 finalizer, so bucket and sign bits are well mixed
+    h = (h ^ (h >> np.uint64(30))) * _MIX1
+    h = (h ^ (h >> np.uint64(27))) * _MIX2
+    h ^= h >> np.uint64(31)
+
+    bucket = (h % np.uint64(dim)).astype(np.int64)
+    sign = np.where(h >> np.uint64(63), -1.0, 1.0)
+    V = np.bincount(np.concatenate(rows) * dim + bucket, weights=sign, minlength=n * dim).reshape(n, dim)
+    V = np.sign(V) * np.log1p(np.abs(V))
+    V /= np.linalg.norm(V, axis=1, keepdims=True) + 1e-8
+    return V.astype("float32")
@@ -0,0 +1,309 @@
+from __future__ import annotations
+import json
+import os
+import re
+import shutil
+import struct
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .utils import INDEX_DIR
+
+# Each build writes a complete index into its own generation directory
+# (data_index/gen-000042/). CURRENT names the live generation and is replaced
+# atomically, so readers only ever see a fully written index.
+CURRENT_FILE = "CURRENT"
+KEEP_GENERATIONS = int(os.getenv("INDEX_KEEP_GENERATIONS", "2"))
+
+# Embedding matrix: L2-normalized float32 rows in an uncompressed .npy, so it
+# can be memory-mapped (near-instant load, page cache shared across workers).
+MATRIX_FILE = "X.npy"
+LEGACY_MATRIX_FILE = "index.npz"
+
+# Optional compact copy of the matrix used for the coarse search pass:
+#   int8    - Xq.npy (int8 rows) + Xq_scale.npy (float32 per-row scale)
+# X.npy is still written; it is only touched to re-score a few candidates.
+# float16 was dropped: NumPy widens float16 to float32 without SIMD, so its
+# scans ran over 10x slower than exact ones while scanning twice the bytes of
+# int8 at the same recall. Builds asked for it use int8 instead (see
+# resolve_quantization), and older float16 generations (X16.npy) are searched
+# exactly.
+QUANTIZATIONS = {"none", "int8"}
+INDEX_QUANTIZATION = os.getenv("INDEX_QUANTIZATION", "none").strip().lower()
+INT8_FILE = "Xq.npy"
+INT8_SCALE_FILE = "Xq_scale.npy"
+
+# Small JSON record describing how a generation was built
+INFO_FILE = "index.json"
+
+# Rows per block when deriving the quantized copy from X.npy
+QUANTIZE_BLOCK_ROWS = int(os.getenv("INDEX_QUANTIZE_BLOCK_ROWS", "65536"))
+
+_GEN_RE = re.compile(r"^gen-(\d+)$")
+
+
+def _generations() -> List[Path]:
+    if not INDEX_DIR.exists():
+        return []
+    gens = [p for p in INDEX_DIR.iterdir() if p.is_dir() and _GEN_RE.match(p.name)]
+    return sorted(gens, key=generation_id)
+
+
+def generation_id(gen_dir: Path) -> int:
+    """Numeric id of a generation directory (0 for the legacy flat layout)."""
+    m = _GEN_RE.match(gen_dir.name)
+    return int(m.group(1)) if m else 0
+
+
+def current_generation_dir() -> Optional[Path]:
+    """
+    Directory holding the live index, or None if nothing has been built.
+    Falls back to the legacy layout (index files directly in INDEX_DIR).
+    """
+    pointer = INDEX_DIR / CURRENT_FILE
+    if pointer.exists():
+        name = pointer.read_text(encoding="utf-8").strip()
+        if name and (INDEX_DIR / name).is_dir():
+            return INDEX_DIR / name
+    if (INDEX_DIR / LEGACY_MATRIX_FILE).exists():
+        return INDEX_DIR
+    return None
+
+
+def normalize_rows(X: np.ndarray) -> np.ndarray:
+    X = np.asarray(X, dtype="float32")
+    return X / (np.linalg.norm(X, axis=1, keepdims=True) + 1e-8)
+
+
+def save_matrix(gen_dir: Path, X: np.ndarray) -> None:
+    """Write normalized float32 rows as gen_dir/X.npy."""
+    np.save(gen_dir / MATRIX_FILE, np.ascontiguousarray(normalize_rows(X)))
+
+
+def has_matrix(gen_dir: Path) -> bool:
+    return (gen_dir / MATRIX_FILE).exists() or (gen_dir / LEGACY_MATRIX_FILE).exists()
+
+
+def quantize_int8(X: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 quantization: X ~= Xq * scale[:, None]."""
+    scale = np.abs(X).max(axis=1) / 127.0
+    scale[scale == 0] = 1.0
+    Xq = np.clip(np.rint(X / scale[:, None]), -127, 127).astype("int8")
+    return Xq, scale.astype("float32")
+
+
+def quantize(X: np.ndarray, quantization: str) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """Coarse-search copy of normalized rows X: (matrix, int8 scales or None)."""
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown INDEX_QUANTIZATION: {quantization!r}")
+    if quantization == "int8":
+        return quantize_int8(np.asarray(X, dtype="float32"))
+    return None, None
+
+
+def resolve_quantization(quantization: str) -> str:
+    """Quantization a build actually uses for the configured setting."""
+    if quantization == "float16":
+        print("[index] INDEX_QUANTIZATION=float16 is no longer supported; using int8.")
+        return "int8"
+    return quantization
+
+
+def save_quantized(gen_dir: Path, X: np.ndarray, quantization: str) -> None:
+    """
+    Write the coarse-search copy of normalized rows X (no-op for "none").
+    X is read in blocks, so a memory-mapped X.npy is never loaded whole.
+    """
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown INDEX_QUANTIZATION: {quantization!r}")
+    if quantization == "none":
+        return
+    dim = X.shape[1]
+    writers = [NpyWriter(gen_dir / INT8_FILE, "int8", (dim,)),
+               NpyWriter(gen_dir / INT8_SCALE_FILE, "float32")]
+    try:
+        for start in range(0, X.shape[0], QUANTIZE_BLOCK_ROWS):
+            Xq, scale = quantize(X[start:start + QUANTIZE_BLOCK_ROWS], quantization)
+            writers[0].append(Xq)
+            if scale is not None:
+                writers[1].append(scale)
+    except BaseException:
+        for w in writers:
+            w.abort()
+        raise
+    for w in writers:
+        w.close()
+
+
+def load_quantized(gen_dir: Path, quantization: str) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """
+    Memory-map the coarse-search matrix and int8 scales recorded for a
+    generation; (None, None) means exact search, also for former float16 ones.
+    """
+    if quantization == "int8":
+        return (np.load(gen_dir / INT8_FILE, mmap_mode="r"),
+                np.load(gen_dir / INT8_SCALE_FILE))
+    return None, None
+
+
+class NpyWriter:
+    """
+    Append-only .npy writer for arrays whose row count is not known up front.
+
+    Space for the header is reserved when the file is opened and the real
+    header is written by close(). Rows go to <name>.tmp, which is renamed into
+    place only once complete, so a reader never maps a half-written file.
+    """
+
+    # Row count used to size the reserved header; the final one is never longer
+    _MAX_ROWS = 2 ** 62
+
+    def __init__(self, path: Path, dtype, row_shape: Tuple[int, ...] = ()):
+        self.path = Path(path)
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(int(d) for d in row_shape)
+        self.rows = 0
+        self._tmp = self.path.with_name(self.path.name + ".tmp")
+        self._header_size = len(self._header(self._MAX_ROWS))
+        self._f: Optional[BinaryIO] = open(self._tmp, "wb")
+        self._f.write(b"\0" * self._header_size)
+
+    def _header(self, rows: int, size: int = 0) -> bytes:
+        """Format 1.0 header, space-padded to `size` (default: next multiple of 64)."""
+        d = {"descr": np.lib.format.dtype_to_descr(self.dtype), "fortran_order": False,
+             "shape": (rows,) + self.row_shape}
+        body = repr(d).encode("latin1")
+        size = size or -(-(10 + len(body) + 1) // 64) * 64
+        return (b"\x93NUMPY\x01\x00" + struct.pack("<H", size - 10)
+                + body + b" " * (size - 11 - len(body)) + b"\n")
+
+    def append(self, rows: np.ndarray) -> None:
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        if rows.shape[1:] != self.row_shape:
+            raise ValueError(f"Row shape {rows.shape[1:]} does not match {self.row_shape} in {self.path.name}")
+        self._f.write(rows.tobytes())
+        self.rows += len(rows)
+
+    def append_raw(self, src: BinaryIO) -> None:
+        """Copy packed rows (same dtype and row shape) from an open binary file."""
+        row_bytes = self.dtype.itemsize * int(np.prod(self.row_shape, dtype="int64"))
+        copied = 0
+        for block in iter(lambda: src.read(1 << 24), b""):
+            self._f.write(block)
+            copied += len(block)
+        if copied % row_bytes:
+            raise ValueError(f"Truncated rows copied into {self.path.name}")
+        self.rows += copied // row_bytes
+
+    def close(self) -> None:
+        """Write the final header and move the file into place."""
+        self._f.seek(0)
+        self._f.write(self._header(self.rows, self._header_size))
+        self._f.close()
+        self._f = None
+        os.replace(self._tmp, self.path)
+
+    def abort(self) -> None:
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        self._tmp.unlink(missing_ok=True)
+
+
+class PartitionSpool:
+    """
+    Rows appended under a small integer partition key (the role code), spooled
+    to one scratch file per key. write_to() then emits them grouped by key in
+    ascending order, keeping arrival order within a key, so the role-grouped
+    row layout no longer needs every row in memory to sort.
+    """
+
+    def __init__(self, directory: Path, name: str):
+        self.directory = Path(directory)
+        self.name = name
+        self.counts: Dict[int, int] = {}
+        self._files: Dict[int, BinaryIO] = {}
+
+    def _path(self, key: int) -> Path:
+        return self.directory / f"{self.name}.part{key}"
+
+    def append(self, key: int, rows: np.ndarray) -> None:
+        f = self._files.get(key)
+        if f is None:
+            f = self._files[key] = open(self._path(key), "wb")
+        f.write(np.ascontiguousarray(rows).tobytes())
+        self.counts[key] = self.counts.get(key, 0) + len(rows)
+
+    def write_to(self, writer: NpyWriter) -> List[Tuple[int, int]]:
+        """Copy every partition into writer; returns [(key, rows)] in output order."""
+        for f in self._files.values():
+            f.flush()
+        for key in sorted(self._files):
+            with open(self._path(key), "rb") as src:
+                writer.append_raw(src)
+        return [(key, self.counts[key]) for key in sorted(self.counts)]
+
+    def close(self) -> None:
+        """Delete the scratch files."""
+        for key, f in self._files.items():
+            f.close()
+            self._path(key).unlink(missing_ok=True)
+        self._files.clear()
+
+
+def write_index_info(gen_dir: Path, **info) -> None:
+    (gen_dir / INFO_FILE).write_text(json.dumps(info, indent=2), encoding="utf-8")
+
+
+def read_index_info(gen_dir: Path) -> Dict:
+    """index.json of a generation ({} for generations built before it existed)."""
+    try:
+        return json.loads((gen_dir / INFO_FILE).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def load_matrix(gen_dir: Path) -> np.ndarray:
+    """
+    Normalized embedding matrix of a generation. X.npy is memory-mapped
+    read-only; a legacy index.npz is decompressed and normalized in memory.
+    """
+    if (gen_dir / MATRIX_FILE).exists():
+        return np.load(gen_dir / MATRIX_FILE, mmap_mode="r")
+    return normalize_rows(np.load(gen_dir / LEGACY_MATRIX_FILE)["X"])
+
+
+def new_generation_dir() -> Path:
+    """Create an empty directory for the next generation."""
+    gens = _generations()
+    next_id = generation_id(gens[-1]) + 1 if gens else 1
+    gen_dir = INDEX_DIR / f"gen-{next_id:06d}"
+    gen_dir.mkdir(parents=True, exist_ok=False)
+    return gen_dir
+
+
+def publish_generation(gen_dir: Path) -> None:
+    """Atomically point CURRENT at gen_dir, then prune old generations."""
+    tmp = INDEX_DIR / f"{CURRENT_FILE}.tmp"
+    tmp.write_text(gen_dir.name, encoding="utf-8")
+    os.replace(tmp, INDEX_DIR / CURRENT_FILE)
+    prune_generations(keep=KEEP_GENERATIONS)
+
+
+def discard_generation(gen_dir: Path) -> None:
+    """Remove a generation that failed before being published."""
+    shutil.rmtree(gen_dir, ignore_errors=True)
+
+
+def prune_generations(keep: int = KEEP_GENERATIONS) -> None:
+    """
+    Delete all but the newest `keep` generations. The live one is never removed;
+    readers that still hold memory from an older one are unaffected on POSIX.
+    """
+    live = current_generation_dir()
+    for gen_dir in _generations()[:-max(1, keep)]:
+        if live is not None and gen_dir.resolve() == live.resolve():
+            continue
+        shutil.rmtree(gen_dir, ignore_errors=True)
@@ -1,13 +1,46 @@
 from __future__ import annotations
+import argparse
+import hashlib
 import json
+import multiprocessing
+import os
+import queue
 import re
+import threading
+import time
+from array import array
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict
+from typing import Deque, Iterable, Iterator, List, Dict, Optional, Tuple
 import numpy as np
 
-from .utils import INDEX_DIR, DATA_DIR, ROLE_TO_DIRS
-from .chunker import chunk_text
-from .embedder import embed_texts
+from .utils import DATA_DIR, ROLE_TO_DIRS, ROLE_CODES
+from .chunker import chunk_spans
+from .embedder import EMBED_MODEL, PROVIDER, index_incompatibility
+from .embed_cache import get_embed_cache, embed_texts_cached
+from .ann import ANN_MIN_ROWS, ANN_RETRAIN_DRIFT, IVFIndex
+from .lexical import LexicalIndex
+from .metastore import MetaStore, MetaWriter
+from .metrics import INDEX_BUILD_SECONDS, METRICS_ENABLED
+from .index_store import (
+    current_generation_dir,
+    discard_generation,
+    generation_id,
+    has_matrix,
+    load_matrix,
+    INDEX_QUANTIZATION,
+    MATRIX_FILE,
+    new_generation_dir,
+    normalize_rows,
+    NpyWriter,
+    PartitionSpool,
+    publish_generation,
+    read_index_info,
+    resolve_quantization,
+    save_quantized,
+    write_index_info,
+)
 
 # --- Roles and regexes -------------------------------------------------------
 
@@ -52,10 +85,8 @@ def _read_text(path: Path) -> str:
             except ImportError:
                 return ""
             reader = PdfReader(str(path))
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() or ""
-            return text
+            # One join instead of repeated += (quadratic on long PDFs)
+            return "".join(page.extract_text() or "" for page in reader.pages)
         return path.read_text(encoding="utf-8", errors="ignore")
     except Exception:
         return ""
@@ -119,17 +150,280 @@ def find_files() -> List[Dict]:
     return files
 
 
-def build_index() -> None:
+MANIFEST_VERSION = 1
+
+# File reading/parsing/chunking runs on a process pool of INDEX_WORKERS
+# processes once at least INDEX_PARALLEL_MIN_FILES files need processing.
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", str(os.cpu_count() or 1)))
+INDEX_PARALLEL_MIN_FILES = int(os.getenv("INDEX_PARALLEL_MIN_FILES", "16"))
+
+# A build is a pipeline: files -> chunks (fed by the worker pool) -> batches of
+# INDEX_BATCH_ROWS rows -> embeddings -> rows appended to the new generation.
+# Stages run on their own threads and hand over through queues holding at most
+# INDEX_QUEUE_DEPTH batches, so the pipeline's memory does not grow with the
+# corpus. What still does, after the loop: the BM25 postings, the IVF
+# assignment, the row-origin map and MetaWriter's file/section tables.
+INDEX_BATCH_ROWS = int(os.getenv("INDEX_BATCH_ROWS", "512"))
+INDEX_QUEUE_DEPTH = int(os.getenv("INDEX_QUEUE_DEPTH", "4"))
+# New embedding-cache rows are flushed to disk after this many misses
+INDEX_CACHE_SAVE_ROWS = int(os.getenv("INDEX_CACHE_SAVE_ROWS", "2048"))
+
+# Serializes builds within one process (e.g. overlapping /documents/flag jobs)
+_BUILD_LOCK = threading.Lock()
+
+
+def _file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _load_previous() -> Optional[Tuple[Path, np.ndarray, MetaStore, Dict[str, Dict]]]:
+    """
+    Load the previous index (directory, matrix, metadata, manifest) so unchanged
+    files can reuse their rows. Returns None if anything is missing or inconsistent.
+    """
+    gen_dir = current_generation_dir()
+    if gen_dir is None:
+        return None
+    manifest_path = gen_dir / "manifest.json"
+    if not (has_matrix(gen_dir) and manifest_path.exists()):
+        return None
+    try:
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("embed_model") != EMBED_MODEL:
+            return None
+        reason = index_incompatibility(read_index_info(gen_dir))
+        if reason is not None:
+            print(f"[index] Previous index was {reason}; doing a full rebuild.")
+            return None
+        X = load_matrix(gen_dir)
+        meta = MetaStore.load(gen_dir)
+    except Exception as e:
+        print(f"[index] WARNING: Could not read previous index ({e}); doing a full rebuild.")
+        return None
+    if X.shape[0] != len(meta):
+        return None
+    return gen_dir, X, meta, manifest.get("files", {})
+
+
+def _process_file(path: Path, folder_role: str) -> Tuple[List[Dict], Dict[str, float]]:
+    """
+    Read, parse and chunk one file into sections: {"role", "contacts", "source",
+    "spans"}, where chunk i is source[spans[i][0]:spans[i][1]].
+    Also returns the seconds spent per stage. Runs in pool worker processes,
+    so it only returns data and leaves logging to the parent.
+    """
+    t0 = time.perf_counter()
+    raw = _read_text(path)
+    t1 = time.perf_counter()
+    if not raw.strip():
+        return [], {"read": t1 - t0}
+
+    sections = parse_sections(raw, fallback_role=folder_role)
+    t2 = time.perf_counter()
+
+    out: List[Dict] = []
+    for sec in sections:
+        category_role = sec["role"]    # public/internal/private from CATEGORY tag
+        body = sec["text"]
+
+        # Small header helps LLM see where this came from
+        header = (
+            f"FILE: {path.name}  "
+            f"FOLDER: {folder_role}  "
+            f"CATEGORY: {category_role}\n"
+        )
+
+        source, spans = chunk_spans(header + body)
+        out.append(
+            {
+                "role": category_role,
+                "contacts": extract_contacts(body),
+                "source": source,
+                "spans": spans,
+            }
+        )
+    t3 = time.perf_counter()
+    return out, {"read": t1 - t0, "parse": t2 - t1, "chunk": t3 - t2}
+
+
+def _process_files(jobs: List[Tuple[Path, str]]) -> Iterator[Tuple[List[Dict], Dict[str, float]]]:
+    """
+    _process_file over many files, fanned out over a process pool when there
+    are enough of them. Results are yielded in job order, so row order does
+    not depend on which worker finishes first, and only a few files per
+    worker are in flight at any time.
+    """
+    workers = min(INDEX_WORKERS, len(jobs))
+    if workers <= 1 or len(jobs) < INDEX_PARALLEL_MIN_FILES:
+        for job in jobs:
+            yield _process_file(*job)
+        return
+    # spawn: build_index also runs on a server thread, where fork is unsafe
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        pending: Deque[Future] = deque()
+        for job in jobs:
+            pending.append(pool.submit(_process_file, *job))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _batched(items: Iterable, size: int) -> Iterator[List]:
+    batch: List = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _prefetch(items: Iterable, depth: int = INDEX_QUEUE_DEPTH) -> Iterator:
+    """
+    Drain `items` on a background thread, at most `depth` items ahead of the
+    consumer. Errors are re-raised in the consumer; if the consumer stops
+    early, the producer stops at its next item.
+    """
+    q: "queue.Queue" = queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+    end = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run() -> None:
+        try:
+            for item in items:
+                if not put((item, None)):
+                    break
+            else:
+                put((end, None))
+        except BaseException as e:
+            put((end, e))
+        finally:
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+
+    threading.Thread(target=run, name="index-pipeline", daemon=True).start()
+    try:
+        while True:
+            item, error = q.get()
+            if item is end:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def _build_ivf(gen_dir: Path, X: np.ndarray, codes: np.ndarray, row_origin: np.ndarray,
+               previous: Optional[Tuple[Path, int]]) -> Dict:
+    """
+    Save the IVF index of gen_dir and return its index.json entry. Given the
+    previous generation (directory, rows), its centroids are kept and only the
+    new rows are assigned, as long as the dimension matches and the row count
+    is within ANN_RETRAIN_DRIFT of the count they were trained on; otherwise
+    k-means runs again.
+    """
+    n, dim = X.shape
+    ivf = None
+    if previous is not None:
+        prev_dir, prev_rows = previous
+        try:
+            old = IVFIndex.load(prev_dir)
+        except (OSError, ValueError):
+            old = None
+        if old is not None and old.centroids.shape[1] == dim and len(old.rows) == prev_rows:
+            trained_rows = int((read_index_info(prev_dir).get("ann") or {}).get("trained_rows", prev_rows))
+            if abs(n - trained_rows) <= ANN_RETRAIN_DRIFT * trained_rows:
+                print(f"[index] Reusing IVF centroids trained over {trained_rows} rows ({n} rows now).")
+                ivf = old.updated(X, codes, row_origin)
+    if ivf is None:
+        print(f"[index] Training IVF index over {n} rows…")
+        ivf = IVFIndex.train(X, codes)
+        trained_rows = n
+    ivf.save(gen_dir)
+    return {"type": "ivf", "nlist": ivf.nlist, "trained_rows": trained_rows}
+
+
+def _build_lexical(gen_dir: Path, row_origin: np.ndarray,
+                   previous: Optional[Tuple[Path, int]]) -> LexicalIndex:
+    """
+    BM25 postings over the rows of gen_dir, in the same order, with texts read
+    back from disk. Given the previous generation (directory, rows), its
+    postings are merged with those of the new rows only (row_origin < 0), so
+    an incremental build tokenizes just the chunks it embedded.
+    """
+    meta = MetaStore.load(gen_dir)
+    if previous is not None:
+        prev_dir, prev_rows = previous
+        try:
+            old = LexicalIndex.load(prev_dir)
+        except (OSError, ValueError) as e:
+            print(f"[index] WARNING: Could not read previous BM25 index ({e}); rebuilding it.")
+            old = None
+        if old is not None and old.n_docs == prev_rows:
+            new_rows = np.flatnonzero(row_origin < 0)
+            return old.updated(row_origin, ((int(i), meta.text(int(i))) for i in new_rows))
+    return LexicalIndex.build(meta.text(i) for i in range(len(meta)))
+
+
+def build_index(full: bool = False) -> Optional[Path]:
+    """
+    Build (or incrementally update) the index into a new generation
+    directory and publish it. Returns the generation directory, or None
+    if there was nothing to index.
+
+    A manifest of path/size/mtime/content hash is kept next to the index.
+    Files whose manifest entry still matches reuse their previous rows;
+    only added or changed files are re-read, re-chunked and re-embedded,
+    and deleted files simply drop out. Pass full=True to ignore the
+    previous index entirely.
+    """
+    with _BUILD_LOCK:
+        return _build_index(full)
+
+
+def _build_index(full: bool) -> Optional[Path]:
     print("\n[index] Rebuilding index...\n")
 
     file_entries = find_files()
     if not file_entries:
         print("[index] No documents found.")
-        return
-
-    all_texts: List[str] = []
-    all_meta: List[Dict] = []
-
+        return None
+
+    previous = None if full else _load_previous()
+    old_rows: Dict[str, np.ndarray] = {}
+    old_files: Dict[str, Dict] = {}
+    if previous is not None:
+        prev_dir, X_old, meta_old, old_files = previous
+        fids = meta_old.file_ids
+        by_file = np.argsort(fids, kind="stable")
+        bounds = np.searchsorted(fids[by_file], np.arange(1, len(meta_old.files)))
+        for f, rows in zip(meta_old.files, np.split(by_file, bounds)):
+            old_rows[f["path"]] = rows
+
+    manifest_files: Dict[str, Dict] = {}
+    stats = {"unchanged": 0, "changed": 0, "added": 0}
+    timings: Dict[str, float] = {"read": 0.0, "parse": 0.0, "chunk": 0.0, "embed": 0.0, "write": 0.0}
+
+    # Pass 1: decide per file whether its previous rows can be reused
+    plan: List[Tuple[str, Path, str, bool]] = []
     for entry in file_entries:
         path: Path = entry["path"]
         folder_role: str = entry["folder_role"]
@@ -138,60 +432,207 @@ def build_index() -> None:
         if path.name.endswith("_meta.txt"):
             continue
 
-        raw = _read_text(path)
-        if not raw.strip():
-            continue
-
-        sections = parse_sections(raw, fallback_role=folder_role)
-
-        print(f"[index] File: {path.name}")
-        print(f"        Folder role: {folder_role}")
-        print(f"        Section roles: {[s['role'] for s in sections]}")
-
-        for sec in sections:
-            category_role = sec["role"]    # public/internal/private from CATEGORY tag
-            body = sec["text"]
-            contacts = extract_contacts(body)
-
-            # Small header helps LLM see where this came from
-            header = (
-                f"FILE: {path.name}  "
-                f"FOLDER: {folder_role}  "
-                f"CATEGORY: {category_role}\n"
-            )
-
-            chunks = chunk_text(header + body)
-            for idx, ch in enumerate(chunks):
-                all_texts.append(ch)
-                all_meta.append(
-                    {
-                        "path": str(path.resolve()),
-                        "folder_role": folder_role,      # physical folder
-                        "category_role": category_role,  # sensitivity tag
-                        "chunk_id": idx,
-                        "chunk_text": ch,
-                        "contacts": contacts,
-                    }
-                )
-
-    if not all_texts:
-        print("[index] Nothing to embed.")
-        return
-
-    print(f"[index] Embedding {len(all_texts)} chunks…")
+        key = str(path.resolve())
+        st = path.stat()
+        prev = old_files.get(key)
+        record = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "folder_role": folder_role}
+
+        reuse = False
+        if prev and prev.get("folder_role") == folder_role and prev.get("size") == st.st_size:
+            if prev.get("mtime_ns") == st.st_mtime_ns:
+                record["sha256"] = prev.get("sha256")
+                reuse = True
+            else:
+                # Touched but maybe not modified: fall back to the content hash
+                record["sha256"] = _file_digest(path)
+                reuse = record["sha256"] == prev.get("sha256")
+        else:
+            record["sha256"] = _file_digest(path)
+
+        if reuse:
+            stats["unchanged"] += 1
+        else:
+            stats["changed" if prev else "added"] += 1
+        manifest_files[key] = record
+        plan.append((key, path, folder_role, reuse))
+
+    removed = len(set(old_files) - set(manifest_files))
+    print(
+        f"[index] Files: {stats['added']} added, {stats['changed']} changed, "
+        f"{stats['unchanged']} unchanged, {removed} removed."
+    )
 
-    # Batch embedding (simple version; could batch in chunks if huge)
-    X = np.array(embed_texts(all_texts), dtype="float32")
+    def chunk_rows() -> Iterator[Tuple]:
+        """
+        Pass 2: every output row in file order, as ("old", old row, part) or
+        ("new", text, path, folder_role, section key, section, chunk_id, part);
+        `part` is the role code rows are grouped by.
+        """
+        processed = _process_files([(path, role) for _, path, role, reuse in plan if not reuse])
+        for key, path, folder_role, reuse in plan:
+            record = manifest_files[key]
+            if reuse:
+                rows = old_rows.get(key, np.zeros(0, dtype="int64"))
+                codes = np.asarray(meta_old.chunks["role"][rows]) if len(rows) else rows
+                for i, code in zip(rows, codes):
+                    yield ("old", int(i), int(code))
+                record["rows"] = len(rows)
+                continue
 
-    INDEX_DIR.mkdir(parents=True, exist_ok=True)
-    np.savez_compressed(INDEX_DIR / "index.npz", X=X)
-    (INDEX_DIR / "meta.json").write_text(
-        json.dumps(all_meta, ensure_ascii=False, indent=2),
-        encoding="utf-8",
+            sections, file_timings = next(processed)
+            for stage, secs in file_timings.items():
+                timings[stage] += secs
+            if sections:
+                print(f"[index] File: {path.name}")
+                print(f"        Folder role: {folder_role}")
+                print(f"        Section roles: {[s['role'] for s in sections]}")
+
+            n = 0
+            for s_idx, sec in enumerate(sections):
+                part = ROLE_CODES.get(sec["role"], len(ROLE_CODES))
+                source = sec["source"]
+                for c_idx, (a, b) in enumerate(sec["spans"]):
+                    yield ("new", source[a:b], key, folder_role, (key, s_idx), sec, c_idx, part)
+                    n += 1
+            record["rows"] = n
+
+    cache = get_embed_cache()
+    hits0, misses0 = cache.hits, cache.misses
+
+    def embedded(batches: Iterable[List[Tuple]]) -> Iterator[Tuple[List[Tuple], np.ndarray]]:
+        """
+        Stage 3: normalized vectors for each batch. Only new/changed chunk
+        texts reach the API (the rest come from the cache); reused rows are
+        read back from the previous matrix.
+        """
+        unsaved = 0
+        for batch in batches:
+            t0 = time.perf_counter()
+            new = [i for i, r in enumerate(batch) if r[0] == "new"]
+            old = [i for i, r in enumerate(batch) if r[0] == "old"]
+            misses = cache.misses
+            V_new = embed_texts_cached([batch[i][1] for i in new], cache) if new else None
+            V_old = np.asarray(X_old[[batch[i][1] for i in old]]) if old else None
+            unsaved += cache.misses - misses
+            if unsaved >= INDEX_CACHE_SAVE_ROWS:
+                cache.save()
+                unsaved = 0
+            V = np.empty((len(batch), (V_new if new else V_old).shape[1]), dtype="float32")
+            if new:
+                V[new] = V_new
+            if old:
+                V[old] = V_old
+            timings["embed"] += time.perf_counter() - t0
+            yield batch, normalize_rows(V)
+        cache.save()
+
+    t_start = time.perf_counter()
+    gen_dir = new_generation_dir()
+    writer = MetaWriter(gen_dir)
+    X_spool = PartitionSpool(gen_dir, MATRIX_FILE)
+    n_new = 0
+    dim = 0
+    refs: List[Tuple[int, int]] = []
+    # Previous row id (-1 for new rows) of every row, per part like X_spool
+    origins: Dict[int, array] = {}
+    try:
+        # Stage 4: append rows as they arrive; both the matrix and the chunk
+        # records are spooled per role and concatenated in role order below,
+        # so each role is one contiguous block the retriever can score as a slice.
+        for batch, V in _prefetch(embedded(_prefetch(_batched(chunk_rows(), INDEX_BATCH_ROWS)))):
+            t0 = time.perf_counter()
+            dim = V.shape[1]
+            parts = np.array([r[-1] for r in batch])
+            for part in np.unique(parts):
+                X_spool.append(int(part), V[parts == part])
+            for r in batch:
+                origins.setdefault(r[-1], array("q")).append(r[1] if r[0] == "old" else -1)
+                if r[0] == "old":
+                    writer.copy_row(meta_old, r[1], part=r[2])
+                else:
+                    _, text, path, folder_role, sec_key, sec, chunk_id, part = r
+                    if chunk_id == 0:
+                        # The section's text is stored once; its chunks are spans of it
+                        refs = writer.add_source(sec["source"], sec["spans"])
+                    writer.add_chunk(path, folder_role, sec_key, sec["role"], sec["contacts"], chunk_id,
+                                     part=part, ref=refs[chunk_id])
+                    n_new += 1
+            timings["write"] += time.perf_counter() - t0
+
+        if not writer.rows:
+            print("[index] Nothing to embed.")
+            writer.abort()
+            X_spool.close()
+            discard_generation(gen_dir)
+            return None
+        print(f"[index] Embedded {n_new} new chunks ({writer.rows} total).")
+
+        t0 = time.perf_counter()
+        writer.close()
+        X_writer = NpyWriter(gen_dir / MATRIX_FILE, "float32", (dim,))
+        layout = X_spool.write_to(X_writer)
+        X_spool.close()
+        X_writer.close()
+
+        X_norm = load_matrix(gen_dir)
+        quantization = resolve_quantization(INDEX_QUANTIZATION)
+        save_quantized(gen_dir, X_norm, quantization)
+        row_origin = np.concatenate([np.frombuffer(origins.pop(key), dtype="int64") for key, _ in layout])
+        reusable = None if previous is None else (prev_dir, len(meta_old))
+        ann = None
+        if X_norm.shape[0] >= ANN_MIN_ROWS:
+            codes = np.repeat([key for key, _ in layout], [n for _, n in layout])
+            ann = _build_ivf(gen_dir, X_norm, codes, row_origin, reusable)
+        lex = _build_lexical(gen_dir, row_origin, reusable)
+        lex.save(gen_dir)
+        write_index_info(
+            gen_dir,
+            rows=int(X_norm.shape[0]),
+            dim=int(X_norm.shape[1]),
+            **PROVIDER.describe(),
+            quantization=quantization,
+            ann=ann,
+            lexical={"type": "bm25", "terms": len(lex.terms), "postings": lex.n_postings},
+        )
+        (gen_dir / "manifest.json").write_text(
+            json.dumps(
+                {"version": MANIFEST_VERSION, "embed_model": EMBED_MODEL, "files": manifest_files},
+                ensure_ascii=False,
+            ),
+            encoding="utf-8",
+        )
+    except BaseException:
+        writer.abort()
+        X_spool.close()
+        discard_generation(gen_dir)
+        raise
+    publish_generation(gen_dir)
+    timings["write"] += time.perf_counter() - t0
+
+    if PROVIDER.cacheable:
+        print(
+            f"[index] Embedding cache: {cache.hits - hits0} hits, "
+            f"{cache.misses - misses0} misses ({len(cache)} cached rows)."
+        )
+    # Stages overlap, so the per-stage times (read/parse/chunk summed over
+    # files, across workers when parallel) can add up to more than the wall time
+    timings["wall"] = time.perf_counter() - t_start
+    if METRICS_ENABLED:
+        for phase, secs in timings.items():
+            INDEX_BUILD_SECONDS.observe(secs, phase)
+    print(
+        "[index] Timings: "
+        + ", ".join(f"{stage} {secs:.2f}s" for stage, secs in timings.items() if stage != "wall")
+        + f" (wall {timings['wall']:.2f}s)"
     )
-
-    print(f"[index] ✅ Index built successfully with {len(all_texts)} chunks.\n")
+    print(
+        f"[index] ✅ Index generation {generation_id(gen_dir)} built successfully "
+        f"with {writer.rows} chunks.\n"
+    )
+    return gen_dir
 
 
 if __name__ == "__main__":
-    build_index()
+    parser = argparse.ArgumentParser(description="Build the retrieval index.")
+    parser.add_argument("--full", action="store_true", help="ignore the previous index and rebuild everything")
+    build_index(full=parser.parse_args().full)
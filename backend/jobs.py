@@ -0,0 +1,70 @@
+from __future__ import annotations
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+MAX_TRACKED_JOBS = 200
+
+
+class RebuildQueue:
+    """
+    Runs index rebuilds on one background worker thread and tracks their status.
+
+    A flag that arrives while a rebuild is still queued joins that job instead
+    of enqueuing another one: the queued build has not scanned the tree yet,
+    so it will pick up the new file too.
+    """
+
+    def __init__(self):
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reindex")
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, Dict]" = OrderedDict()
+        self._pending: Optional[str] = None
+
+    def submit(self, fn: Callable[[], Optional[int]]) -> Dict:
+        """Schedule fn (returning the published generation) and return its job record."""
+        with self._lock:
+            if self._pending is not None:
+                return dict(self._jobs[self._pending])
+
+            job_id = uuid.uuid4().hex[:12]
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "status": "queued",
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "generation": None,
+                "error": None,
+            }
+            while len(self._jobs) > MAX_TRACKED_JOBS:
+                self._jobs.popitem(last=False)
+            self._pending = job_id
+            self._pool.submit(self._run, job_id, fn)
+            return dict(self._jobs[job_id])
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _update(self, job_id: str, **fields) -> None:
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def _run(self, job_id: str, fn: Callable[[], Optional[int]]) -> None:
+        with self._lock:
+            self._pending = None
+        self._update(job_id, status="running", started_at=time.time())
+        try:
+            generation = fn()
+        except Exception as e:
+            traceback.print_exc()
+            self._update(job_id, status="failed", error=str(e), finished_at=time.time())
+            return
+        self._update(job_id, status="done", generation=generation, finished_at=time.time())
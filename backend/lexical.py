@@ -0,0 +1,305 @@
+from __future__ import annotations
+import json
+import math
+import os
+import re
+from collections import Counter
+from itertools import chain
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .ann import top_k_positions
+
+# BM25 inverted index over chunk text, stored in the generation directory:
+#   lex_terms.json   - vocabulary; a term's position is its id
+#   lex_offsets.npy  - postings of term t are [offsets[t], offsets[t + 1])
+#   lex_rows.npy     - row ids (ascending within each term)
+#   lex_tf.npy       - term frequency of each posting
+#   lex_doclen.npy   - tokens per row
+#   lex_weight.npy   - BM25 term-frequency factor of each posting, precomputed
+#                      from tf and doclen so queries only multiply by idf
+# Scoring needs no embedding call, so it also serves as a fallback when the
+# embedding service is slow or unavailable.
+BM25_K1 = float(os.getenv("LEXICAL_BM25_K1", "1.2"))
+BM25_B = float(os.getenv("LEXICAL_BM25_B", "0.75"))
+
+TERMS_FILE = "lex_terms.json"
+# Postings collected as Python ints before being packed into arrays, and
+# postings per block when they are scattered into place (build)
+BUILD_FLUSH_POSTINGS = 1 << 16
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Function words occur in nearly every chunk: they carry almost no BM25 weight
+# but would make up most of the postings a query has to scan.
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have how i if in is it its of on or "
+    "our so that the their there these this to was we were what when where which "
+    "who will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased alphanumeric runs ("CS-101" -> ["cs", "101"]), minus stopwords."""
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class _Postings:
+    """
+    (term id, row, tf) postings and doc lengths of tokenized texts, packed into
+    numpy blocks every BUILD_FLUSH_POSTINGS postings instead of Python lists.
+    """
+
+    def __init__(self, vocab: Dict[str, int]):
+        self.vocab = vocab
+        self.blocks: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self.doc_blocks: List[Tuple[np.ndarray, np.ndarray]] = []
+        self._tids: List[int] = []
+        self._rows: List[int] = []
+        self._tfs: List[int] = []
+        self._doc_rows: List[int] = []
+        self._doclen: List[int] = []
+
+    def add(self, row: int, text: str) -> None:
+        tokens = tokenize(text)
+        self._doc_rows.append(row)
+        self._doclen.append(len(tokens))
+        for term, n in Counter(tokens).items():
+            self._tids.append(self.vocab.setdefault(term, len(self.vocab)))
+            self._rows.append(row)
+            self._tfs.append(n)
+        if len(self._tids) >= BUILD_FLUSH_POSTINGS:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._tids:
+            self.blocks.append((np.array(self._tids, dtype="int32"), np.array(self._rows, dtype="int32"),
+                                np.minimum(np.array(self._tfs, dtype="int64"), np.iinfo("uint16").max)
+                                .astype("uint16")))
+        if self._doc_rows:
+            self.doc_blocks.append((np.array(self._doc_rows, dtype="int64"), np.array(self._doclen, dtype="int32")))
+        for buf in (self._tids, self._rows, self._tfs, self._doc_rows, self._doclen):
+            buf.clear()
+
+    def counts(self) -> np.ndarray:
+        """Postings per term id."""
+        counts = np.zeros(len(self.vocab), dtype="int64")
+        for tids, _, _ in self.blocks:
+            counts += np.bincount(tids, minlength=len(self.vocab))
+        return counts
+
+    def docs(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, token counts) of the added texts."""
+        if not self.doc_blocks:
+            return np.zeros(0, dtype="int64"), np.zeros(0, dtype="int32")
+        return (np.concatenate([b[0] for b in self.doc_blocks]),
+                np.concatenate([b[1] for b in self.doc_blocks]))
+
+    def drain(self) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Yield the posting blocks in order, releasing each one."""
+        self.blocks.reverse()
+        while self.blocks:
+            yield self.blocks.pop()
+
+
+def _sort_within_terms(offsets: np.ndarray, rows: np.ndarray, tf: np.ndarray, n_docs: int) -> None:
+    """Sort rows (and tf alongside) within each term, a group of terms at a time."""
+    group = BUILD_FLUSH_POSTINGS * 16
+    t0, n_terms = 0, len(offsets) - 1
+    while t0 < n_terms:
+        a = int(offsets[t0])
+        t1 = max(t0 + 1, int(np.searchsorted(offsets, a + group, side="right")) - 1)
+        t1 = min(t1, n_terms)
+        b = int(offsets[t1])
+        r = rows[a:b]
+        descending = r[1:] <= r[:-1]
+        descending[offsets[t0 + 1:t1] - a - 1] = False   # term boundaries
+        if descending.any():
+            local = np.repeat(np.arange(t1 - t0, dtype="int64"), np.diff(offsets[t0:t1 + 1]))
+            order = np.argsort(local * max(n_docs, 1) + r)
+            rows[a:b] = r[order]
+            tf[a:b] = tf[a:b][order]
+        t0 = t1
+
+
+class LexicalIndex:
+    ARRAYS = ("offsets", "rows", "tf", "doclen", "weight")
+
+    def __init__(self, terms: List[str], offsets: np.ndarray, rows: np.ndarray,
+                 tf: np.ndarray, doclen: np.ndarray, weight: np.ndarray):
+        self.terms = terms
+        self.vocab: Dict[str, int] = {t: i for i, t in enumerate(terms)}
+        self.offsets = offsets
+        self.rows = rows
+        self.tf = tf
+        self.doclen = doclen
+        self.weight = weight
+        self.n_docs = len(doclen)
+
+    @property
+    def n_postings(self) -> int:
+        return len(self.rows)
+
+    # ---- build ----
+    @classmethod
+    def build(cls, texts: Iterable[str]) -> "LexicalIndex":
+        """
+        Index texts in row order. Texts may be a generator: postings are packed
+        into compact arrays as they accumulate and then scattered block by
+        block into their final place, so build memory stays close to the size
+        of the finished index.
+        """
+        vocab: Dict[str, int] = {}
+        acc = _Postings(vocab)
+        for row, text in enumerate(texts):
+            acc.add(row, text)
+        acc.flush()
+        _, dl = acc.docs()
+        # Blocks come in row order, so rows are already ascending within each term
+        return cls._pack(list(vocab), acc.counts(), acc.drain(), dl, rows_sorted=True)
+
+    def updated(self, row_origin: np.ndarray, new_texts: Iterable[Tuple[int, str]]) -> "LexicalIndex":
+        """
+        The index of a new generation whose row i is row row_origin[i] of this
+        one, or a new row when row_origin[i] < 0; new_texts yields (row, text)
+        for exactly those. Reused postings are remapped rather than re-tokenized,
+        rows that are gone drop out, and weights and doc-frequencies are
+        recomputed over the merged rows. Equal to build() over the new rows up
+        to the order of term ids.
+        """
+        n = len(row_origin)
+        reused = row_origin >= 0
+        old_to_new = np.full(self.n_docs, -1, dtype="int64")
+        old_to_new[row_origin[reused]] = np.flatnonzero(reused)
+        dl = np.zeros(n, dtype="int32")
+        dl[reused] = self.doclen[row_origin[reused]]
+
+        vocab = dict(self.vocab)
+        acc = _Postings(vocab)
+        for row, text in new_texts:
+            acc.add(row, text)
+        acc.flush()
+        doc_rows, doc_len = acc.docs()
+        dl[doc_rows] = doc_len
+
+        counts = acc.counts()
+        for tids, _, _ in self._remapped(old_to_new):
+            counts[:len(self.terms)] += np.bincount(tids, minlength=len(self.terms))
+        blocks = chain(self._remapped(old_to_new), acc.drain())
+        return type(self)._pack(list(vocab), counts, blocks, dl, rows_sorted=False)
+
+    def _remapped(self, old_to_new: np.ndarray) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """This index's postings in blocks, rows mapped through old_to_new (< 0: dropped)."""
+        offsets = np.asarray(self.offsets)
+        for a in range(0, self.n_postings, BUILD_FLUSH_POSTINGS):
+            b = min(a + BUILD_FLUSH_POSTINGS, self.n_postings)
+            rows = old_to_new[np.asarray(self.rows[a:b])]
+            keep = rows >= 0
+            tids = (np.searchsorted(offsets, np.arange(a, b), side="right") - 1).astype("int32")
+            yield tids[keep], rows[keep].astype("int32"), np.asarray(self.tf[a:b])[keep]
+
+    @classmethod
+    def _pack(cls, terms: List[str], counts: np.ndarray, blocks: Iterable[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+              dl: np.ndarray, rows_sorted: bool) -> "LexicalIndex":
+        """
+        Index from blocks of (term ids, rows, tf) postings, counts[t] of them for
+        term t. Each block is scattered straight to its final positions, so only
+        the finished arrays and one block are in memory. Terms without postings
+        are dropped; unless rows_sorted, rows are then sorted within each term.
+        """
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype("int64")
+        row_arr = np.empty(int(offsets[-1]), dtype="int32")
+        tf = np.empty(int(offsets[-1]), dtype="uint16")
+        cursor = offsets[:-1].copy()
+        for tids, rows, tfs in blocks:
+            if not len(tids):
+                continue
+            # Stable, so postings of a term keep their block order
+            order = np.argsort(tids, kind="stable")
+            t = tids[order]
+            first = np.flatnonzero(np.concatenate([[True], t[1:] != t[:-1]]))
+            run = np.diff(np.append(first, len(t)))
+            dest = cursor[t] + np.arange(len(t)) - np.repeat(first, run)
+            row_arr[dest] = rows[order]
+            tf[dest] = tfs[order]
+            cursor[t[first]] += run
+
+        live = counts > 0
+        if not live.all():
+            terms = [term for term, alive in zip(terms, live) if alive]
+            offsets = np.concatenate([offsets[:-1][live], offsets[-1:]])
+        if not rows_sorted:
+            _sort_within_terms(offsets, row_arr, tf, len(dl))
+
+        avgdl = float(dl.mean()) if len(dl) else 1.0
+        weight = np.empty(len(row_arr), dtype="float32")
+        # In blocks, to bound the float64 temporaries
+        for a in range(0, len(row_arr), BUILD_FLUSH_POSTINGS):
+            b = a + BUILD_FLUSH_POSTINGS
+            tf_f = tf[a:b].astype("float32")
+            norm = BM25_K1 * (1.0 - BM25_B + BM25_B * dl[row_arr[a:b]] / max(avgdl, 1e-9))
+            weight[a:b] = tf_f * (BM25_K1 + 1.0) / (tf_f + norm)
+        return cls(terms, offsets, row_arr, tf, dl, weight)
+
+    # ---- persistence ----
+    def save(self, directory: Path) -> None:
+        (directory / TERMS_FILE).write_text(json.dumps(self.terms, ensure_ascii=False), encoding="utf-8")
+        for name in self.ARRAYS:
+            np.save(directory / f"lex_{name}.npy", getattr(self, name))
+
+    @classmethod
+    def load(cls, directory: Path) -> Optional["LexicalIndex"]:
+        """Load a saved index, or None if there is none."""
+        if not (directory / TERMS_FILE).exists():
+            return None
+        terms = json.loads((directory / TERMS_FILE).read_text(encoding="utf-8"))
+        arrays = [np.load(directory / f"lex_{name}.npy", mmap_mode="r") for name in cls.ARRAYS]
+        arrays[0] = np.asarray(arrays[0])   # offsets are read on every query
+        return cls(terms, *arrays)
+
+    # ---- query ----
+    def search(self, query: str, visible: Optional[np.ndarray], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k (row ids, BM25 scores), best first. Postings are filtered by the
+        boolean `visible` mask before scoring, so RBAC applies here as well.
+        """
+        tids = {self.vocab.get(t) for t in tokenize(query)}
+        tids.discard(None)
+        spans = [(int(self.offsets[t]), int(self.offsets[t + 1])) for t in tids]
+        empty = np.zeros(0, dtype="int64"), np.zeros(0, dtype="float32")
+        if not spans:
+            return empty
+
+        def idf(df: int) -> float:
+            return math.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+
+        if sum(b - a for a, b in spans) * 16 < self.n_docs:
+            # Few postings: filter and merge them sparsely
+            found_rows, found_scores = [], []
+            for a, b in spans:
+                r = np.asarray(self.rows[a:b])
+                w = np.asarray(self.weight[a:b])
+                if visible is not None:
+                    keep = visible[r]
+                    r, w = r[keep], w[keep]
+                found_rows.append(r)
+                found_scores.append(idf(b - a) * w)
+            rows, inv = np.unique(np.concatenate(found_rows), return_inverse=True)
+            scores = np.bincount(inv, weights=np.concatenate(found_scores)).astype("float32")
+        else:
+            # Common terms: a dense accumulator beats sorting the postings, and
+            # RBAC becomes one mask at the end. Rows are unique within a list.
+            acc = np.zeros(self.n_docs, dtype="float32")
+            for a, b in spans:
+                acc[self.rows[a:b]] += idf(b - a) * self.weight[a:b]
+            if visible is not None:
+                acc *= visible
+            rows = np.flatnonzero(acc)
+            scores = acc[rows]
+
+        if not rows.size:
+            return empty
+        top = top_k_positions(scores, k)
+        return rows[top].astype("int64"), scores[top]
@@ -8,26 +8,88 @@ from fastapi import (
     Form,
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Tuple
 from pathlib import Path
+import asyncio
+import json
 import os
 import re
+import threading
+import time
 
 from .schemas import (
     LoginRequest,
     LoginResponse,
     ChatRequest,
     ChatResponse,
+    ChatBatchRequest,
+    ChatBatchResponse,
 )
-from .auth import login as do_login, decode_token
+from .auth import login as do_login, decode_token, token_cache_stats
 from .retriever import Retriever
-from .chat import answer_with_rag
+from .chat import ANSWER_CACHE, CHAT_BATCH_CONCURRENCY, aanswer_many, aanswer_with_rag, astream_answer_with_rag
 from .utils import DATA_DIR, ROOT
 from .indexer import build_index
+from .jobs import RebuildQueue
+from .clients import aclose_clients
+from .embed_cache import embed_cache_stats
+from . import metrics
 
-app = FastAPI(title="RBAC RAG Chatbot")
+# --------------------------------------------------------------------
+# SINGLETON RETRIEVER
+# --------------------------------------------------------------------
+
+# When the index is loaded:
+#   eager      - during startup, before requests are served (default)
+#   background - on a worker thread after startup; /ready answers 503 until
+#                it is live and requests that need it wait for it
+#   lazy       - on the first request that needs it
+INDEX_PRELOAD = os.getenv("INDEX_PRELOAD", "eager").strip().lower()
+
+_GLOBAL_RETRIEVER: Optional[Retriever] = None
+_RETRIEVER_LOCK = threading.Lock()
+_RETRIEVER_ERROR: Optional[str] = None
+
+
+def get_retriever() -> Retriever:
+    """Provide the single shared Retriever instance."""
+    global _GLOBAL_RETRIEVER, _RETRIEVER_ERROR
+    if _GLOBAL_RETRIEVER is None:
+        with _RETRIEVER_LOCK:
+            if _GLOBAL_RETRIEVER is None:
+                print("[main] Initializing Retriever singleton…")
+                try:
+                    _GLOBAL_RETRIEVER = Retriever()
+                except Exception as e:
+                    _RETRIEVER_ERROR = str(e)
+                    raise
+                _RETRIEVER_ERROR = None
+    return _GLOBAL_RETRIEVER
+
+
+def _preload_retriever() -> None:
+    try:
+        get_retriever()
+    except Exception as e:
+        # Keep serving (/health, /auth); the next request that needs the index retries
+        print(f"[main] WARNING: Could not load the index at startup: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if INDEX_PRELOAD == "eager":
+        await asyncio.to_thread(_preload_retriever)
+    elif INDEX_PRELOAD == "background":
+        threading.Thread(target=_preload_retriever, name="index-preload", daemon=True).start()
+    yield
+    await aclose_clients()
+
+
+app = FastAPI(title="RBAC RAG Chatbot", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -37,20 +99,69 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# --------------------------------------------------------------------
-# SINGLETON RETRIEVER
-# --------------------------------------------------------------------
+# Background index rebuilds triggered by /documents/flag
+REBUILD_QUEUE = RebuildQueue()
 
-_GLOBAL_RETRIEVER: Optional[Retriever] = None
 
+# --------------------------------------------------------------------
+# METRICS
+# --------------------------------------------------------------------
 
-def get_retriever() -> Retriever:
-    """Provide the single shared Retriever instance."""
-    global _GLOBAL_RETRIEVER
-    if _GLOBAL_RETRIEVER is None:
-        print("[main] Initializing Retriever singleton…")
-        _GLOBAL_RETRIEVER = Retriever()
-    return _GLOBAL_RETRIEVER
+if metrics.METRICS_ENABLED:
+    @app.middleware("http")
+    async def _time_request(request, call_next):
+        t0 = time.perf_counter()
+        token, stages = metrics.begin_request()
+        try:
+            response = await call_next(request)
+        finally:
+            metrics.end_request(token)
+        elapsed = time.perf_counter() - t0
+        route = request.scope.get("route")
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            elapsed, request.method, getattr(route, "path", "other"), str(response.status_code))
+        if metrics.METRICS_SERVER_TIMING:
+            response.headers["Server-Timing"] = metrics.server_timing(stages, elapsed)
+        return response
+
+
+def _collect_app_metrics():
+    """Index and cache gauges, read on each /metrics scrape."""
+    caches = {
+        "answer": ANSWER_CACHE.stats(),
+        "token": token_cache_stats(),
+        "embedding": embed_cache_stats(),
+        "query": None,
+    }
+    retriever = _GLOBAL_RETRIEVER
+    if retriever is not None:
+        caches["query"] = retriever.query_cache_stats()
+        snap = retriever.snapshot
+        lexical = snap.lexical
+        yield ("retrievai_index_generation", "gauge", "Live index generation.",
+               [({}, snap.generation)])
+        yield ("retrievai_index_rows", "gauge", "Chunks in the live index.",
+               [({}, snap.X.shape[0])])
+        yield ("retrievai_index_vector_bytes", "gauge", "Bytes of embedding vectors in the live index.",
+               [({"kind": "float32"}, snap.X.nbytes)]
+               + ([({"kind": snap.quantization}, snap.Xq.nbytes)] if snap.Xq is not None else []))
+        yield ("retrievai_index_lexical_postings", "gauge", "Postings in the BM25 index.",
+               [({}, lexical.n_postings if lexical is not None else 0)])
+    yield from metrics.cache_samples(caches)
+
+
+metrics.REGISTRY.add_collector(_collect_app_metrics)
+
+
+def _rebuild_and_reload(retriever_service: Retriever) -> int:
+    """Build a new index generation and hot-swap it into the retriever."""
+    print("[flag] Rebuilding index after flag…")
+    build_index()
+    print("[flag] Reloading retriever in memory…")
+    retriever_service.load()
+    # Answers keyed on the old generation can no longer be hit; free them now
+    ANSWER_CACHE.clear()
+    return retriever_service.generation
 
 
 # --------------------------------------------------------------------
@@ -62,7 +173,8 @@ def require_auth(authorization: str = Header("")):
         raise HTTPException(status_code=401, detail="Missing token")
     token = authorization.split(" ", 1)[1]
     try:
-        return decode_token(token)
+        with metrics.stage("auth_decode"):
+            return decode_token(token)
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid token")
 
@@ -94,12 +206,8 @@ def route_login(req: LoginRequest):
     return out
 
 
-@app.post("/chat", response_model=ChatResponse)
-async def route_chat(
-    req: ChatRequest,
-    user=Depends(require_auth),
-    retriever_service: Retriever = Depends(get_retriever),
-):
+def chat_scope(req: ChatRequest, user) -> Tuple[str, List[str]]:
+    """Requested category (checked against the token) and the roles it may read."""
     requested = (req.category or "").strip().lower()
     user_roles = [c.lower() for c in user.get("categories", [])]
 
@@ -113,18 +221,108 @@ async def route_chat(
     cascaded = cascade(requested)
     # (Optional intersect with user_roles – safe but not strictly needed)
     allowed_roles = [r for r in cascaded if r in {"public", "internal", "private"}]
+    return requested, allowed_roles
 
-    answer, ctx = answer_with_rag(
+
+@app.post("/chat", response_model=ChatResponse)
+async def route_chat(
+    req: ChatRequest,
+    user=Depends(require_auth),
+    retriever_service: Retriever = Depends(get_retriever),
+):
+    requested, allowed_roles = chat_scope(req, user)
+
+    answer, ctx = await aanswer_with_rag(
         message=req.message,
         category=requested,
         retriever=retriever_service,
         allowed_roles=allowed_roles,
         top_k=req.top_k,
+        fusion=req.fusion,
     )
 
     return {"answer": answer, "context": ctx}
 
 
+@app.post("/chat/stream")
+async def route_chat_stream(
+    req: ChatRequest,
+    user=Depends(require_auth),
+    retriever_service: Retriever = Depends(get_retriever),
+):
+    """
+    /chat as server-sent events: `context` first, then `token` events while
+    the model generates, then `contacts` (private role) and `done`.
+    """
+    requested, allowed_roles = chat_scope(req, user)
+
+    async def events():
+        async for event, data in astream_answer_with_rag(
+            message=req.message,
+            category=requested,
+            retriever=retriever_service,
+            allowed_roles=allowed_roles,
+            top_k=req.top_k,
+            fusion=req.fusion,
+        ):
+            yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Largest number of questions accepted by one /chat/batch request
+CHAT_BATCH_MAX = int(os.getenv("CHAT_BATCH_MAX", "256"))
+
+
+@app.post("/chat/batch", response_model=ChatBatchResponse)
+async def route_chat_batch(
+    req: ChatBatchRequest,
+    user=Depends(require_auth),
+    retriever_service: Retriever = Depends(get_retriever),
+):
+    """
+    Many /chat requests in one call. Each item is authorized exactly like
+    /chat (a rejected item gets an `error`, the others still run). Items
+    sharing a category are retrieved in one batch; completions run at most
+    CHAT_BATCH_CONCURRENCY at a time. Results keep the request order.
+    """
+    if len(req.items) > CHAT_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {CHAT_BATCH_MAX} items per batch")
+
+    results: List[Optional[dict]] = [None] * len(req.items)
+    groups: dict = {}
+    for i, item in enumerate(req.items):
+        try:
+            requested, allowed_roles = chat_scope(item, user)
+        except HTTPException as e:
+            results[i] = {"answer": "", "context": [], "error": e.detail}
+            continue
+        groups.setdefault((requested, tuple(allowed_roles), item.top_k, item.fusion), []).append(i)
+
+    limit = asyncio.Semaphore(CHAT_BATCH_CONCURRENCY)
+
+    async def run_group(key, idx: List[int]) -> None:
+        category, allowed_roles, top_k, fusion = key
+        if fusion:
+            async def one(i: int):
+                async with limit:
+                    return await aanswer_with_rag(req.items[i].message, category, retriever_service,
+                                                  list(allowed_roles), top_k=top_k, fusion=True)
+            answers = await asyncio.gather(*(one(i) for i in idx))
+        else:
+            answers = await aanswer_many([req.items[i].message for i in idx], category, retriever_service,
+                                         list(allowed_roles), top_k=top_k, limit=limit)
+        for i, (answer, ctx) in zip(idx, answers):
+            results[i] = {"answer": answer, "context": ctx}
+
+    await asyncio.gather(*(run_group(key, idx) for key, idx in groups.items()))
+    return {"results": results}
+
+
 @app.post("/documents/flag")
 async def documents_flag(
     title: str = Form(...),
@@ -139,7 +337,8 @@ async def documents_flag(
     - Only private users can flag.
     - Deletes any old files with the same slug prefix.
     - Saves new file.
-    - Rebuilds index and reloads retriever in memory.
+    - Queues a background rebuild; chat keeps serving the current index
+      until the new generation is published. Poll /documents/jobs/{job_id}.
     """
     user_roles = {c.lower() for c in user.get("categories", [])}
     if "private" not in user_roles:
@@ -175,27 +374,63 @@ async def documents_flag(
     fpath = target_dir / f"{base_slug}_{ts}{ext}"
     fpath.write_bytes(await file.read())
     print(f"[flag] Saved new file: {fpath}")
+    # DATA_DIR may live outside the repo (RETRIEVAI_DATA_DIR)
+    try:
+        rel_path = fpath.relative_to(ROOT)
+    except ValueError:
+        rel_path = fpath
 
-    # Rebuild index
-    print("[flag] Rebuilding index after flag…")
-    build_index()
-
-    # Reload retriever in memory
-    print("[flag] Reloading retriever in memory…")
-    retriever_service.load()
+    # Rebuild index + reload retriever in the background
+    job = REBUILD_QUEUE.submit(lambda: _rebuild_and_reload(retriever_service))
 
     return {
         "ok": True,
-        "path": str(fpath.relative_to(ROOT)),
+        "path": str(rel_path),
         "deleted_files": deleted_count,
+        "job_id": job["job_id"],
+        "status": job["status"],
     }
 
 
+@app.get("/documents/jobs/{job_id}")
+def documents_job_status(job_id: str, user=Depends(require_auth)):
+    """Status of a background rebuild started by /documents/flag."""
+    user_roles = {c.lower() for c in user.get("categories", [])}
+    if "private" not in user_roles:
+        raise HTTPException(status_code=403, detail="Only private users can view rebuild jobs")
+
+    job = REBUILD_QUEUE.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    return job
+
+
 @app.get("/health")
 def route_health():
     return {"status": "ok", "message": "RBAC RAG chatbot API running"}
 
 
+@app.get("/ready")
+def route_ready():
+    """Readiness probe: 200 once an index is live, 503 until then (or if loading failed)."""
+    retriever = _GLOBAL_RETRIEVER
+    if retriever is None:
+        if _RETRIEVER_ERROR is not None:
+            status = "error"
+        else:
+            status = "not_loaded" if INDEX_PRELOAD == "lazy" else "loading"
+        return JSONResponse(status_code=503, content={"status": status, "detail": _RETRIEVER_ERROR})
+    return {"status": "ready", "generation": retriever.generation, "rows": int(retriever.X.shape[0])}
+
+
+@app.get("/metrics")
+def route_metrics():
+    """Prometheus text exposition of stage latencies, cache and index gauges."""
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 # --------------------------------------------------------------------
 # FRONTEND STATIC
 # --------------------------------------------------------------------
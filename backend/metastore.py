@@ -0,0 +1,293 @@
+from __future__ import annotations
+import json
+import os
+from pathlib import Path
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+from .utils import ROLE_CODES
+from .index_store import NpyWriter, PartitionSpool
+
+# Columnar chunk metadata for one index generation:
+#   meta_tables.json - interned file table [{path, folder_role}] and one
+#                      {file, role, contacts} entry per CATEGORY section
+#   chunks.npy       - one fixed-width record per row (below)
+#   text.bin         - UTF-8 chunk texts, addressed by (text_off, text_len)
+TABLES_FILE = "meta_tables.json"
+CHUNKS_FILE = "chunks.npy"
+TEXT_FILE = "text.bin"
+# Chunk records buffered per role before they are spooled to disk
+SPOOL_FLUSH_ROWS = 4096
+LEGACY_META_FILE = "meta.json"
+
+CHUNK_DTYPE = np.dtype([
+    ("file", "<i4"),
+    ("section", "<i4"),
+    ("role", "i1"),
+    ("chunk_id", "<i4"),
+    ("text_off", "<i8"),
+    ("text_len", "<i4"),
+])
+
+ROLE_BY_CODE = {code: role for role, code in ROLE_CODES.items()}
+
+
+class MetaStore:
+    """
+    Read side of the columnar metadata. Columns (roles, text lengths) are
+    NumPy arrays; text is decoded only for rows that are actually returned.
+    Indexing a store yields the same dict shape meta.json used to hold.
+    """
+
+    def __init__(self, chunks: np.ndarray, files: List[Dict], sections: List[Dict], text: np.ndarray):
+        self.chunks = chunks
+        self.files = files
+        self.sections = sections
+        self._text = text
+
+    # ---- construction ----
+    @classmethod
+    def load(cls, gen_dir: Path) -> "MetaStore":
+        if not (gen_dir / CHUNKS_FILE).exists():
+            legacy = json.loads((gen_dir / LEGACY_META_FILE).read_text(encoding="utf-8"))
+            return cls.from_dicts(legacy)
+
+        tables = json.loads((gen_dir / TABLES_FILE).read_text(encoding="utf-8"))
+        chunks = np.load(gen_dir / CHUNKS_FILE, mmap_mode="r")
+        text_path = gen_dir / TEXT_FILE
+        if text_path.stat().st_size:
+            text = np.memmap(text_path, dtype="uint8", mode="r")
+        else:
+            text = np.zeros(0, dtype="uint8")
+        return cls(chunks, tables["files"], tables["sections"], text)
+
+    @classmethod
+    def from_dicts(cls, meta: List[Dict]) -> "MetaStore":
+        """Build an in-memory store from legacy per-chunk dicts."""
+        w = MetaWriter(None)
+        for m in meta:
+            path = m.get("path", "")
+            role = str(m.get("category_role", "public")).lower()
+            contacts = m.get("contacts") or {}
+            w.add_chunk(
+                path=path,
+                folder_role=m.get("folder_role", ""),
+                section_key=(path, role, json.dumps(contacts, sort_keys=True)),
+                role=role,
+                contacts=contacts,
+                chunk_id=int(m.get("chunk_id", 0)),
+                text=(m.get("chunk_text") or "").strip(),
+            )
+        return cls(w.chunk_array(), w.files, w.sections, np.frombuffer(w.text_bytes(), dtype="uint8"))
+
+    # ---- columns ----
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    @property
+    def role_codes(self) -> np.ndarray:
+        return np.asarray(self.chunks["role"])
+
+    @property
+    def nonempty(self) -> np.ndarray:
+        return np.asarray(self.chunks["text_len"]) > 0
+
+    @property
+    def file_ids(self) -> np.ndarray:
+        return np.asarray(self.chunks["file"])
+
+    # ---- per-row access ----
+    def blob(self, start: int, end: int) -> bytes:
+        """Raw bytes [start, end) of text.bin."""
+        return bytes(self._text[start:end])
+
+    def text_bytes(self, i: int) -> bytes:
+        rec = self.chunks[i]
+        off = int(rec["text_off"])
+        return self.blob(off, off + int(rec["text_len"]))
+
+    def text(self, i: int) -> str:
+        return self.text_bytes(i).decode("utf-8")
+
+    def path(self, i: int) -> str:
+        return self.files[int(self.chunks[i]["file"])]["path"]
+
+    def __getitem__(self, i: int) -> Dict:
+        rec = self.chunks[i]
+        f = self.files[int(rec["file"])]
+        sec = self.sections[int(rec["section"])]
+        return {
+            "path": f["path"],
+            "folder_role": f["folder_role"],
+            "category_role": ROLE_BY_CODE.get(int(rec["role"]), "public"),
+            "chunk_id": int(rec["chunk_id"]),
+            "chunk_text": self.text(i),
+            "contacts": sec["contacts"],
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class MetaWriter:
+    """
+    Write side: interns files and sections and appends chunk text to one blob.
+    With gen_dir=None everything stays in memory (used by MetaStore.from_dicts).
+
+    With a gen_dir, rows are streamed to disk as they are added: text is
+    appended to text.bin straight away and chunk records are spooled per
+    `part` (the role code), so chunks.npy comes out grouped by role while
+    only the interned file/section tables are kept in memory.
+
+    Chunks of one section overlap, so a section's source text is written once
+    (add_source) and its rows address spans of it rather than copies.
+    """
+
+    def __init__(self, gen_dir: Optional[Path]):
+        self.gen_dir = gen_dir
+        self.files: List[Dict] = []
+        self.sections: List[Dict] = []
+        self.rows = 0
+        self._file_ids: Dict[str, int] = {}
+        self._section_ids: Dict[Hashable, int] = {}
+        self._rows: List[tuple] = []
+        self._text: List[bytes] = []
+        self._text_off = 0
+        self._text_file = None
+        self._spool: Optional[PartitionSpool] = None
+        self._pending: Dict[int, List[tuple]] = {}
+        # Last run of text copied by copy_row: [store, old start, old end, new start]
+        self._copied: Optional[list] = None
+        if gen_dir is not None:
+            self._text_file = open(gen_dir / TEXT_FILE, "wb")
+            self._spool = PartitionSpool(gen_dir, CHUNKS_FILE)
+
+    def _file_id(self, path: str, folder_role: str) -> int:
+        fid = self._file_ids.get(path)
+        if fid is None:
+            fid = self._file_ids[path] = len(self.files)
+            self.files.append({"path": path, "folder_role": folder_role})
+        return fid
+
+    def _write_text(self, data: bytes) -> int:
+        off = self._text_off
+        if self._text_file is None:
+            self._text.append(data)
+        else:
+            self._text_file.write(data)
+        self._text_off += len(data)
+        return off
+
+    def add_source(self, source: str, spans: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """
+        Append a chunked section's source text once. Returns (text_off, text_len)
+        for each (start, end) character span of it, to pass to add_chunk(ref=...).
+        """
+        data = source.encode("utf-8")
+        if len(data) == len(source):
+            byte_at = None
+        else:
+            # Character -> byte offsets of the span boundaries, in one walk
+            byte_at: Dict[int, int] = {}
+            c = b = 0
+            for p in sorted({p for span in spans for p in span}):
+                b += len(source[c:p].encode("utf-8"))
+                byte_at[p] = b
+                c = p
+        base = self._write_text(data)
+        if byte_at is None:
+            return [(base + a, e - a) for a, e in spans]
+        return [(base + byte_at[a], byte_at[e] - byte_at[a]) for a, e in spans]
+
+    def add_chunk(self, path: str, folder_role: str, section_key: Hashable, role: str,
+                  contacts: Dict, chunk_id: int, text=None, part: int = 0,
+                  ref: Optional[Tuple[int, int]] = None) -> None:
+        """
+        Append one row. `text` may be str or already-encoded bytes; pass ref
+        (from add_source) instead to point the row at text already written.
+        """
+        fid = self._file_id(path, folder_role)
+        code = ROLE_CODES.get(role, -1)
+        sid = self._section_ids.get(section_key)
+        if sid is None:
+            sid = self._section_ids[section_key] = len(self.sections)
+            self.sections.append({"file": fid, "role": code, "contacts": contacts})
+
+        if ref is None:
+            data = text if isinstance(text, bytes) else text.encode("utf-8")
+            ref = (self._write_text(data), len(data))
+        row = (fid, sid, code, chunk_id, ref[0], ref[1])
+        if self._spool is None:
+            self._rows.append(row)
+        else:
+            pending = self._pending.setdefault(part, [])
+            pending.append(row)
+            if len(pending) >= SPOOL_FLUSH_ROWS:
+                self._flush(part)
+        self.rows += 1
+
+    def copy_row(self, store: MetaStore, i: int, part: int = 0) -> None:
+        """
+        Append row i of another store without decoding its text. Consecutive
+        rows whose text overlaps or adjoins in the old blob (chunks of one
+        section) keep sharing it: only bytes not copied yet are written.
+        """
+        rec = store.chunks[i]
+        f = store.files[int(rec["file"])]
+        sid = int(rec["section"])
+        off, n = int(rec["text_off"]), int(rec["text_len"])
+        run = self._copied
+        if (run is not None and run[0] is store and run[1] <= off <= run[2]
+                and self._text_off == run[3] + run[2] - run[1]):
+            if off + n > run[2]:
+                self._write_text(store.blob(run[2], off + n))
+                run[2] = off + n
+        else:
+            run = self._copied = [store, off, off + n, self._write_text(store.blob(off, off + n))]
+        self.add_chunk(
+            path=f["path"],
+            folder_role=f["folder_role"],
+            section_key=(id(store), sid),
+            role=ROLE_BY_CODE.get(int(rec["role"]), ""),
+            contacts=store.sections[sid]["contacts"],
+            chunk_id=int(rec["chunk_id"]),
+            part=part,
+            ref=(run[3] + off - run[1], n),
+        )
+
+    def _flush(self, part: int) -> None:
+        self._spool.append(part, np.array(self._pending.pop(part), dtype=CHUNK_DTYPE))
+
+    def chunk_array(self) -> np.ndarray:
+        return np.array(self._rows, dtype=CHUNK_DTYPE)
+
+    def text_bytes(self) -> bytes:
+        return b"".join(self._text)
+
+    def abort(self) -> None:
+        """Release scratch files after a failed build."""
+        if self._text_file is not None:
+            self._text_file.close()
+        if self._spool is not None:
+            self._spool.close()
+
+    def close(self) -> None:
+        """Finish the three metadata files in gen_dir."""
+        self._text_file.close()
+        for part in list(self._pending):
+            self._flush(part)
+        chunks = NpyWriter(self.gen_dir / CHUNKS_FILE, CHUNK_DTYPE)
+        try:
+            self._spool.write_to(chunks)
+        except BaseException:
+            chunks.abort()
+            raise
+        finally:
+            self._spool.close()
+        chunks.close()
+        tmp = self.gen_dir / f"{TABLES_FILE}.tmp"
+        tmp.write_text(json.dumps({"files": self.files, "sections": self.sections}, ensure_ascii=False),
+                       encoding="utf-8")
+        os.replace(tmp, self.gen_dir / TABLES_FILE)
@@ -0,0 +1,199 @@
+from __future__ import annotations
+import bisect
+import contextvars
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# In-process metrics in the Prometheus text format (served on /metrics).
+#   METRICS_ENABLED=0        stage() becomes a shared no-op and /metrics is off
+#   METRICS_SERVER_TIMING=1  add a Server-Timing header with the stages of the
+#                            request (streamed responses only carry the stages
+#                            finished before the first byte)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").strip().lower() not in {"0", "false", "no", "off"}
+METRICS_SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "0").strip().lower() in {"1", "true", "yes", "on"}
+
+# Histogram bucket upper bounds, in seconds
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BUILD_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+# One sample: (labels, value)
+Sample = Tuple[Dict[str, str], float]
+# A collector returns (name, type, help, samples) families, read at scrape time
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs: Iterable[Tuple[str, str]]) -> str:
+    body = ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs)
+    return "{" + body + "}" if body else ""
+
+
+def _number(v: float) -> str:
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+
+class Histogram:
+    """Fixed-bucket histogram with positional label values."""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = STAGE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            s[0][i] += 1
+            s[1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = [(k, list(v[0]), v[1]) for k, v in sorted(self._series.items())]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, counts, total in series:
+            pairs = list(zip(self.labelnames, values))
+            cumulative = 0
+            for le, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                bound = "+Inf" if le == float("inf") else _number(le)
+                lines.append(f"{self.name}_bucket{_labels(pairs + [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(pairs)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(pairs)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.histograms: List[Histogram] = []
+        self.collectors: List[Collector] = []
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        h = Histogram(*args, **kwargs)
+        self.histograms.append(h)
+        return h
+
+    def add_collector(self, collector: Collector) -> None:
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for h in self.histograms:
+            lines.extend(h.render())
+        for collector in self.collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                print(f"[metrics] Collector {getattr(collector, '__name__', collector)} failed: {e}")
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(f"{name}{_labels(labels.items())} {_number(value)}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "retrievai_stage_seconds", "Time spent in each request pipeline stage.", ("stage",))
+INDEX_BUILD_SECONDS = REGISTRY.histogram(
+    "retrievai_index_build_seconds", "Index build time per phase (read/parse/chunk summed over files).",
+    ("phase",), buckets=BUILD_BUCKETS)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "retrievai_http_request_seconds", "HTTP request latency until the response starts.",
+    ("method", "route", "status"))
+
+# Stage timings of the current request, as (stage, seconds); None outside one.
+# A list rather than a dict: appends stay safe when stages of one request run
+# on worker threads at the same time (/chat/batch).
+_REQUEST_STAGES: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = \
+    contextvars.ContextVar("retrievai_request_stages", default=None)
+
+
+class _Stage:
+    __slots__ = ("name", "t0")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> "_Stage":
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        elapsed = time.perf_counter() - self.t0
+        STAGE_SECONDS.observe(elapsed, self.name)
+        stages = _REQUEST_STAGES.get()
+        if stages is not None:
+            stages.append((self.name, elapsed))
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoStage":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name: str):
+    """`with stage("query_embed"):` times the block into retrievai_stage_seconds."""
+    return _Stage(name) if METRICS_ENABLED else _NO_STAGE
+
+
+def begin_request() -> Tuple[contextvars.Token, List[Tuple[str, float]]]:
+    """Start collecting stage timings for the current request (see end_request)."""
+    stages: List[Tuple[str, float]] = []
+    return _REQUEST_STAGES.set(stages), stages
+
+
+def end_request(token: contextvars.Token) -> None:
+    _REQUEST_STAGES.reset(token)
+
+
+def server_timing(stages: List[Tuple[str, float]], total: float) -> str:
+    """Server-Timing header value; repeated stages are summed, durations in ms."""
+    summed: Dict[str, float] = {}
+    for name, secs in list(stages):
+        summed[name] = summed.get(name, 0.0) + secs
+    parts = [f"{name};dur={secs * 1000:.2f}" for name, secs in summed.items()]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+def cache_samples(caches: Dict[str, Optional[Dict]]) -> List[Tuple[str, str, str, List[Sample]]]:
+    """Metric families for {cache name: stats dict with size/hits/misses}; None entries are skipped."""
+    live = {name: s for name, s in caches.items() if s is not None}
+    hit_ratio = []
+    for name, s in live.items():
+        served = s.get("hits", 0) + s.get("semantic_hits", 0) + s.get("coalesced", 0)
+        total = served + s.get("misses", 0)
+        hit_ratio.append(({"cache": name}, served / total if total else 0.0))
+    return [
+        ("retrievai_cache_entries", "gauge", "Entries held by each cache.",
+         [({"cache": n}, s.get("size", 0)) for n, s in live.items()]),
+        ("retrievai_cache_hits_total", "counter", "Cache lookups served without recomputing.",
+         [({"cache": n}, s.get("hits", 0) + s.get("semantic_hits", 0) + s.get("coalesced", 0))
+          for n, s in live.items()]),
+        ("retrievai_cache_misses_total", "counter", "Cache lookups that had to compute the value.",
+         [({"cache": n}, s.get("misses", 0)) for n, s in live.items()]),
+        ("retrievai_cache_hit_ratio", "gauge", "Share of cache lookups served from the cache.", hit_ratio),
+    ]
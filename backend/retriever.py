@@ -1,11 +1,295 @@
 from __future__ import annotations
-import json
+import asyncio
+import os
+import threading
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional, FrozenSet, Tuple
 import numpy as np
 
-from .utils import INDEX_DIR
-from .embedder import embed_texts
+from . import embedder
+from .cache import TTLCache
+from .index_store import (
+    current_generation_dir,
+    generation_id,
+    load_matrix,
+    load_quantized,
+    normalize_rows,
+    quantize,
+    read_index_info,
+)
+from .ann import ANN_MIN_ROWS, ANN_NPROBE, IVFIndex, top_k_positions
+from .lexical import LexicalIndex
+from .metastore import MetaStore
+from .metrics import stage
+from .utils import ROLE_CODES
+
+# A role set whose rows form at most this many contiguous runs is scored
+# slice-by-slice (views, no gather); otherwise the full matrix is scored.
+MAX_SCORE_RANGES = 8
+
+# Quantized indexes: the coarse pass keeps max(top_k * factor, min) candidates,
+# which are then re-scored exactly against the float32 rows.
+RERANK_FACTOR = int(os.getenv("RETRIEVER_RERANK_FACTOR", "10"))
+RERANK_MIN = int(os.getenv("RETRIEVER_RERANK_MIN", "100"))
+# The coarse pass de-quantizes into a small reusable float32 buffer so each
+# block stays in cache. The widening copy still costs more than the matmul:
+# an int8 scan takes 2-2.5x the time of an exact float32 one (50k x 256:
+# 6.6 ms vs 2.9 ms). The int8 win is memory: a quarter of the bytes resident.
+COARSE_BLOCK_BYTES = 1 << 21
+
+# Normalized query vectors, keyed on (embedding model, normalized query text).
+# Repeated questions skip the embedding call; QUERY_CACHE_TTL=0 disables expiry.
+# This is the only cache for queries: they never enter the persistent
+# embedding cache, which only the indexer fills and evicts.
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+
+
+# Retrieval mode when the caller doesn't pick one:
+#   dense   - embedding cosine similarity (default)
+#   lexical - BM25 over the inverted index only; no embedding call
+#   hybrid  - dense and BM25 rankings merged by reciprocal-rank fusion
+# Dense and hybrid fall back to lexical when the query embedding fails or
+# takes longer than QUERY_EMBED_TIMEOUT seconds (async path).
+RETRIEVAL_MODES = {"dense", "lexical", "hybrid"}
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense").strip().lower()
+QUERY_EMBED_TIMEOUT = float(os.getenv("QUERY_EMBED_TIMEOUT", "5"))
+
+# Multi-query retrieval: each query contributes its top RRF_DEPTH rows and a
+# row scores sum(1 / (RRF_K + rank)) over the queries (reciprocal-rank fusion).
+RRF_K = int(os.getenv("RETRIEVER_RRF_K", "60"))
+RRF_DEPTH = int(os.getenv("RETRIEVER_RRF_DEPTH", "50"))
+
+
+def rrf_fuse(ranked: List[Tuple[np.ndarray, np.ndarray]], k: int,
+             rrf_k: int = RRF_K) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fuse best-first (row ids, cosines) lists into the top k rows:
+    (row ids, fused scores, best cosine of each row), best first.
+    """
+    rows = np.concatenate([r for r, _ in ranked]) if ranked else np.zeros(0, dtype="int64")
+    if rows.size == 0:
+        return rows, np.zeros(0), np.zeros(0, dtype="float32")
+    ranks = np.concatenate([np.arange(len(r)) for r, _ in ranked])
+    cos = np.concatenate([c for _, c in ranked]).astype("float32")
+
+    uniq, inv = np.unique(rows, return_inverse=True)
+    fused = np.zeros(len(uniq))
+    np.add.at(fused, inv, 1.0 / (rrf_k + 1 + ranks))
+    best = np.full(len(uniq), -np.inf, dtype="float32")
+    np.maximum.at(best, inv, cos)
+
+    top = top_k_positions(fused, k)
+    return uniq[top], fused[top], best[top]
+
+
+def normalize_query(q: str) -> str:
+    """Cache key form of a query: collapsed whitespace, case-folded."""
+    return " ".join(q.split()).casefold()
+
+
+class IndexSnapshot:
+    """
+    One immutable index generation: matrix, normalized matrix and metadata.
+    The Retriever swaps whole snapshots, so a reader never sees a matrix
+    from one generation paired with metadata from another.
+
+    Indexes on disk store rows already normalized, so X and X_norm are the
+    same read-only memory map rather than two private copies. Metadata is a
+    columnar MetaStore; chunk text is decoded only for returned rows.
+    """
+
+    __slots__ = ("X", "X_norm", "meta", "generation", "path", "role_codes", "nonempty", "_rows_cache",
+                 "_mask_cache", "quantization", "Xq", "Xq_scale", "ann", "lexical")
+
+    def __init__(self, X: np.ndarray, X_norm: np.ndarray, meta: MetaStore,
+                 generation: int = 0, path: Optional[Path] = None,
+                 quantization: str = "none", Xq: Optional[np.ndarray] = None,
+                 Xq_scale: Optional[np.ndarray] = None, ann: Optional[IVFIndex] = None,
+                 lexical: Optional[LexicalIndex] = None):
+        self.X = X
+        self.X_norm = X_norm
+        self.meta = meta
+        self.generation = generation
+        self.path = path
+        # Optional int8 copy of X_norm used for a coarse first pass
+        self.quantization = quantization if Xq is not None else "none"
+        self.Xq = Xq
+        self.Xq_scale = Xq_scale
+        # Optional IVF index for large corpora
+        self.ann = ann
+        # Optional BM25 inverted index (lexical / hybrid modes)
+        self.lexical = lexical
+        # RBAC columns, so retrieve() never loops over rows in Python
+        self.role_codes = meta.role_codes
+        self.nonempty = meta.nonempty
+        self._rows_cache: Dict[FrozenSet[str], Tuple[np.ndarray, Optional[List[Tuple[int, int]]]]] = {}
+        self._mask_cache: Dict[FrozenSet[str], np.ndarray] = {}
+
+    def allowed_mask(self, allowed: FrozenSet[str]) -> np.ndarray:
+        """Boolean row mask for a role set (cached)."""
+        mask = self._mask_cache.get(allowed)
+        if mask is None:
+            codes = [ROLE_CODES[r] for r in allowed if r in ROLE_CODES]
+            mask = np.isin(self.role_codes, codes) & self.nonempty
+            self._mask_cache[allowed] = mask
+        return mask
+
+    def allowed_rows(self, allowed: FrozenSet[str]) -> Tuple[np.ndarray, Optional[List[Tuple[int, int]]]]:
+        """
+        Row ids visible to a role set, plus their contiguous [start, end) runs
+        when there are few of them (the indexer groups rows by role, so usually
+        there are). Cached: there are only a handful of role sets.
+        """
+        cached = self._rows_cache.get(allowed)
+        if cached is None:
+            rows = np.flatnonzero(self.allowed_mask(allowed))
+            breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+            ranges: Optional[List[Tuple[int, int]]] = None
+            if rows.size and len(breaks) < MAX_SCORE_RANGES:
+                starts = np.concatenate([[0], breaks])
+                ends = np.concatenate([breaks, [rows.size]])
+                ranges = [(int(rows[s]), int(rows[e - 1]) + 1) for s, e in zip(starts, ends)]
+            cached = (rows, ranges)
+            self._rows_cache[allowed] = cached
+        return cached
+
+    def score(self, q: np.ndarray, allowed: FrozenSet[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Exact cosine scores of q against the rows visible to `allowed`: (row ids, scores).
+        q may also be a (dim, m) matrix of m queries; scores are then (rows, m).
+        """
+        rows, ranges = self.allowed_rows(allowed)
+        if rows.size == 0:
+            return rows, np.zeros((0,) + q.shape[1:], dtype="float32")
+        if ranges is not None:
+            # Only touch the allowed partitions of the matrix
+            scores = np.concatenate([self.X_norm[s:e] @ q for s, e in ranges])
+        else:
+            scores = (self.X_norm @ q)[rows]
+        return rows, scores
+
+    def coarse_score(self, q: np.ndarray, allowed: FrozenSet[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Like score(), but against the quantized matrix, block by block."""
+        rows, ranges = self.allowed_rows(allowed)
+        if rows.size == 0:
+            return rows, np.zeros((0,) + q.shape[1:], dtype="float32")
+
+        block = max(64, COARSE_BLOCK_BYTES // (4 * self.Xq.shape[1]))
+        if ranges is None:
+            sels = [rows[b:b + block] for b in range(0, rows.size, block)]
+        else:
+            sels = [slice(b, min(e, b + block)) for s, e in ranges for b in range(s, e, block)]
+
+        buf = np.empty((block, self.Xq.shape[1]), dtype="float32")
+        out = np.empty((rows.size,) + q.shape[1:], dtype="float32")
+        pos = 0
+        for sel in sels:
+            src = self.Xq[sel]
+            dst = buf[:len(src)]
+            np.copyto(dst, src, casting="unsafe")
+            s = dst @ q
+            if self.Xq_scale is not None:
+                scale = self.Xq_scale[sel]
+                s *= scale[:, None] if s.ndim == 2 else scale
+            out[pos:pos + len(s)] = s
+            pos += len(s)
+        return rows, out
+
+    def search(self, q: np.ndarray, allowed: FrozenSet[str], k: int,
+               nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k (row ids, exact cosine scores) among rows visible to `allowed`,
+        best first.
+
+        - With an IVF index and at least ANN_MIN_ROWS visible rows, only the
+          closest lists are scored (nprobe, default ANN_NPROBE).
+        - Quantized snapshots shortlist candidates on the compact matrix and
+          re-score only those against the float32 rows.
+        - Otherwise (and always for small role partitions) search is exact.
+        """
+        rows, _ = self.allowed_rows(allowed)
+        if self.ann is not None and rows.size >= ANN_MIN_ROWS:
+            codes = [ROLE_CODES[r] for r in allowed if r in ROLE_CODES]
+            cand = self.ann.candidates(q, self.allowed_mask(allowed), codes,
+                                       nprobe or ANN_NPROBE, min_candidates=k)
+            exact = self.X_norm[cand] @ q
+            top = top_k_positions(exact, k)
+            return cand[top], exact[top]
+
+        if self.Xq is None:
+            rows, sims = self.score(q, allowed)
+            top = top_k_positions(sims, k)
+            return rows[top], sims[top]
+
+        rows, approx = self.coarse_score(q, allowed)
+        cand = np.sort(rows[top_k_positions(approx, max(k * RERANK_FACTOR, RERANK_MIN))])
+        exact = self.X_norm[cand] @ q
+        top = top_k_positions(exact, k)
+        return cand[top], exact[top]
+
+    def lexical_search(self, query: str, allowed: FrozenSet[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k (row ids, BM25 scores) among rows visible to `allowed`, best first."""
+        return self.lexical.search(query, self.allowed_mask(allowed), k)
+
+    def search_many(self, Q: np.ndarray, allowed: FrozenSet[str], k: int,
+                    nprobe: Optional[int] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        search() for a (m, dim) batch of queries. Exact and quantized scans
+        score all queries in one matrix-matrix product over the matrix; IVF
+        probes differ per query, so those are searched one by one.
+        """
+        rows, _ = self.allowed_rows(allowed)
+        if len(Q) == 1 or (self.ann is not None and rows.size >= ANN_MIN_ROWS):
+            return [self.search(q, allowed, k, nprobe=nprobe) for q in Q]
+
+        out: List[Tuple[np.ndarray, np.ndarray]] = []
+        if self.Xq is None:
+            rows, S = self.score(Q.T, allowed)
+            for j in range(len(Q)):
+                top = top_k_positions(S[:, j], k)
+                out.append((rows[top], S[top, j]))
+            return out
+
+        rows, A = self.coarse_score(Q.T, allowed)
+        for j, q in enumerate(Q):
+            cand = np.sort(rows[top_k_positions(A[:, j], max(k * RERANK_FACTOR, RERANK_MIN))])
+            exact = self.X_norm[cand] @ q
+            top = top_k_positions(exact, k)
+            out.append((cand[top], exact[top]))
+        return out
+
+    @classmethod
+    def empty(cls) -> "IndexSnapshot":
+        z = np.zeros((0, 0), dtype="float32")
+        return cls(z, z, MetaStore.from_dicts([]), generation=-1)
+
+    @classmethod
+    def from_arrays(cls, X: np.ndarray, meta, generation: int = 0,
+                    path: Optional[Path] = None, quantization: str = "none",
+                    lexical: bool = False) -> "IndexSnapshot":
+        """Snapshot from an in-memory matrix and a MetaStore or list of meta dicts."""
+        X = np.asarray(X, dtype="float32")
+        if not isinstance(meta, MetaStore):
+            meta = MetaStore.from_dicts(meta)
+        # Normalize rows for cosine similarity
+        X_norm = normalize_rows(X)
+        Xq, Xq_scale = quantize(X_norm, quantization)
+        lex = LexicalIndex.build(meta.text(i) for i in range(len(meta))) if lexical else None
+        return cls(X, X_norm, meta, generation=generation, path=path,
+                   quantization=quantization, Xq=Xq, Xq_scale=Xq_scale, lexical=lex)
+
+    @classmethod
+    def load(cls, gen_dir: Path) -> "IndexSnapshot":
+        X_norm = load_matrix(gen_dir)
+        meta = MetaStore.load(gen_dir)
+        info = read_index_info(gen_dir)
+        quantization = info.get("quantization", "none")
+        Xq, Xq_scale = load_quantized(gen_dir, quantization)
+        ann = IVFIndex.load(gen_dir) if info.get("ann") else None
+        lexical = LexicalIndex.load(gen_dir) if info.get("lexical") else None
+        return cls(X_norm, X_norm, meta, generation=generation_id(gen_dir), path=gen_dir,
+                   quantization=quantization, Xq=Xq, Xq_scale=Xq_scale, ann=ann, lexical=lexical)
 
 
 class Retriever:
@@ -15,89 +299,435 @@ class Retriever:
     and returns top-k chunks with their metadata.
     """
 
-    def __init__(self):
-        self.X: np.ndarray = np.zeros((0, 0), dtype="float32")
-        self.X_norm: np.ndarray = np.zeros((0, 0), dtype="float32")
-        self.meta: List[Dict] = []
-        self.load()
+    def __init__(self, autoload: bool = True):
+        self._snap: IndexSnapshot = IndexSnapshot.empty()
+        self._load_lock = threading.Lock()
+        self._query_cache = TTLCache(QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL or None)
+        self._query_model = embedder.EMBED_MODEL
+        if autoload:
+            self.load()
+
+    # Read-only views of the live snapshot (kept for existing callers)
+    @property
+    def X(self) -> np.ndarray:
+        return self._snap.X
+
+    @property
+    def X_norm(self) -> np.ndarray:
+        return self._snap.X_norm
+
+    @property
+    def meta(self) -> MetaStore:
+        return self._snap.meta
+
+    @property
+    def generation(self) -> int:
+        return self._snap.generation
+
+    @property
+    def snapshot(self) -> IndexSnapshot:
+        return self._snap
+
+    def publish(self, snap: IndexSnapshot) -> None:
+        """Make snap the live index with a single reference swap."""
+        self._snap = snap
+        print(f"[retriever] Published index generation {snap.generation}: {snap.X.shape[0]} chunks.")
 
     def load(self) -> None:
         """
-        Load the current index and metadata from disk.
-        Called at startup and again after /documents/flag → build_index().
+        Load the current index generation from disk and publish it.
+        Called at startup and again after a background rebuild.
+        In-flight retrievals keep using the snapshot they started with.
         """
-        idx_path = INDEX_DIR / "index.npz"
-        meta_path = INDEX_DIR / "meta.json"
+        with self._load_lock:
+            gen_dir = current_generation_dir()
+            if gen_dir is None:
+                if self._snap.X.size == 0:
+                    # First-time startup with no index at all
+                    raise RuntimeError("Missing index. Run: python -m backend.indexer")
+                print("[retriever] WARNING: Index files not found during reload. Keeping old in-memory index.")
+                return
 
-        if not idx_path.exists() or not meta_path.exists():
-            if self.X.size == 0:
-                # First-time startup with no index at all
-                raise RuntimeError("Missing index. Run: python -m backend.indexer")
-            print("[retriever] WARNING: Index files not found during reload. Keeping old in-memory index.")
-            return
+            if self._snap.path is not None and gen_dir == self._snap.path and generation_id(gen_dir) > 0:
+                return
 
-        data = np.load(idx_path)
-        X = data["X"].astype("float32")
-        # Normalize rows for cosine similarity
-        X_norm = X / (np.linalg.norm(X, axis=1, keepdims=True) + 1e-8)
+            reason = embedder.index_incompatibility(read_index_info(gen_dir))
+            if reason is not None:
+                if self._snap.X.size == 0:
+                    raise RuntimeError(f"Index {gen_dir.name} was {reason}. Rebuild: python -m backend.indexer --full")
+                print(f"[retriever] WARNING: Index {gen_dir.name} was {reason}. Keeping old in-memory index.")
+                return
 
-        self.X = X
-        self.X_norm = X_norm
-        self.meta = json.loads(meta_path.read_text(encoding="utf-8"))
-
-        print(f"[retriever] Reloaded index: {self.X.shape[0]} chunks.")
+            with stage("index_reload"):
+                snap = IndexSnapshot.load(gen_dir)
+            self.publish(snap)
 
     # ---- embedding ----
+    def _current_query_model(self) -> str:
+        model = embedder.EMBED_MODEL
+        if model != self._query_model:
+            # Vectors from another model are not comparable with the index
+            self._query_cache.clear()
+            self._query_model = model
+        return model
+
     def _embed_query(self, q: str) -> np.ndarray:
-        arr = np.array(embed_texts([q]), dtype="float32")
-        v = arr[0]
+        """
+        Normalized query vector. Served from the in-process LRU when the same
+        question was asked recently; concurrent misses for one query share a
+        single embedding call. The returned array is read-only.
+        """
+        model = self._current_query_model()
+        text = " ".join(q.split())
+        with stage("query_embed"):
+            return self._query_cache.get_or_compute((model, normalize_query(text)),
+                                                    lambda: self._compute_query_vector(text))
+
+    async def _aembed_query(self, q: str) -> np.ndarray:
+        """Async _embed_query(); shares the same cache and in-flight table."""
+        model = self._current_query_model()
+        text = " ".join(q.split())
+
+        async def compute() -> np.ndarray:
+            return self._finish_query_vector((await embedder.aembed_texts([text]))[0])
+
+        with stage("query_embed"):
+            return await self._query_cache.aget_or_compute((model, normalize_query(text)), compute)
+
+    @classmethod
+    def _compute_query_vector(cls, q: str) -> np.ndarray:
+        return cls._finish_query_vector(embedder.embed_texts([q])[0])
+
+    @staticmethod
+    def _finish_query_vector(v: np.ndarray) -> np.ndarray:
         v /= (np.linalg.norm(v) + 1e-8)
+        v.setflags(write=False)
         return v
 
+    def _query_lookup(self, queries: List[str]):
+        """Cache keys, cached vectors (None on miss) and {key: text} of distinct misses."""
+        model = self._current_query_model()
+        texts = [" ".join(q.split()) for q in queries]
+        keys = [(model, normalize_query(t)) for t in texts]
+        vecs = [self._query_cache.get(k) for k in keys]
+        todo: Dict[Tuple[str, str], str] = {}
+        for k, t, v in zip(keys, texts, vecs):
+            if v is None and k not in todo:
+                todo[k] = t
+        return keys, vecs, todo
+
+    def _query_store(self, keys, vecs, todo: Dict, V: Optional[np.ndarray]) -> np.ndarray:
+        fresh = {}
+        for k, v in zip(todo, V if todo else ()):
+            fresh[k] = self._finish_query_vector(np.array(v, dtype="float32"))
+            self._query_cache.set(k, fresh[k])
+        return np.stack([fresh[k] if v is None else v for k, v in zip(keys, vecs)])
+
+    def _embed_queries(self, queries: List[str]) -> np.ndarray:
+        """(m, dim) normalized vectors; all cache misses go out in one embedding call."""
+        keys, vecs, todo = self._query_lookup(queries)
+        with stage("query_embed"):
+            V = embedder.embed_texts(list(todo.values())) if todo else None
+        return self._query_store(keys, vecs, todo, V)
+
+    async def _aembed_queries(self, queries: List[str]) -> np.ndarray:
+        keys, vecs, todo = self._query_lookup(queries)
+        with stage("query_embed"):
+            V = await embedder.aembed_texts(list(todo.values())) if todo else None
+        return self._query_store(keys, vecs, todo, V)
+
+    def query_vector(self, q: str) -> np.ndarray:
+        """Normalized embedding of a query (shares the query-vector cache)."""
+        return self._embed_query(q)
+
+    async def aquery_vector(self, q: str) -> np.ndarray:
+        return await self._aembed_query(q)
+
+    def chunk_vectors(self, results: List[Dict]) -> Optional[np.ndarray]:
+        """
+        Stored (normalized) embeddings of retrieved chunks, read from the index;
+        None if the results came from a generation that is no longer live.
+        """
+        snap = self._snap
+        if not results or any(r.get("generation") != snap.generation or "id" not in r for r in results):
+            return None
+        return np.asarray(snap.X_norm[[r["id"] for r in results]], dtype="float32")
+
+    def query_cache_stats(self) -> Dict:
+        c = self._query_cache
+        return {"size": len(c), "hits": c.hits, "misses": c.misses,
+                "coalesced": c.coalesced, "hit_rate": round(c.hit_rate, 4)}
+
     # ---- main retrieve ----
-    def retrieve(self, query: str, allowed_roles: List[str], top_k: int = 8) -> List[Dict]:
+    def _visible(self, query: str, allowed_roles: List[str]) -> Optional[Tuple[IndexSnapshot, str, FrozenSet[str]]]:
+        """Snapshot, cleaned query and role set, or None when nothing can match."""
+        snap = self._snap
+        query = (query or "").strip()
+        if not query or snap.X_norm.size == 0:
+            return None
+
+        allowed = frozenset(r.lower() for r in allowed_roles)
+
+        # RBAC: category-level only, applied as a precomputed row partition
+        with stage("rbac_filter"):
+            rows = snap.allowed_rows(allowed)[0]
+        if rows.size == 0:
+            return None
+        return snap, query, allowed
+
+    @staticmethod
+    def _results(snap: IndexSnapshot, rows: np.ndarray, sims: np.ndarray, allowed: FrozenSet[str],
+                 extra: Optional[Dict[str, np.ndarray]] = None) -> List[Dict]:
+        results: List[Dict] = []
+        for j, (i, cos) in enumerate(zip(rows, sims)):
+            m = snap.meta[i]
+            r = {
+                "text": (m.get("chunk_text") or "").strip(),
+                "meta": m,
+                "cos": float(cos),
+                "id": int(i),
+                "generation": snap.generation,
+            }
+            for name, values in (extra or {}).items():
+                r[name] = float(values[j])
+            results.append(r)
+
+        print(
+            f"[retriever] Returned {len(results)} chunks for roles {sorted(allowed)}"
+        )
+        return results
+
+    @classmethod
+    def _search(cls, snap: IndexSnapshot, q: np.ndarray, allowed: FrozenSet[str], top_k: int,
+                nprobe: Optional[int]) -> List[Dict]:
+        with stage("search_dense"):
+            rows, sims = snap.search(q, allowed, max(1, int(top_k)), nprobe=nprobe)
+        return cls._results(snap, rows, sims, allowed)
+
+    @classmethod
+    def _search_fused(cls, snap: IndexSnapshot, Q: np.ndarray, allowed: FrozenSet[str], top_k: int,
+                      nprobe: Optional[int]) -> List[Dict]:
+        top_k = max(1, int(top_k))
+        with stage("search_dense"):
+            ranked = snap.search_many(Q, allowed, max(top_k, RRF_DEPTH), nprobe=nprobe)
+            rows, fused, sims = rrf_fuse(ranked, top_k)
+        return cls._results(snap, rows, sims, allowed, extra={"rrf": fused})
+
+    @classmethod
+    def _search_lexical(cls, snap: IndexSnapshot, queries: List[str], allowed: FrozenSet[str],
+                        top_k: int) -> List[Dict]:
+        """BM25 only (no query vector, so "cos" is 0); several queries are rank-fused."""
+        top_k = max(1, int(top_k))
+        if len(queries) == 1:
+            with stage("search_lexical"):
+                rows, scores = snap.lexical_search(queries[0], allowed, top_k)
+            return cls._results(snap, rows, np.zeros(len(rows)), allowed, extra={"bm25": scores})
+        with stage("search_lexical"):
+            ranked = [snap.lexical_search(q, allowed, max(top_k, RRF_DEPTH)) for q in queries]
+            rows, fused, _ = rrf_fuse(ranked, top_k)
+        return cls._results(snap, rows, np.zeros(len(rows)), allowed, extra={"rrf": fused})
+
+    @classmethod
+    def _search_hybrid(cls, snap: IndexSnapshot, q: np.ndarray, query: str, allowed: FrozenSet[str],
+                       top_k: int, nprobe: Optional[int]) -> List[Dict]:
+        top_k = max(1, int(top_k))
+        depth = max(top_k, RRF_DEPTH)
+        with stage("search_hybrid"):
+            ranked = [snap.search(q, allowed, depth, nprobe=nprobe), snap.lexical_search(query, allowed, depth)]
+            rows, fused, _ = rrf_fuse(ranked, top_k)
+            # Lexical-only hits have no cosine yet; score the few fused rows exactly
+            sims = np.asarray(snap.X_norm[rows]) @ q
+        return cls._results(snap, rows, sims, allowed, extra={"rrf": fused})
+
+    @staticmethod
+    def _mode(snap: IndexSnapshot, mode: Optional[str]) -> str:
+        mode = (mode or RETRIEVAL_MODE).lower()
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode!r}")
+        # Indexes built before the lexical index existed are dense-only
+        return mode if snap.lexical is not None else "dense"
+
+    @staticmethod
+    def _lexical_fallback(snap: IndexSnapshot, e: BaseException) -> None:
+        if snap.lexical is None:
+            raise e
+        print(f"[retriever] Query embedding unavailable ({type(e).__name__}); serving lexical results.")
+
+    def retrieve(self, query: str, allowed_roles: List[str], top_k: int = 8,
+                 nprobe: Optional[int] = None, mode: Optional[str] = None) -> List[Dict]:
         """
         Retrieve top_k chunks where category_role is in allowed_roles.
         We intentionally ignore folder_role for access, so
         PUBLIC sections inside Internal/Private folders are still visible
-        to public users.
+        to public users. nprobe tunes the IVF search on large indexes;
+        mode is dense / lexical / hybrid (default RETRIEVAL_MODE).
         """
-        query = (query or "").strip()
-        if not query or self.X_norm.size == 0:
+        visible = self._visible(query, allowed_roles)
+        if visible is None:
             return []
+        snap, query, allowed = visible
+        mode = self._mode(snap, mode)
+        if mode == "lexical":
+            return self._search_lexical(snap, [query], allowed, top_k)
+        try:
+            q = self._embed_query(query)
+        except Exception as e:
+            self._lexical_fallback(snap, e)
+            return self._search_lexical(snap, [query], allowed, top_k)
+        if mode == "hybrid":
+            return self._search_hybrid(snap, q, query, allowed, top_k, nprobe)
+        return self._search(snap, q, allowed, top_k, nprobe)
 
-        allowed = {r.lower() for r in allowed_roles}
+    async def aretrieve(self, query: str, allowed_roles: List[str], top_k: int = 8,
+                        nprobe: Optional[int] = None, mode: Optional[str] = None) -> List[Dict]:
+        """
+        retrieve() for async callers: the query embedding is awaited and the
+        NumPy search runs in a worker thread, so the event loop keeps serving
+        other requests meanwhile.
+        """
+        visible = self._visible(query, allowed_roles)
+        if visible is None:
+            return []
+        snap, query, allowed = visible
+        mode = self._mode(snap, mode)
+        if mode == "lexical":
+            return self._search_lexical(snap, [query], allowed, top_k)
+        try:
+            q = await self._await_query_vector(snap, self._aembed_query(query))
+        except Exception as e:
+            self._lexical_fallback(snap, e)
+            return self._search_lexical(snap, [query], allowed, top_k)
+        if mode == "hybrid":
+            return await asyncio.to_thread(self._search_hybrid, snap, q, query, allowed, top_k, nprobe)
+        return await asyncio.to_thread(self._search, snap, q, allowed, top_k, nprobe)
 
-        q = self._embed_query(query)
-        sims = self.X_norm @ q
-        order = np.argsort(-sims)
+    @staticmethod
+    async def _await_query_vector(snap: IndexSnapshot, coro):
+        """
+        With a lexical index to fall back on, give up waiting after
+        QUERY_EMBED_TIMEOUT. The embedding call itself is shielded and keeps
+        running, so its result still lands in the query cache.
+        """
+        if snap.lexical is None or QUERY_EMBED_TIMEOUT <= 0:
+            return await coro
+        return await asyncio.wait_for(asyncio.shield(coro), QUERY_EMBED_TIMEOUT)
 
-        results: List[Dict] = []
+    def _visible_multi(self, queries: List[str], allowed_roles: List[str]):
+        # One entry per distinct (normalized) query, so duplicates don't double-vote
+        queries = list({normalize_query(q): q.strip() for q in queries if q and q.strip()}.values())
+        visible = self._visible(queries[0] if queries else "", allowed_roles)
+        if visible is None:
+            return None
+        snap, _, allowed = visible
+        return snap, queries, allowed
 
-        for i in order:
-            m = self.meta[i]
-            category_role = m.get("category_role", "public").lower()
+    def retrieve_multi(self, queries: List[str], allowed_roles: List[str], top_k: int = 8,
+                       nprobe: Optional[int] = None, mode: Optional[str] = None) -> List[Dict]:
+        """
+        Retrieve for several phrasings of one question at once: one batched
+        embedding call, one matrix-matrix scan, and the per-query rankings
+        merged by reciprocal-rank fusion. "cos" is the row's best cosine
+        over the queries, "rrf" its fused score. Lexical mode fuses the
+        per-query BM25 rankings instead.
+        """
+        visible = self._visible_multi(queries, allowed_roles)
+        if visible is None:
+            return []
+        snap, queries, allowed = visible
+        if self._mode(snap, mode) == "lexical":
+            return self._search_lexical(snap, queries, allowed, top_k)
+        try:
+            Q = self._embed_queries(queries)
+        except Exception as e:
+            self._lexical_fallback(snap, e)
+            return self._search_lexical(snap, queries, allowed, top_k)
+        return self._search_fused(snap, Q, allowed, top_k, nprobe)
 
-            # RBAC: category-level only
-            if category_role not in allowed:
-                continue
+    async def aretrieve_multi(self, queries: List[str], allowed_roles: List[str], top_k: int = 8,
+                              nprobe: Optional[int] = None, mode: Optional[str] = None) -> List[Dict]:
+        visible = self._visible_multi(queries, allowed_roles)
+        if visible is None:
+            return []
+        snap, queries, allowed = visible
+        if self._mode(snap, mode) == "lexical":
+            return self._search_lexical(snap, queries, allowed, top_k)
+        try:
+            Q = await self._await_query_vector(snap, self._aembed_queries(queries))
+        except Exception as e:
+            self._lexical_fallback(snap, e)
+            return self._search_lexical(snap, queries, allowed, top_k)
+        return await asyncio.to_thread(self._search_fused, snap, Q, allowed, top_k, nprobe)
 
-            text = (m.get("chunk_text") or "").strip()
-            if not text:
-                continue
+    # ---- batches of independent queries ----
+    @classmethod
+    def _search_each(cls, snap: IndexSnapshot, Q: np.ndarray, queries: List[str], allowed: FrozenSet[str],
+                     top_k: int, nprobe: Optional[int], mode: str) -> List[List[Dict]]:
+        if mode == "hybrid":
+            return [cls._search_hybrid(snap, q, text, allowed, top_k, nprobe) for q, text in zip(Q, queries)]
+        with stage("search_dense"):
+            ranked = snap.search_many(Q, allowed, max(1, int(top_k)), nprobe=nprobe)
+        return [cls._results(snap, rows, sims, allowed) for rows, sims in ranked]
 
-            results.append(
-                {
-                    "text": text,
-                    "meta": m,
-                    "cos": float(sims[i]),
-                }
-            )
+    def _many_prepare(self, queries: List[str], allowed_roles: List[str]):
+        """Snapshot, role set and positions of the non-empty queries (None if nothing is visible)."""
+        snap = self._snap
+        allowed = frozenset(r.lower() for r in allowed_roles)
+        live = [i for i, q in enumerate(queries) if q and q.strip()]
+        if not live or snap.X_norm.size == 0:
+            return None
+        with stage("rbac_filter"):
+            rows = snap.allowed_rows(allowed)[0]
+        if rows.size == 0:
+            return None
+        return snap, allowed, live
 
-            if len(results) >= max(1, int(top_k)):
-                break
+    def retrieve_many(self, queries: List[str], allowed_roles: List[str], top_k: int = 8,
+                      nprobe: Optional[int] = None, mode: Optional[str] = None) -> List[List[Dict]]:
+        """
+        retrieve() for a batch of independent queries under one role set:
+        one batched embedding call and one Q @ X.T scan. Returns one result
+        list per query, in input order.
+        """
+        out: List[List[Dict]] = [[] for _ in queries]
+        prepared = self._many_prepare(queries, allowed_roles)
+        if prepared is None:
+            return out
+        snap, allowed, live = prepared
+        texts = [queries[i].strip() for i in live]
+        mode = self._mode(snap, mode)
+        if mode == "lexical":
+            found = [self._search_lexical(snap, [t], allowed, top_k) for t in texts]
+        else:
+            try:
+                Q = self._embed_queries(texts)
+            except Exception as e:
+                self._lexical_fallback(snap, e)
+                found = [self._search_lexical(snap, [t], allowed, top_k) for t in texts]
+            else:
+                found = self._search_each(snap, Q, texts, allowed, top_k, nprobe, mode)
+        for i, res in zip(live, found):
+            out[i] = res
+        return out
 
-        print(
-            f"[retriever] Returned {len(results)} chunks for roles {sorted(allowed)}"
-        )
-        return results
+    async def aretrieve_many(self, queries: List[str], allowed_roles: List[str], top_k: int = 8,
+                             nprobe: Optional[int] = None, mode: Optional[str] = None) -> List[List[Dict]]:
+        out: List[List[Dict]] = [[] for _ in queries]
+        prepared = self._many_prepare(queries, allowed_roles)
+        if prepared is None:
+            return out
+        snap, allowed, live = prepared
+        texts = [queries[i].strip() for i in live]
+        mode = self._mode(snap, mode)
+        if mode == "lexical":
+            found = [self._search_lexical(snap, [t], allowed, top_k) for t in texts]
+        else:
+            try:
+                Q = await self._await_query_vector(snap, self._aembed_queries(texts))
+            except Exception as e:
+                self._lexical_fallback(snap, e)
+                found = [self._search_lexical(snap, [t], allowed, top_k) for t in texts]
+            else:
+                found = await asyncio.to_thread(self._search_each, snap, Q, texts, allowed, top_k, nprobe, mode)
+        for i, res in zip(live, found):
+            out[i] = res
+        return out
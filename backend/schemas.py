@@ -14,6 +14,7 @@ class ChatRequest(BaseModel):
     message: str
     history: Optional[List[dict]] = None
     top_k: int = 5
+    fusion: bool = False  # also search LLM rewrites of the question, merged by rank fusion
 
 class ChatChunk(BaseModel):
     text: str
@@ -23,6 +24,17 @@ class ChatResponse(BaseModel):
     answer: str
     context: List[ChatChunk]
 
+class ChatBatchRequest(BaseModel):
+    items: List[ChatRequest]
+
+class ChatBatchItem(BaseModel):
+    answer: str
+    context: List[ChatChunk]
+    error: Optional[str] = None  # set when this item was rejected (e.g. 403)
+
+class ChatBatchResponse(BaseModel):
+    results: List[ChatBatchItem]
+
 # These are for the /documents/flag endpoint, derived from your file
 class DocumentCreateRequest(BaseModel):
     title: str
@@ -1,16 +1,16 @@
 # backend/utils.py (CORRECTED)
 import json
+import os
 from pathlib import Path
-from dotenv import load_dotenv
 
 ROOT = Path(__file__).resolve().parents[1]
-load_dotenv(ROOT / ".env")
 
 # --- PATHS ---
 # DATA_DIR now points to the top-level folder *containing* the role subdirectories (raw)
-DATA_DIR = ROOT / "Data" / "raw"
-INDEX_DIR = ROOT / "data_index"
-INDEX_DIR.mkdir(exist_ok=True)
+# RETRIEVAI_DATA_DIR / RETRIEVAI_INDEX_DIR relocate them (benchmarks, tests)
+DATA_DIR = Path(os.getenv("RETRIEVAI_DATA_DIR", str(ROOT / "Data" / "raw")))
+INDEX_DIR = Path(os.getenv("RETRIEVAI_INDEX_DIR", str(ROOT / "data_index")))
+INDEX_DIR.mkdir(parents=True, exist_ok=True)
 USERS_PATH = ROOT / "users.json"
 
 # map roles to the ACTUAL directory names you use (which are subfolders of DATA_DIR)
@@ -22,18 +22,21 @@ ROLE_TO_DIRS = {
 
 ALLOWED_ROLES = set(ROLE_TO_DIRS.keys())
 
-def load_users():
+# Compact integer codes for CATEGORY roles (index columns, row ordering)
+ROLE_CODES = {"public": 0, "internal": 1, "private": 2}
+
+def load_users(path: Path = USERS_PATH):
     """Loads mock user data for authentication."""
-    if not USERS_PATH.exists():
+    if not path.exists():
          # Create a placeholder users.json if it doesn't exist
         placeholder_data = {
             "public_user": {"password": "pwd", "categories": ["public"]},
             "internal_user": {"password": "pwd", "categories": ["public", "internal"]},
             "private_user": {"password": "pwd", "categories": ["public", "internal", "private"]}
         }
-        with open(USERS_PATH, "w", encoding="utf-8") as f:
+        with open(path, "w", encoding="utf-8") as f:
              json.dump(placeholder_data, f, indent=2)
-             print(f"Created placeholder users.json at {USERS_PATH}")
+             print(f"Created placeholder users.json at {path}")
 
-    with open(USERS_PATH, "r", encoding="utf-8") as f:
+    with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
\ No newline at end of file
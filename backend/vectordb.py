@@ -3,30 +3,67 @@ import numpy as np
 from pathlib import Path
 from typing import Tuple, List
 
+from .ann import ANN_MIN_ROWS, ANN_NPROBE, IVFIndex, top_k_positions
+from .index_store import normalize_rows
+
 class VectorDB:
+    """
+    index_path ending in .npy uses the memory-mapped format (normalized
+    float32 rows, same as the indexer's X.npy); .npz keeps the legacy
+    compressed format. Indexes with at least ANN_MIN_ROWS rows also get an
+    IVF index saved next to them (<stem>.ivf_*.npy).
+    """
     def __init__(self, index_path: Path, meta_path: Path):
-        self.index_path = index_path
+        self.index_path = Path(index_path)
         self.meta_path = meta_path
         self._X = None
         self._meta = None
+        self._ann = None
+
+    @property
+    def _ann_prefix(self) -> str:
+        return f"{self.index_path.stem}.ivf_"
+
+    @property
+    def _mmap_format(self) -> bool:
+        return self.index_path.suffix.lower() == ".npy"
 
     def load(self):
-        self._X = np.load(self.index_path)["X"]
+        if self._mmap_format:
+            self._X = np.load(self.index_path, mmap_mode="r")
+        else:
+            # Normalize once here rather than on every search()
+            self._X = normalize_rows(np.load(self.index_path)["X"])
+        self._ann = IVFIndex.load(self.index_path.parent, prefix=self._ann_prefix)
         with open(self.meta_path, "r", encoding="utf-8") as f:
             self._meta = json.load(f)
 
     def save(self, X: np.ndarray, meta: List[dict]):
-        np.savez_compressed(self.index_path, X=X)
+        if self._mmap_format:
+            np.save(self.index_path, np.ascontiguousarray(normalize_rows(X)))
+        else:
+            np.savez_compressed(self.index_path, X=X)
         with open(self.meta_path, "w", encoding="utf-8") as f:
             json.dump(meta, f, ensure_ascii=False, indent=2)
+        if X.shape[0] >= ANN_MIN_ROWS:
+            IVFIndex.train(normalize_rows(X), np.zeros(X.shape[0], dtype="int8")).save(
+                self.index_path.parent, prefix=self._ann_prefix
+            )
+        else:
+            # An IVF left over from a larger index would point past the new rows
+            for name in IVFIndex.FILES:
+                (self.index_path.parent / f"{self._ann_prefix}{name}.npy").unlink(missing_ok=True)
 
-    def search(self, q: np.ndarray, top_k: int = 5) -> List[Tuple[int, float]]:
-        X = self._X
-        qn = q / (np.linalg.norm(q) + 1e-9)
-        Xn = X / (np.linalg.norm(X, axis=1, keepdims=True) + 1e-9)
-        sims = Xn @ qn
-        idx = np.argsort(-sims)[:top_k]
-        return [(int(i), float(sims[i])) for i in idx]
+    def search(self, q: np.ndarray, top_k: int = 5, nprobe: int = ANN_NPROBE) -> List[Tuple[int, float]]:
+        qn = (q / (np.linalg.norm(q) + 1e-9)).astype("float32")
+        if self._ann is not None:
+            rows = self._ann.candidates(qn, None, None, nprobe, min_candidates=top_k)
+            sims = self._X[rows] @ qn
+        else:
+            rows = None
+            sims = self._X @ qn
+        idx = top_k_positions(sims, top_k)
+        return [(int(i if rows is None else rows[i]), float(sims[i])) for i in idx]
 
     @property
     def meta(self):
@@ -0,0 +1 @@
+"""Offline benchmarks for the retrieval pipeline (no OpenAI calls)."""
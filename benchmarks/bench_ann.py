@@ -0,0 +1,56 @@
+"""
+IVF approximate search vs. exact search: latency and recall@k per nprobe,
+for the full corpus and for a restricted (public-only) role partition.
+
+    python -m benchmarks.bench_ann --rows 200000 --dim 256
+"""
+from __future__ import annotations
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.bench_quant import clustered_vectors
+from benchmarks.bench_retrieve import synthetic_meta
+from backend.ann import IVFIndex
+from backend.metastore import MetaStore
+from backend.retriever import IndexSnapshot
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, default=200_000)
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--top-k", type=int, default=10)
+    ap.add_argument("--queries", type=int, default=50)
+    ap.add_argument("--nprobe", default="1,4,8,16,32")
+    args = ap.parse_args()
+
+    X = clustered_vectors(args.rows, args.dim, clusters=1024, noise=0.8)
+    meta = MetaStore.from_dicts(synthetic_meta(args.rows))
+    rng = np.random.default_rng(1)
+    Q = X[rng.integers(0, args.rows, args.queries)] + 0.5 * rng.standard_normal((args.queries, args.dim), dtype="float32")
+    Q /= np.linalg.norm(Q, axis=1, keepdims=True)
+
+    exact = IndexSnapshot.from_arrays(X, meta)
+    ivf_snap = IndexSnapshot.from_arrays(X, meta)
+    t0 = time.perf_counter()
+    ivf_snap.ann = IVFIndex.train(ivf_snap.X_norm, ivf_snap.role_codes)
+    print(f"rows={args.rows} dim={args.dim} nlist={ivf_snap.ann.nlist} "
+          f"train={time.perf_counter() - t0:.1f}s top_k={args.top_k}")
+
+    for roles in (frozenset({"public", "internal", "private"}), frozenset({"public"})):
+        print(f"-- roles: {','.join(sorted(roles))}")
+        t0 = time.perf_counter()
+        truth = [set(exact.search(q, roles, args.top_k)[0].tolist()) for q in Q]
+        print(f"{'exact':<12}{(time.perf_counter() - t0) / len(Q) * 1000:>10.2f} ms{1.0:>10.3f}")
+        for nprobe in (int(n) for n in args.nprobe.split(",")):
+            t0 = time.perf_counter()
+            got = [set(ivf_snap.search(q, roles, args.top_k, nprobe=nprobe)[0].tolist()) for q in Q]
+            ms = (time.perf_counter() - t0) / len(Q) * 1000
+            recall = np.mean([len(g & t) / len(t) for g, t in zip(got, truth)])
+            print(f"{'nprobe=' + str(nprobe):<12}{ms:>10.2f} ms{recall:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
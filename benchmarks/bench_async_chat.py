@@ -0,0 +1,69 @@
+"""
+Load test for the /chat pipeline against the local OpenAI stub: N chats
+issued concurrently on one event loop, through the blocking pipeline
+(answer_with_rag, what route_chat used to call) and the async one
+(aanswer_with_rag). Blocking calls serialize; async calls overlap.
+
+    python -m benchmarks.bench_async_chat --concurrency 32 --chat-latency 0.5
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+from benchmarks.stub_openai import serve_in_thread  # noqa: E402
+
+
+async def _run(fn, n: int, retriever, tag: str) -> float:
+    async def one(i: int):
+        return await fn(message=f"{tag} question number {i}", category="public", retriever=retriever,
+                        allowed_roles=["public"], top_k=5)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    return time.perf_counter() - t0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--rows", type=int, default=20_000)
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--embed-latency", type=float, default=0.05)
+    ap.add_argument("--chat-latency", type=float, default=0.5)
+    args = ap.parse_args()
+
+    os.environ["OPENAI_BASE_URL"] = serve_in_thread(dim=args.dim, embed_latency=args.embed_latency,
+                                                    chat_latency=args.chat_latency)
+
+    # Imported after OPENAI_BASE_URL is set; the shared clients pick it up
+    from backend.chat import aanswer_with_rag, answer_with_rag
+    from backend.retriever import Retriever
+    from benchmarks.bench_retrieve import synthetic_snapshot
+
+    retriever = Retriever(autoload=False)
+    with contextlib.redirect_stdout(io.StringIO()):
+        retriever.publish(synthetic_snapshot(args.rows, args.dim))
+
+    async def blocking(**kw):
+        return answer_with_rag(**kw)
+
+    n = args.concurrency
+    per_chat = args.embed_latency + args.chat_latency
+    print(f"concurrency={n} embed={args.embed_latency * 1000:.0f}ms chat={args.chat_latency * 1000:.0f}ms "
+          f"(~{per_chat * 1000:.0f}ms per chat)")
+    with contextlib.redirect_stdout(io.StringIO()):
+        t_sync = asyncio.run(_run(blocking, n, retriever, "sync"))
+        t_async = asyncio.run(_run(aanswer_with_rag, n, retriever, "async"))
+    print(f"{'pipeline':<10} {'wall (s)':>9} {'chats/s':>8}")
+    print(f"{'blocking':<10} {t_sync:>9.2f} {n / t_sync:>8.1f}")
+    print(f"{'async':<10} {t_async:>9.2f} {n / t_async:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Chunker throughput (MB/s) on large synthetic documents: the offset-based
+chunk_spans() vs. the previous string-building chunker, kept below as a
+reference. Every document is also checked for identical chunk boundaries.
+
+    python -m benchmarks.bench_chunker --docs 8 --mb 4
+"""
+from __future__ import annotations
+import argparse
+import re
+import time
+from typing import List
+
+import numpy as np
+
+from backend.chunker import chunk_spans, chunk_text
+
+_SENT_SPLIT = re.compile(r"(?<=[.!?])\s+")
+_PARA_SPLIT = re.compile(r"\n\s*\n+")
+
+WORDS = ("policy student leave campus office hours library parking permit course credit "
+         "deadline registration faculty research grant report résumé café naïve").split()
+
+
+def _legacy_sentences(text: str) -> List[str]:
+    sents: List[str] = []
+    for para in _PARA_SPLIT.split(text):
+        para = para.strip()
+        if not para:
+            continue
+        for s in _SENT_SPLIT.split(para):
+            s = s.strip()
+            if s:
+                sents.append(s)
+    return sents
+
+
+def legacy_chunk_text(text: str, max_chars: int = 1800, min_chars: int = 600, overlap_sents: int = 1) -> List[str]:
+    """The chunker as it was before chunk_spans(), unchanged."""
+    sents = _legacy_sentences(text)
+    chunks: List[str] = []
+    curr: List[str] = []
+    curr_len = 0
+
+    def flush():
+        if curr:
+            chunks.append(" ".join(curr))
+            curr.clear()
+            nonlocal curr_len
+            curr_len = 0
+
+    for i, s in enumerate(sents):
+        s_len = len(s) + 1
+        if curr_len + s_len <= max_chars or not curr:
+            curr.append(s)
+            curr_len += s_len
+        else:
+            flush()
+            if overlap_sents > 0 and chunks and i > 0:
+                carry_start = max(0, i - overlap_sents)
+                carry = sents[carry_start:i]
+                if carry:
+                    curr.extend(carry)
+                    curr_len = sum(len(x) + 1 for x in curr)
+
+            curr.append(s)
+            curr_len += s_len
+
+    flush()
+
+    if len(chunks) >= 2 and len(chunks[-1]) < min_chars:
+        chunks[-2] = (chunks[-2] + " " + chunks[-1]).strip()
+        chunks.pop()
+
+    return [c for c in (x.strip() for x in chunks) if c]
+
+
+def same_boundaries(text: str, **kw) -> bool:
+    """
+    chunk_text() starts and ends every chunk where the legacy chunker did.
+    The only textual difference is the merged tail: the legacy chunker glued
+    the last two chunks with " ", repeating their overlap sentences, while a
+    span covers the overlap once.
+    """
+    new, old = chunk_text(text, **kw), legacy_chunk_text(text, **kw)
+    if new == old:
+        return True
+    unmerged = legacy_chunk_text(text, **dict(kw, min_chars=0))
+    return (len(new) == len(unmerged) - 1 and new[:-1] == unmerged[:-2]
+            and new[-1].startswith(unmerged[-2]) and new[-1].endswith(unmerged[-1])
+            and old[-1] == unmerged[-2] + " " + unmerged[-1])
+
+
+def synthetic_document(n_bytes: int, seed: int = 0) -> str:
+    """Paragraphs of sentences with varied lengths, stray whitespace and non-ASCII words."""
+    rng = np.random.default_rng(seed)
+    words = np.array(WORDS)
+    out: List[str] = []
+    size = 0
+    while size < n_bytes:
+        para = []
+        for _ in range(int(rng.integers(1, 12))):
+            n = int(rng.integers(3, 60))
+            sent = " ".join(words[rng.integers(0, len(words), n)])
+            para.append(sent.capitalize() + str(rng.choice([".", "!", "?", ".  ", ".\n"])))
+        block = " ".join(para) + "\n\n" + ("  \n\n" if rng.random() < 0.1 else "")
+        out.append(block)
+        size += len(block)
+    return "".join(out)
+
+
+def _mb_per_s(fn, docs: List[str], repeat: int) -> float:
+    mb = sum(len(d.encode("utf-8")) for d in docs) / 1e6
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for d in docs:
+            fn(d)
+        best = min(best, time.perf_counter() - t0)
+    return mb / best
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--docs", type=int, default=8)
+    ap.add_argument("--mb", type=float, default=4.0, help="size of each document")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--check-docs", type=int, default=500, help="small random documents checked for equivalence")
+    args = ap.parse_args()
+
+    docs = [synthetic_document(int(args.mb * 1e6), seed=i) for i in range(args.docs)]
+
+    # Equivalence: the large documents plus many small ones, where the
+    # tail-merge and overlap edge cases are hit far more often
+    rng = np.random.default_rng(1)
+    checks = [(d, {}) for d in docs]
+    for i in range(args.check_docs):
+        kw = {"max_chars": int(rng.integers(50, 2000)), "min_chars": int(rng.integers(0, 800)),
+              "overlap_sents": int(rng.integers(0, 4))}
+        checks.append((synthetic_document(int(rng.integers(0, 8000)), seed=1000 + i), kw))
+    bad = sum(not same_boundaries(d, **kw) for d, kw in checks)
+    print(f"equivalence: {len(checks) - bad}/{len(checks)} documents with identical chunk boundaries")
+
+    print(f"docs={args.docs} x {args.mb:g} MB")
+    print(f"{'chunker':<22}{'MB/s':>8}")
+    for name, fn in (("legacy (join)", legacy_chunk_text),
+                     ("chunk_spans", chunk_spans),
+                     ("chunk_text (spans)", chunk_text)):
+        print(f"{name:<22}{_mb_per_s(fn, docs, args.repeat):>8.1f}")
+    if bad:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Quantized coarse search + float32 re-ranking vs. exact float32 search:
+latency, bytes scanned per query and recall@k against the exact result.
+
+    python -m benchmarks.bench_quant --rows 100000 --dim 768
+"""
+from __future__ import annotations
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.bench_retrieve import synthetic_meta
+from backend.metastore import MetaStore
+from backend.retriever import IndexSnapshot
+
+
+def clustered_vectors(rows: int, dim: int, clusters: int = 256, noise: float = 0.6, seed: int = 0) -> np.ndarray:
+    """Embedding-like data: points scattered around random topic centroids."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim), dtype="float32")
+    X = centers[rng.integers(0, clusters, rows)]
+    X += noise * rng.standard_normal((rows, dim), dtype="float32")
+    return X
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--dim", type=int, default=768)
+    ap.add_argument("--top-k", type=int, default=10)
+    ap.add_argument("--queries", type=int, default=50)
+    args = ap.parse_args()
+
+    X = clustered_vectors(args.rows, args.dim)
+    meta = MetaStore.from_dicts(synthetic_meta(args.rows))
+    rng = np.random.default_rng(1)
+    Q = X[rng.integers(0, args.rows, args.queries)] + 0.3 * rng.standard_normal((args.queries, args.dim), dtype="float32")
+    Q /= np.linalg.norm(Q, axis=1, keepdims=True)
+
+    exact = IndexSnapshot.from_arrays(X, meta)
+    variants = {
+        "float32 (exact)": exact,
+        "int8 + rerank": IndexSnapshot.from_arrays(X, meta, quantization="int8"),
+    }
+
+    print(f"rows={args.rows} dim={args.dim} top_k={args.top_k} queries={args.queries}")
+    print(f"{'mode':<20}{'scan MB':>10}{'ms/query':>11}{'recall@k':>10}")
+    for roles in (frozenset({"public"}), frozenset({"public", "internal", "private"})):
+        truth = [set(exact.search(q, roles, args.top_k)[0].tolist()) for q in Q]
+        print(f"-- roles: {','.join(sorted(roles))}")
+        for name, snap in variants.items():
+            scanned = snap.Xq if snap.Xq is not None else snap.X_norm
+            snap.search(Q[0], roles, args.top_k)  # warm-up
+            t0 = time.perf_counter()
+            got = [set(snap.search(q, roles, args.top_k)[0].tolist()) for q in Q]
+            ms = (time.perf_counter() - t0) / len(Q) * 1000
+            recall = np.mean([len(g & t) / len(t) for g, t in zip(got, truth)])
+            print(f"{name:<20}{scanned.nbytes / 1e6:>10.1f}{ms:>11.2f}{recall:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Retrieval microbenchmark: legacy argsort + Python RBAC loop vs. the
+vectorized row-partition / argpartition path in Retriever.retrieve.
+
+    python -m benchmarks.bench_retrieve --rows 100000 --dim 256
+"""
+from __future__ import annotations
+import argparse
+import contextlib
+import io
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")  # no requests are made
+
+from backend.retriever import IndexSnapshot, Retriever  # noqa: E402
+
+ROLES = ["public", "internal", "private"]
+
+
+def synthetic_meta(rows: int, role_mix=(0.1, 0.3, 0.6), seed: int = 0) -> List[Dict]:
+    rng = np.random.default_rng(seed)
+    # Rows grouped by role, as build_index writes them
+    roles = np.sort(rng.choice(ROLES, size=rows, p=list(role_mix)))
+    return [
+        {"path": f"doc{i // 20}.txt", "folder_role": r, "category_role": r,
+         "chunk_id": i % 20, "chunk_text": f"chunk {i}", "contacts": {}}
+        for i, r in enumerate(roles)
+    ]
+
+
+def synthetic_snapshot(rows: int, dim: int, role_mix=(0.1, 0.3, 0.6), seed: int = 0) -> IndexSnapshot:
+    rng = np.random.default_rng(seed)
+    X = rng.standard_normal((rows, dim), dtype="float32")
+    return IndexSnapshot.from_arrays(X, synthetic_meta(rows, role_mix, seed))
+
+
+def legacy_retrieve(snap: IndexSnapshot, q: np.ndarray, allowed_roles: List[str], top_k: int) -> List[Dict]:
+    """The pre-vectorization algorithm, kept here as the baseline."""
+    allowed = {r.lower() for r in allowed_roles}
+    sims = snap.X_norm @ q
+    order = np.argsort(-sims)
+    results: List[Dict] = []
+    for i in order:
+        m = snap.meta[i]
+        if m.get("category_role", "public").lower() not in allowed:
+            continue
+        text = (m.get("chunk_text") or "").strip()
+        if not text:
+            continue
+        results.append({"text": text, "meta": m, "cos": float(sims[i])})
+        if len(results) >= max(1, int(top_k)):
+            break
+    return results
+
+
+def _time(fn, repeats: int) -> float:
+    fn()  # warm-up
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - t0) / repeats * 1000
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--top-k", type=int, default=5)
+    ap.add_argument("--repeats", type=int, default=20)
+    args = ap.parse_args()
+
+    snap = synthetic_snapshot(args.rows, args.dim)
+    r = Retriever(autoload=False)
+    r.publish(snap)
+
+    rng = np.random.default_rng(1)
+    q = rng.standard_normal(args.dim).astype("float32")
+    q /= np.linalg.norm(q)
+    r._embed_query = lambda _text: q
+
+    print(f"rows={args.rows} dim={args.dim} top_k={args.top_k} (10% public / 30% internal / 60% private)")
+    print(f"{'roles':<28}{'legacy ms':>12}{'vectorized ms':>16}{'speedup':>10}")
+    for roles in (["public"], ["public", "internal"], ["public", "internal", "private"]):
+        with contextlib.redirect_stdout(io.StringIO()):
+            want = [x["meta"]["chunk_text"] for x in legacy_retrieve(snap, q, roles, args.top_k)]
+            got = [x["meta"]["chunk_text"] for x in r.retrieve("q", roles, args.top_k)]
+            assert want == got, (want, got)
+            t_old = _time(lambda: legacy_retrieve(snap, q, roles, args.top_k), args.repeats)
+            t_new = _time(lambda: r.retrieve("q", roles, args.top_k), args.repeats)
+        print(f"{','.join(roles):<28}{t_old:>12.2f}{t_new:>16.2f}{t_old / t_new:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Startup cost of the API: import time of backend.main, time until the app
+serves requests and until /ready reports the index live, and the latency
+of the first and second /chat, for each INDEX_PRELOAD mode. Each mode runs
+in a fresh interpreter against one synthetic index (benchmarks.corpus,
+deterministic fakes from benchmarks.fakes).
+
+    python -m benchmarks.bench_startup --chunks 20000
+"""
+from __future__ import annotations
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+MODES = ("lazy", "eager", "background")
+
+
+def _env(workdir: Path, **extra) -> dict:
+    return dict(os.environ, RETRIEVAI_DATA_DIR=str(workdir / "raw"), RETRIEVAI_INDEX_DIR=str(workdir / "index"),
+                OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "benchmark"), **extra)
+
+
+def _build(args) -> None:
+    from benchmarks.fakes import use_fakes
+    from backend.indexer import build_index
+
+    with use_fakes(dim=args.dim), contextlib.redirect_stdout(io.StringIO()):
+        build_index(full=True)
+
+
+def _measure(args) -> None:
+    t0 = time.perf_counter()
+    import backend.main as main
+    import_s = time.perf_counter() - t0
+    openai_loaded = "openai" in sys.modules
+
+    from fastapi.testclient import TestClient
+    from benchmarks.fakes import use_fakes
+
+    out = {"mode": main.INDEX_PRELOAD, "import_s": import_s, "openai_imported": openai_loaded}
+    with use_fakes(dim=args.dim), contextlib.redirect_stdout(io.StringIO()):
+        client = TestClient(main.app)
+        t0 = time.perf_counter()
+        client.__enter__()                       # runs the lifespan startup
+        out["startup_s"] = time.perf_counter() - t0
+        if main.INDEX_PRELOAD != "lazy":
+            while client.get("/ready").status_code != 200 and time.perf_counter() - t0 < args.timeout:
+                time.sleep(0.002)
+            out["ready_s"] = time.perf_counter() - t0
+        try:
+            token = client.post("/auth/login", json={"username": args.user, "password": args.password}).json()["token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            for name, question in (("first_chat_s", "first question after startup"),
+                                   ("second_chat_s", "second question after startup")):
+                t = time.perf_counter()
+                client.post("/chat", json={"message": question, "category": "public"}, headers=headers)
+                out[name] = time.perf_counter() - t
+        finally:
+            client.__exit__(None, None, None)
+    print(json.dumps(out))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--chunks", type=int, default=20_000)
+    ap.add_argument("--dim", type=int, default=1024)
+    ap.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    ap.add_argument("--user", default="admin")
+    ap.add_argument("--password", default="admin123")
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--worker", choices=("build", "measure"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker == "build":
+        _build(args)
+        return
+    if args.worker == "measure":
+        _measure(args)
+        return
+
+    from benchmarks.corpus import generate_corpus
+
+    passthrough = ["--dim", str(args.dim), "--user", args.user, "--password", args.password,
+                   "--timeout", str(args.timeout)]
+    with tempfile.TemporaryDirectory(prefix="retrievai-startup-") as tmp:
+        workdir = Path(tmp)
+        generate_corpus(workdir / "raw", args.chunks)
+        subprocess.run([sys.executable, "-m", "benchmarks.bench_startup", "--worker", "build", *passthrough],
+                       env=_env(workdir), check=True)
+
+        print(f"chunks={args.chunks} dim={args.dim}")
+        print(f"{'mode':<11} {'import':>8} {'startup':>8} {'ready':>8} {'1st chat':>9} {'2nd chat':>9}  openai")
+        for mode in args.modes:
+            proc = subprocess.run([sys.executable, "-m", "benchmarks.bench_startup", "--worker", "measure",
+                                   *passthrough], env=_env(workdir, INDEX_PRELOAD=mode),
+                                  capture_output=True, text=True, check=True)
+            r = json.loads(proc.stdout.strip().splitlines()[-1])
+            ready = f"{r['ready_s'] * 1000:>6.0f}ms" if "ready_s" in r else f"{'-':>8}"
+            print(f"{mode:<11} {r['import_s'] * 1000:>6.0f}ms {r['startup_s'] * 1000:>6.0f}ms {ready} "
+                  f"{r['first_chat_s'] * 1000:>7.1f}ms {r['second_chat_s'] * 1000:>7.1f}ms  "
+                  f"{'imported' if r['openai_imported'] else 'not imported'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Checks the embeddings client (backend/embedder.py) against the local OpenAI
+stub: requests are split by input count and token budget, transient 429/503
+responses are retried, retries give up after EMBED_MAX_RETRIES, and rows come
+back in input order even when the service returns them shuffled. Runs the
+sync (embed_texts) and async (aembed_texts) paths; exits non-zero on failure.
+
+    python -m benchmarks.check_embedder
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+from typing import Callable, List
+
+from benchmarks.stub_openai import make_app, serve_in_thread, stub_vector
+
+BATCH_SIZE = 8
+MAX_RETRIES = 3
+
+
+def _configure(base_url: str) -> None:
+    # Read by backend modules at import time
+    os.environ.update(EMBED_PROVIDER="openai", OPENAI_BASE_URL=base_url, OPENAI_API_KEY="check",
+                      EMBED_BATCH_SIZE=str(BATCH_SIZE), EMBED_CONCURRENCY="4",
+                      EMBED_MAX_RETRIES=str(MAX_RETRIES), EMBED_BACKOFF_BASE="0.01", EMBED_BACKOFF_MAX="0.05")
+
+
+def _texts(n: int) -> List[str]:
+    return [f"chunk {i}: " + "lorem ipsum " * (i % 5) + ("\nsecond line" if i % 3 == 0 else "") for i in range(n)]
+
+
+def _check(ok: bool, what: str) -> None:
+    if not ok:
+        raise SystemExit(f"FAIL: {what}")
+    print(f"ok    {what}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--texts", type=int, default=50)
+    ap.add_argument("--dim", type=int, default=32)
+    args = ap.parse_args()
+
+    import numpy as np
+
+    app = make_app(dim=args.dim, embed_latency=0.0)
+    _configure(serve_in_thread(app=app))
+    from backend import embedder
+
+    from backend.clients import aclose_clients
+
+    texts = _texts(args.texts)
+    expected = np.stack([stub_vector(embedder.prepare_text(t), args.dim) for t in texts])
+    n_batches = -(-len(texts) // BATCH_SIZE)
+    # One loop for every async call: the shared async client is bound to it
+    loop = asyncio.new_event_loop()
+    paths = {
+        "embed_texts": embedder.embed_texts,
+        "aembed_texts": lambda ts: loop.run_until_complete(embedder.aembed_texts(ts)),
+    }
+
+    def served(log) -> List[List[str]]:
+        return [inputs for inputs, status in log if status == 200]
+
+    def run(fn: Callable, inputs: List[str] = texts, **state):
+        for k, v in state.items():
+            setattr(app.state, k, v)
+        app.state.embed_log = []
+        with contextlib.redirect_stdout(io.StringIO()):   # retry messages
+            return fn(inputs)
+
+    for name, fn in paths.items():
+        # Batch splitting by input count: every input sent exactly once, in contiguous batches
+        V = run(fn, fail_every=0, shuffle=False)
+        batches = served(app.state.embed_log)
+        _check(sorted(len(b) for b in batches) == sorted([BATCH_SIZE] * (len(texts) // BATCH_SIZE)
+                                                         + [len(texts) % BATCH_SIZE] * (len(texts) % BATCH_SIZE > 0)),
+               f"{name}: {len(texts)} inputs split into {n_batches} requests of <= {BATCH_SIZE}")
+        _check(sorted(sum(batches, [])) == sorted(embedder.prepare_text(t) for t in texts),
+               f"{name}: every input sent once")
+        _check(np.allclose(V, expected), f"{name}: rows match the inputs")
+
+        # Batch splitting by token budget
+        budget = embedder.EMBED_BATCH_TOKENS
+        embedder.EMBED_BATCH_TOKENS = tokens = 3 * max(embedder.approx_tokens(t) for t in texts)
+        try:
+            V = run(fn)
+        finally:
+            embedder.EMBED_BATCH_TOKENS = budget
+        batches = served(app.state.embed_log)
+        _check(all(sum(map(embedder.approx_tokens, b)) <= tokens for b in batches)
+               and len(batches) > n_batches and np.allclose(V, expected),
+               f"{name}: a {tokens}-token budget splits requests further ({len(batches)} requests)")
+
+        # Order is restored from each row's index when the service shuffles rows
+        V = run(fn, shuffle=True)
+        _check(np.allclose(V, expected), f"{name}: shuffled response rows returned in input order")
+
+        # Transient 429/503 responses are retried
+        V = run(fn, fail_every=3, shuffle=True)
+        log = app.state.embed_log
+        failures = sum(status != 200 for _, status in log)
+        _check(failures > 0 and {s for _, s in log} >= {429, 503} and len(served(log)) == n_batches
+               and np.allclose(V, expected),
+               f"{name}: {failures} injected 429/503 responses retried, result unchanged")
+
+        # ... up to EMBED_MAX_RETRIES times per request (one request here)
+        try:
+            run(fn, texts[:BATCH_SIZE], fail_every=1, shuffle=False)
+            raised = None
+        except Exception as e:
+            raised = e
+        attempts = len(app.state.embed_log)
+        _check(type(raised) in embedder._transient_errors() and attempts == MAX_RETRIES + 1,
+               f"{name}: gives up with {type(raised).__name__} after {attempts} attempts")
+        app.state.fail_every = 0
+    loop.run_until_complete(aclose_clients())
+    loop.close()
+    print("all embedder checks passed")
+
+
+if __name__ == "__main__":
+    main()
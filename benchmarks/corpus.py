@@ -0,0 +1,115 @@
+"""
+Synthetic document corpora in the Data/raw layout the indexer reads:
+
+    <root>/Public/doc_000000.txt
+    <root>/Internal/...
+    <root>/Private/...
+
+Files hold one or more sections, most of them introduced by a
+"CATEGORY: PUBLIC|INTERNAL|PRIVATE" block, so role tags are mixed within
+files and folders; some files have no block and take their folder role.
+
+    python -m benchmarks.corpus /tmp/corpus --chunks 10000
+"""
+from __future__ import annotations
+import argparse
+import json
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+FOLDERS = {"public": "Public", "internal": "Internal", "private": "Private"}
+ROLES = list(FOLDERS)
+FOLDER_MIX = (0.5, 0.3, 0.2)
+
+# Characters of section text per chunk the indexer produces (chunker default
+# max_chars=1800 with a one-sentence overlap), used to size sections
+CHARS_PER_CHUNK = 1650
+CHUNKS_PER_SECTION = (1, 12)
+SENTENCE_POOL = 8192
+
+BLOCK = "==============================\nCATEGORY: {}\n==============================\n"
+
+
+def _vocabulary(rng: np.random.Generator, n: int = 6000) -> np.ndarray:
+    syllables = np.array([c + v for c in "bcdfghjklmnprstvwz" for v in "aeiou"])
+    lengths = rng.integers(1, 4, n)
+    return np.array(["".join(rng.choice(syllables, k)) for k in lengths])
+
+
+def _sentences(rng: np.random.Generator, n: int) -> List[str]:
+    vocab = _vocabulary(rng)
+    # Zipf-like word frequencies, so some terms are common and some rare
+    p = 1.0 / np.arange(1, len(vocab) + 1)
+    p /= p.sum()
+    out = []
+    for _ in range(n):
+        words = vocab[rng.choice(len(vocab), int(rng.integers(6, 28)), p=p)]
+        out.append(" ".join(words).capitalize() + str(rng.choice([".", ".", ".", "?", "!"])))
+    return out
+
+
+def _contacts(rng: np.random.Generator, i: int) -> str:
+    kind = int(rng.integers(0, 3))
+    if kind == 0:
+        return f"email: team{i}@example.com\n"
+    if kind == 1:
+        return f"url: https://intranet.example.com/page/{i}\n"
+    return f"phone: +1 555 {i % 1000:03d} {i % 10000:04d}\n"
+
+
+def generate_corpus(root: Path, chunks: int, seed: int = 0) -> Dict:
+    """
+    Write roughly `chunks` chunks worth of documents under root and return
+    {"files", "sections", "bytes", "target_chunks"}. Deterministic for a seed.
+    """
+    rng = np.random.default_rng(seed)
+    pool = _sentences(rng, SENTENCE_POOL)
+    pool_len = np.array([len(s) + 1 for s in pool])
+    for folder in FOLDERS.values():
+        (root / folder).mkdir(parents=True, exist_ok=True)
+
+    stats = {"files": 0, "sections": 0, "bytes": 0, "target_chunks": chunks}
+    remaining = chunks
+    while remaining > 0:
+        folder_role = ROLES[int(rng.choice(3, p=FOLDER_MIX))]
+        parts: List[str] = []
+        for s in range(int(rng.integers(1, 5))):
+            n = min(remaining, int(rng.integers(*CHUNKS_PER_SECTION)))
+            remaining -= n
+            # Sentences until the section holds about n chunks of text
+            idx = rng.integers(0, SENTENCE_POOL, int(n * CHARS_PER_CHUNK / pool_len.mean()) + 1)
+            body = " ".join(pool[i] for i in idx)
+            # Paragraph breaks every few sentences are kept by the chunker
+            body = body.replace("! ", "!\n\n")
+            if rng.random() < 0.3:
+                body = _contacts(rng, stats["sections"]) + body
+            if s > 0 or rng.random() < 0.85:
+                # Mostly the folder's own role, sometimes another one
+                role = folder_role if rng.random() < 0.7 else ROLES[int(rng.integers(0, 3))]
+                parts.append(BLOCK.format(role.upper()) + body)
+            else:
+                parts.append(body)
+            stats["sections"] += 1
+            if remaining <= 0:
+                break
+        text = "\n\n".join(parts) + "\n"
+        path = root / FOLDERS[folder_role] / f"doc_{stats['files']:06d}.txt"
+        path.write_text(text, encoding="utf-8")
+        stats["files"] += 1
+        stats["bytes"] += len(text.encode("utf-8"))
+    return stats
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("root", type=Path)
+    ap.add_argument("--chunks", type=int, default=10_000)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    print(json.dumps(generate_corpus(args.root, args.chunks, args.seed)))
+
+
+if __name__ == "__main__":
+    main()
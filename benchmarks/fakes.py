@@ -0,0 +1,98 @@
+"""
+Deterministic in-process stand-ins for the OpenAI calls, so the indexing,
+retrieval and chat paths can be measured offline:
+
+- embeddings: pseudo-random unit vectors seeded by a hash of the text, so
+  the same text always gets the same vector (and the embedding cache works);
+- chat: canned completions after a configurable latency, including three
+  rewrite lines for the query-rewrite prompt.
+
+    with use_fakes(dim=256, chat_latency=0.2):
+        build_index()
+"""
+from __future__ import annotations
+import asyncio
+import contextlib
+import hashlib
+import time
+from typing import AsyncIterator, Iterator, List
+
+import numpy as np
+
+STREAM_PIECES = 20
+
+
+def fake_vector(text: str, dim: int) -> np.ndarray:
+    """Unit vector from the SHAKE-128 digest of the text."""
+    raw = hashlib.shake_128(text.encode("utf-8")).digest(2 * dim)
+    v = np.frombuffer(raw, dtype="<i2").astype("float32")
+    return v / (np.linalg.norm(v) + 1e-8)
+
+
+def fake_embed_texts(texts: List[str], dim: int = 256, latency: float = 0.0) -> np.ndarray:
+    if latency:
+        time.sleep(latency)
+    if not texts:
+        return np.zeros((0, dim), dtype="float32")
+    return np.stack([fake_vector(t, dim) for t in texts])
+
+
+def fake_answer(system_prompt: str, user_prompt: str) -> str:
+    from backend.chat import SYSTEM_REWRITE
+
+    question = next((line[len("QUESTION:"):].strip() for line in user_prompt.splitlines()
+                     if line.startswith("QUESTION:")), "the question")
+    if system_prompt == SYSTEM_REWRITE:
+        return "\n".join(f"{prefix} {question}" for prefix in
+                         ("What is the policy on", "Where can I find details about", "Who handles requests about"))
+    words = user_prompt.split()
+    return f"Based on the provided context ({len(words)} words): {question}"
+
+
+@contextlib.contextmanager
+def use_fakes(dim: int = 256, embed_latency: float = 0.0, chat_latency: float = 0.0) -> Iterator[None]:
+    """Patch the embedding and chat entry points of the backend for the duration."""
+    from backend import chat, embed_cache, embedder
+
+    def embed_texts(texts: List[str]) -> np.ndarray:
+        return fake_embed_texts(texts, dim, embed_latency)
+
+    async def aembed_texts(texts: List[str]) -> np.ndarray:
+        if embed_latency:
+            await asyncio.sleep(embed_latency)
+        return fake_embed_texts(texts, dim)
+
+    def _chat(system_prompt: str, user_prompt: str) -> str:
+        if chat_latency:
+            time.sleep(chat_latency)
+        return fake_answer(system_prompt, user_prompt)
+
+    async def _achat(system_prompt: str, user_prompt: str) -> str:
+        if chat_latency:
+            await asyncio.sleep(chat_latency)
+        return fake_answer(system_prompt, user_prompt)
+
+    async def _astream_chat(system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        words = fake_answer(system_prompt, user_prompt).split(" ")
+        step = max(1, len(words) // STREAM_PIECES)
+        for i in range(0, len(words), step):
+            if chat_latency:
+                await asyncio.sleep(chat_latency * step / len(words))
+            yield " ".join(words[i:i + step]) + " "
+
+    patches = [
+        (embedder, "embed_texts", embed_texts),
+        (embedder, "aembed_texts", aembed_texts),
+        (embed_cache, "embed_texts", embed_texts),
+        (chat, "_chat", _chat),
+        (chat, "_achat", _achat),
+        (chat, "_astream_chat", _astream_chat),
+    ]
+    saved = [(mod, name, getattr(mod, name)) for mod, name, _ in patches]
+    for mod, name, fn in patches:
+        setattr(mod, name, fn)
+    try:
+        yield
+    finally:
+        for mod, name, fn in saved:
+            setattr(mod, name, fn)
@@ -0,0 +1,279 @@
+"""
+Offline benchmark suite: indexing, retrieval, chunking and chat on synthetic
+corpora, with deterministic embedding and LLM stand-ins (benchmarks.fakes).
+Results are written as JSON so runs can be compared.
+
+    python -m benchmarks.run --chunks 1000 10000 100000 --out bench.json
+    python -m benchmarks.run --chunks 1000 --suites retrieve --modes dense lexical hybrid
+
+Every suite runs in a fresh interpreter pointed at the corpus through
+RETRIEVAI_DATA_DIR / RETRIEVAI_INDEX_DIR, so the peak RSS it reports is its
+own. Suites:
+
+  chunk     chunk_text over every corpus file         MB/s, per-file latency
+  index     build_index(full=True)                    chunks/s, MB/s, wall time
+  retrieve  Retriever.retrieve per RETRIEVAL mode     queries/s, latency
+  chat      answer_with_rag (and aanswer_with_rag     chats/s, latency
+            with --chat-concurrency > 1)
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.corpus import generate_corpus
+
+SUITES = ("chunk", "index", "retrieve", "chat")
+CASCADE = {
+    "public": ["public"],
+    "internal": ["public", "internal"],
+    "private": ["public", "internal", "private"],
+}
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process in MiB (None where unsupported)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+
+def latency_stats(seconds: List[float]) -> Dict:
+    ms = np.asarray(seconds) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99]) if len(ms) else (0.0, 0.0, 0.0)
+    return {"n": len(ms), "mean_ms": round(float(ms.mean()), 3) if len(ms) else 0.0,
+            "p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3)}
+
+
+def _corpus_files(data_dir: Path) -> List[Path]:
+    return sorted(p for p in data_dir.rglob("*.txt"))
+
+
+def _queries(n: int, seed: int) -> List[str]:
+    """Question-like strings cut from indexed chunk texts (distinct, so no cache hits)."""
+    from backend.index_store import current_generation_dir
+    from backend.metastore import MetaStore
+
+    meta = MetaStore.load(current_generation_dir())
+    rng = np.random.default_rng(seed)
+    out: List[str] = []
+    seen = set()
+    while len(out) < n:
+        words = meta.text(int(rng.integers(0, len(meta)))).split()[12:]
+        if len(words) < 8:
+            continue
+        start = int(rng.integers(0, len(words) - 7))
+        q = " ".join(words[start:start + int(rng.integers(4, 9))]).strip(".?!") + "?"
+        if q not in seen:
+            seen.add(q)
+            out.append(q)
+    return out
+
+
+# ---- suites (run inside the worker process) ----
+
+def suite_chunk(args) -> Dict:
+    from backend.chunker import chunk_text
+
+    texts = [p.read_text(encoding="utf-8") for p in _corpus_files(Path(os.environ["RETRIEVAI_DATA_DIR"]))]
+    mb = sum(len(t.encode("utf-8")) for t in texts) / 1e6
+    lat, chunks = [], 0
+    t_all = time.perf_counter()
+    for t in texts:
+        t0 = time.perf_counter()
+        chunks += len(chunk_text(t))
+        lat.append(time.perf_counter() - t0)
+    wall = time.perf_counter() - t_all
+    return {"files": len(texts), "chunks": chunks, "mb": round(mb, 2), "wall_s": round(wall, 3),
+            "mb_per_s": round(mb / wall, 2), "per_file": latency_stats(lat)}
+
+
+def suite_index(args) -> Dict:
+    from backend.index_store import read_index_info
+    from backend.indexer import build_index
+
+    mb = sum(p.stat().st_size for p in _corpus_files(Path(os.environ["RETRIEVAI_DATA_DIR"]))) / 1e6
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        gen_dir = build_index(full=True)
+    wall = time.perf_counter() - t0
+    rows = int(read_index_info(gen_dir).get("rows", 0))
+    return {"chunks": rows, "mb": round(mb, 2), "wall_s": round(wall, 3),
+            "chunks_per_s": round(rows / wall, 1), "mb_per_s": round(mb / wall, 2)}
+
+
+def suite_retrieve(args) -> Dict:
+    from backend.retriever import Retriever
+
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        retriever = Retriever()
+    out: Dict = {"load_s": round(time.perf_counter() - t0, 3), "rows": int(retriever.X_norm.shape[0])}
+    categories = list(CASCADE)
+    # Separate query sets per mode, so the query-embedding cache never helps
+    queries = _queries(args.queries * len(args.modes), args.seed)
+    for m, mode in enumerate(args.modes):
+        lat = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i, q in enumerate(queries[m * args.queries:(m + 1) * args.queries]):
+                t = time.perf_counter()
+                retriever.retrieve(q, allowed_roles=CASCADE[categories[i % 3]], top_k=args.top_k, mode=mode)
+                lat.append(time.perf_counter() - t)
+        out[mode] = {"qps": round(len(lat) / sum(lat), 1), **latency_stats(lat)}
+    return out
+
+
+def suite_chat(args) -> Dict:
+    from backend.chat import aanswer_with_rag, answer_with_rag
+    from backend.retriever import Retriever
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        retriever = Retriever()
+    categories = list(CASCADE)
+    queries = _queries(args.queries * 2, args.seed + 1)
+    out: Dict = {"chat_latency_s": args.chat_latency}
+
+    lat = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i, q in enumerate(queries[:args.queries]):
+            cat = categories[i % 3]
+            t = time.perf_counter()
+            answer_with_rag(q, cat, retriever, CASCADE[cat], top_k=args.top_k)
+            lat.append(time.perf_counter() - t)
+    out["sync"] = {"chats_per_s": round(len(lat) / sum(lat), 1), **latency_stats(lat)}
+
+    if args.chat_concurrency > 1:
+        async def run() -> List[float]:
+            sem = asyncio.Semaphore(args.chat_concurrency)
+
+            async def one(i: int, q: str) -> float:
+                async with sem:
+                    cat = categories[i % 3]
+                    t = time.perf_counter()
+                    await aanswer_with_rag(q, cat, retriever, CASCADE[cat], top_k=args.top_k)
+                    return time.perf_counter() - t
+
+            return list(await asyncio.gather(*(one(i, q) for i, q in enumerate(queries[args.queries:]))))
+
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            alat = asyncio.run(run())
+        wall = time.perf_counter() - t0
+        out["async"] = {"concurrency": args.chat_concurrency, "chats_per_s": round(len(alat) / wall, 1),
+                        **latency_stats(alat)}
+    return out
+
+
+def _worker(args) -> None:
+    from benchmarks.fakes import use_fakes
+
+    fn = {"chunk": suite_chunk, "index": suite_index, "retrieve": suite_retrieve, "chat": suite_chat}[args.worker]
+    with use_fakes(dim=args.dim, embed_latency=args.embed_latency, chat_latency=args.chat_latency):
+        result = fn(args)
+    result["peak_rss_mb"] = peak_rss_mb()
+    print(json.dumps(result))
+
+
+# ---- driver ----
+
+def _run_suite(suite: str, workdir: Path, argv: List[str]) -> Dict:
+    env = dict(os.environ,
+               RETRIEVAI_DATA_DIR=str(workdir / "raw"),
+               RETRIEVAI_INDEX_DIR=str(workdir / "index"),
+               OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "benchmark"))
+    proc = subprocess.run([sys.executable, "-m", "benchmarks.run", "--worker", suite, *argv],
+                          env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parents[1]).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--chunks", type=int, nargs="+", default=[1000, 10_000], help="corpus sizes (chunks)")
+    ap.add_argument("--suites", nargs="+", choices=SUITES, default=list(SUITES))
+    ap.add_argument("--modes", nargs="+", choices=("dense", "lexical", "hybrid"), default=["dense", "lexical"])
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--top-k", type=int, default=5)
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--embed-latency", type=float, default=0.0, help="seconds per fake embedding call")
+    ap.add_argument("--chat-latency", type=float, default=0.0, help="seconds per fake completion")
+    ap.add_argument("--chat-concurrency", type=int, default=8)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--workdir", type=Path, help="keep corpora and indexes here (default: a temp dir)")
+    ap.add_argument("--out", type=Path, help="write the JSON report here (default: stdout)")
+    ap.add_argument("--worker", choices=SUITES, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        _worker(args)
+        return
+
+    argv = ["--queries", str(args.queries), "--top-k", str(args.top_k), "--dim", str(args.dim),
+            "--embed-latency", str(args.embed_latency), "--chat-latency", str(args.chat_latency),
+            "--chat-concurrency", str(args.chat_concurrency), "--seed", str(args.seed),
+            "--modes", *args.modes]
+    report = {
+        "meta": {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items() if k != "worker"},
+        },
+        "runs": [],
+    }
+    with contextlib.ExitStack() as stack:
+        base = args.workdir or Path(stack.enter_context(tempfile.TemporaryDirectory(prefix="retrievai-bench-")))
+        for n in args.chunks:
+            workdir = base / f"chunks-{n}"
+            t0 = time.perf_counter()
+            corpus = generate_corpus(workdir / "raw", n, seed=args.seed)
+            corpus["generate_s"] = round(time.perf_counter() - t0, 2)
+            run: Dict = {"chunks": n, "corpus": corpus}
+            # Retrieval and chat need an index, so one is built even if "index" is not reported
+            needs_index = {"retrieve", "chat"} & set(args.suites)
+            for suite in SUITES:
+                if suite in args.suites or (suite == "index" and needs_index):
+                    print(f"[bench] chunks={n} {suite}...", file=sys.stderr)
+                    result = _run_suite(suite, workdir, argv)
+                    if suite in args.suites:
+                        run[suite] = result
+            report["runs"].append(run)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        args.out.write_text(text + "\n", encoding="utf-8")
+        print(f"[bench] Wrote {args.out}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
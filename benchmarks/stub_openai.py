@@ -0,0 +1,133 @@
+"""
+Local stand-in for the OpenAI embeddings and chat completions endpoints,
+with configurable latency. Point the backend at it with OPENAI_BASE_URL.
+Embedding requests can also be failed (every Nth one answers 429 or 503 in
+turn) and answered with rows out of order, to exercise client retries and
+reordering; app.state.embed_log records (inputs, status) per request.
+
+    python -m benchmarks.stub_openai --port 8765 --chat-latency 0.5
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import socket
+import threading
+import time
+import zlib
+import random
+from typing import Dict, Optional
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+
+STREAM_TOKENS = 20
+
+
+def stub_vector(text: str, dim: int) -> np.ndarray:
+    """The embedding the stub returns for text (seeded by its CRC-32)."""
+    rng = np.random.default_rng(zlib.crc32(text.encode("utf-8")))
+    return rng.standard_normal(dim).astype("float32")
+
+
+def make_app(dim: int = 256, embed_latency: float = 0.05, chat_latency: float = 0.5,
+             fail_every: int = 0, shuffle: bool = False) -> FastAPI:
+    app = FastAPI(title="OpenAI stub")
+    # Mutable at runtime, e.g. app.state.fail_every = 1 to fail every request
+    app.state.fail_every = fail_every
+    app.state.shuffle = shuffle
+    app.state.embed_log = []
+
+    @app.post("/v1/embeddings")
+    async def embeddings(body: Dict):
+        await asyncio.sleep(embed_latency)
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        log = app.state.embed_log
+        if app.state.fail_every and (len(log) + 1) % app.state.fail_every == 0:
+            status = 429 if sum(s != 200 for _, s in log) % 2 == 0 else 503
+            log.append((list(inputs), status))
+            return JSONResponse({"error": {"message": "stub failure", "type": "stub", "code": None}},
+                                status_code=status)
+        log.append((list(inputs), 200))
+        data = [{"object": "embedding", "index": i, "embedding": stub_vector(t, dim).tolist()}
+                for i, t in enumerate(inputs)]
+        if app.state.shuffle:
+            random.shuffle(data)
+        return {
+            "object": "list",
+            "model": body.get("model", "stub"),
+            "data": data,
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat(body: Dict):
+        if body.get("stream"):
+            return StreamingResponse(stream_chat(body), media_type="text/event-stream")
+        await asyncio.sleep(chat_latency)
+        return {
+            "id": "stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": f"stub answer ({len(body['messages'])} messages)"},
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    async def stream_chat(body: Dict):
+        # Same total latency as the non-streaming call, spread over the tokens
+        words = [f"stub{i} " for i in range(STREAM_TOKENS)]
+        for i, w in enumerate(words):
+            await asyncio.sleep(chat_latency / len(words))
+            chunk = {
+                "id": "stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "delta": {"content": w},
+                             "finish_reason": "stop" if i == len(words) - 1 else None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve_in_thread(port: int = 0, app: Optional[FastAPI] = None, **app_kwargs) -> str:
+    """Start the stub (or a given make_app() app) on a daemon thread and return its base URL."""
+    port = port or _free_port()
+    app = app or make_app(**app_kwargs)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}/v1"
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--embed-latency", type=float, default=0.05)
+    ap.add_argument("--chat-latency", type=float, default=0.5)
+    ap.add_argument("--fail-every", type=int, default=0, help="fail every Nth embeddings request (429/503)")
+    ap.add_argument("--shuffle", action="store_true", help="return embedding rows out of order")
+    args = ap.parse_args()
+    uvicorn.run(make_app(args.dim, args.embed_latency, args.chat_latency, args.fail_every, args.shuffle),
+                host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -81,9 +81,32 @@ async function api(path, opts = {}) {
 function addMsg(role, content) {
   const el = document.createElement('div');
   el.className = `msg ${role}`;
-  el.innerHTML = `<b>${role}</b>: ${escapeHtml(content)}`;
+  el.innerHTML = `<b>${role}</b>: <span>${escapeHtml(content)}</span>`;
   els.messages.appendChild(el);
   els.messages.scrollTop = els.messages.scrollHeight;
+  return el;
+}
+
+async function readEvents(res, onEvent) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buf += decoder.decode(value, { stream: true });
+    let sep;
+    while ((sep = buf.indexOf('\n\n')) >= 0) {
+      const block = buf.slice(0, sep);
+      buf = buf.slice(sep + 2);
+      let event = 'message', data = '';
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      }
+      if (data) onEvent(event, JSON.parse(data));
+    }
+  }
 }
 
 function setCtx(items) {
@@ -167,7 +190,7 @@ async function send() {
   els.sendBtn.disabled = true;
 
   try {
-    const res = await fetch(`${API_BASE}/chat`, {
+    const res = await fetch(`${API_BASE}/chat/stream`, {
       method: 'POST',
       headers: {
         'Authorization': `Bearer ${auth.token}`,
@@ -179,9 +202,22 @@ async function send() {
         top_k: 5
       })
     });
-    const r = await res.json();
-    addMsg('assistant', r.answer || '(no answer)');
-    setCtx(r.context || []);
+    if (!res.ok) {
+      const err = await res.json().catch(() => ({}));
+      throw new Error(err.detail || `HTTP ${res.status}`);
+    }
+
+    // Server-sent events: context, token..., contacts, done
+    const el = addMsg('assistant', '');
+    const body = el.querySelector('span');
+    let answer = '';
+    await readEvents(res, (event, data) => {
+      if (event === 'context') setCtx(data.context || []);
+      else if (event === 'token' || event === 'contacts') answer += data.text || '';
+      else if (event === 'done') answer = data.answer || answer || '(no answer)';
+      body.textContent = answer;
+      els.messages.scrollTop = els.messages.scrollHeight;
+    });
   } catch (e) {
     addMsg('assistant', 'Error: ' + (e.message || 'Request failed'));
   } finally {
@@ -201,6 +237,16 @@ els.flagBtn.addEventListener('click', () => {
 els.addCancel.addEventListener('click', () => els.addDialog.close());
 
 // ---------------- Document Upload ----------------
+async function waitForJob(jobId) {
+  if (!jobId) return;
+  for (;;) {
+    const job = await api(`/documents/jobs/${jobId}`, { method: 'GET' });
+    if (job.status === 'done') return;
+    if (job.status === 'failed') throw new Error(job.error || 'Re-indexing failed');
+    await new Promise(r => setTimeout(r, 1000));
+  }
+}
+
 els.addSubmit.addEventListener('click', async (e) => {
   e.preventDefault();
   els.addErr.textContent = '⏳ Uploading & processing document...';
@@ -238,7 +284,10 @@ els.addSubmit.addEventListener('click', async (e) => {
       return;
     }
 
+    const r = await res.json();
     els.addErr.style.color = 'green';
+    els.addErr.textContent = '⏳ Document uploaded, re-indexing in background...';
+    await waitForJob(r.job_id);
     els.addErr.textContent = '✅ Document uploaded & indexed successfully.';
     setTimeout(() => els.addDialog.close(), 2000);
 